@@ -0,0 +1,11 @@
+"""
+Offline benchmarks for the replicator.
+
+Importing this package swaps pyodbc for the sqlite backed stand-in in
+bench.fakeodbc, so it must be imported before mssql or dataflow.
+"""
+import sys
+
+from bench import fakeodbc
+
+sys.modules['pyodbc'] = fakeodbc
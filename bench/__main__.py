@@ -0,0 +1,261 @@
+"""
+Replicator benchmark.
+
+Replicates a synthetic table through Dataflow against the sqlite stand-in
+for every combination of batch and commit size, prefetch depth and apply
+strategy and reports rows/sec and peak python memory.  Runs offline.
+
+Each run loads the table, then (except for the insert strategy) updates a
+fraction of the rows and replicates again.  The target must end up
+identical to the source or the run fails, so every strategy goes through
+the same correctness check.
+
+    python -m bench --rows 20000 --width 20 --batch 1000 10000 --commit 500
+
+Use --save to record results and --baseline to fail (exit 1) when a
+combination is slower than the recorded one by more than --tolerance.
+"""
+import bench
+import argparse
+import itertools
+import json
+import sys
+import tempfile
+import time
+import tracemalloc
+from os import path
+
+import pyodbc
+import confighelper as cfgh
+import replicator
+from bench import synthetic
+from checkpoint import CheckpointStore
+from dataflow import Dataflow, Fanout
+from mssql.pool import Pool
+
+
+def jobConfig(workDir, extra, targets=1, mode='rowver',
+              tables=('synthetic',)):
+    """A jobconfig.json equivalent for synthetic tables"""
+    job = {
+        'source': {'connStr':
+                   f"DATABASE={path.join(workDir, 'source.db')};"},
+        'target': {'connStr':
+                   f"DATABASE={path.join(workDir, 'target.db')};"},
+        'tables': [{
+            'source': {'schema': 'dbo', 'name': table},
+            'target': {'schema': 'dbo', 'name': table},
+            'mode': mode,
+        } for table in tables]
+    }
+
+    if targets > 1:
+        job['targets'] = [
+            {'label': f't{i}',
+             'connStr': f"DATABASE={path.join(workDir, f'target{i}.db')};"}
+            for i in range(targets)]
+        del job['target']
+
+    return {
+        'global': dict({
+            'auto': True,
+            'drain': True,
+            'drainSeconds': 0,
+            'checkpoint': path.join(workDir, 'checkpoint.db'),
+            'catalog': path.join(workDir, 'catalog.db'),
+            'lagInterval': 0,
+        }, **extra),
+        'jobs': {'bench': job}
+    }
+
+
+def drain(flow):
+    rowCount = flow.run()
+    while flow.backlog:
+        rowCount += flow.run()
+
+    return rowCount
+
+
+def contents(connection, width, rowver=True):
+    cols = ', '.join(synthetic.columns(width) + (['[rowver]'] if rowver
+                                                 else []))
+    return [tuple(row) for row in connection.execute(
+        f'select {cols} from [dbo].[synthetic] order by [id];').fetchall()]
+
+
+def runOnce(opts, batch, commit, depth, strategy):
+    with tempfile.TemporaryDirectory() as workDir:
+        configF = jobConfig(workDir, {
+            'batch': batch,
+            'commit': commit,
+            'depth': depth,
+            'fast': opts.fast,
+            'columnar': opts.columnar,
+            'passThrough': opts.passThrough,
+            'rowSetBytes': opts.rowSetBytes,
+            'lobChunk': opts.lobChunk,
+            'adaptive': opts.adaptive,
+            'spool': path.join(workDir, 'spool') if opts.spool else None,
+            'strategy': strategy,
+        }, opts.targets, 'changeTracking' if opts.changeTracking else 'rowver')
+        config = cfgh.config(replicator.argParser().parse_args([]), configF)
+        jobName, conf = next(iter(config.jobs.items()))
+
+        src = pyodbc.connect(conf['source']['connStr'])
+        synthetic.createTable(src, 'dbo', 'synthetic', opts.width, opts.lob,
+                              opts.changeTracking)
+        synthetic.insert(src, 'dbo', 'synthetic', 1, opts.rows, opts.width,
+                         opts.lob, opts.seed)
+
+        commons = config.commons
+        store = CheckpointStore(commons['checkpoint'])
+        flow = Fanout if 'targets' in conf else Dataflow
+        pool = Pool(commons['poolSize'], commons['poolCheck'],
+                    commons['shareConnections'])
+        flow = flow(jobName, conf, commons, store, {}, pool)
+
+        tracemalloc.start()
+        started = time.perf_counter()
+        rowCount = drain(flow)
+
+        if strategy != 'insert' and opts.updates:
+            ids = range(1, opts.rows + 1, max(1, int(1 / opts.updates)))
+            synthetic.update(src, 'dbo', 'synthetic', ids, opts.width,
+                             opts.seed)
+            rowCount += drain(flow)
+
+        if opts.changeTracking and opts.deletes:
+            ids = range(1, opts.rows + 1, max(1, int(1 / opts.deletes)))
+            synthetic.delete(src, 'dbo', 'synthetic', ids)
+            rowCount += drain(flow)
+
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        rowver = not opts.changeTracking
+        expected = contents(src, opts.width, rowver)
+        matches = True
+        for target in conf.get('targets', [conf.get('target')]):
+            trgt = pyodbc.connect(target['connStr'])
+            matches = matches and \
+                contents(trgt, opts.width, rowver) == expected
+            trgt.close()
+
+        flow.close()
+        pool.close()
+        store.close()
+        src.close()
+
+        if not matches:
+            raise RuntimeError(f'{strategy}: target does not match source')
+
+        return {
+            'batch': batch,
+            'commit': commit,
+            'depth': depth,
+            'strategy': strategy,
+            'rows': rowCount,
+            'seconds': round(elapsed, 3),
+            'rowsPerSecond': round(rowCount / elapsed, 1),
+            'peakMB': round(peak / 2 ** 20, 2),
+        }
+
+
+def key(result):
+    return f"{result['batch']}/{result['commit']}/{result['depth']}" \
+        f"/{result['strategy']}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Replicator benchmark')
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--width', type=int, default=10)
+    parser.add_argument('--lob', action='store_true',
+                        help='make the last column nvarchar(max)')
+    parser.add_argument('--batch', type=int, nargs='+', default=[10000])
+    parser.add_argument('--commit', type=int, nargs='+', default=[500])
+    parser.add_argument('--depth', type=int, nargs='+', default=[0])
+    parser.add_argument('--strategy', nargs='+', default=['update'],
+                        choices=['update', 'merge', 'delete', 'insert',
+                                 'auto'])
+    parser.add_argument('--updates', type=float, default=0.1,
+                        help='fraction of rows updated after the load')
+    parser.add_argument('--fast', action='store_true')
+    parser.add_argument('--adaptive', action='store_true',
+                        help='let batch and commit adapt, from the given'
+                        ' sizes')
+    parser.add_argument('--columnar', action='store_true',
+                        help='hold row sets by column')
+    parser.add_argument('--passThrough', action='store_true',
+                        help='let the server format datetimeoffset values')
+    parser.add_argument('--rowSetBytes', type=int, default=0,
+                        help='cut row sets at this many estimated bytes')
+    parser.add_argument('--lobChunk', type=int, default=0,
+                        help='stream (max) values in chunks of this many'
+                        ' bytes')
+    parser.add_argument('--spool', action='store_true',
+                        help='buffer row sets in a local spool')
+    parser.add_argument('--targets', type=int, default=1,
+                        help='fan the table out to this many targets')
+    parser.add_argument('--changeTracking', action='store_true',
+                        help='read the source through change tracking')
+    parser.add_argument('--deletes', type=float, default=0.05,
+                        help='fraction of rows deleted after the updates,'
+                        ' with --changeTracking')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--save', help='write results to a json file')
+    parser.add_argument('--baseline', help='json file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed slowdown against the baseline')
+    opts = parser.parse_args(argv)
+
+    print(f'{opts.rows} rows x {opts.width} columns'
+          f'{" (lob)" if opts.lob else ""}'
+          f'{" (columnar)" if opts.columnar else ""}'
+          f'{" (pass-through)" if opts.passThrough else ""}'
+          f'{" (adaptive)" if opts.adaptive else ""}'
+          f'{" (spool)" if opts.spool else ""}'
+          f'{" (change tracking)" if opts.changeTracking else ""}'
+          f'{f" to {opts.targets} targets" if opts.targets > 1 else ""}')
+    print(f'{"batch":>8} {"commit":>8} {"depth":>6} {"strategy":>9}'
+          f' {"rows/s":>10} {"seconds":>8} {"peak MB":>8}')
+
+    results = []
+    for batch, commit, depth, strategy in itertools.product(
+            opts.batch, opts.commit, opts.depth, opts.strategy):
+        result = runOnce(opts, batch, commit, depth, strategy)
+        results.append(result)
+        print(f'{batch:>8} {commit:>8} {depth:>6} {strategy:>9}'
+              f' {result["rowsPerSecond"]:>10} {result["seconds"]:>8}'
+              f' {result["peakMB"]:>8}')
+
+    if opts.save:
+        with open(opts.save, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if opts.baseline:
+        with open(opts.baseline, 'r') as f:
+            baseline = {key(r): r for r in json.load(f)}
+
+        regressions = []
+        for result in results:
+            base = baseline.get(key(result))
+            if base and result['rowsPerSecond'] < \
+                    base['rowsPerSecond'] * (1 - opts.tolerance):
+                regressions.append(f"{key(result)}:"
+                                   f" {result['rowsPerSecond']} rows/s,"
+                                   f" baseline {base['rowsPerSecond']}")
+
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
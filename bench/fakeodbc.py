@@ -0,0 +1,800 @@
+"""
+A sqlite backed stand-in for the parts of pyodbc used by the replicator.
+
+Each DATABASE in a connection string is a sqlite file.  The T-SQL the
+replicator emits is recognised by shape and translated: [schema].[name]
+becomes the table "schema.name", #temp tables become sqlite temp tables,
+timestamp (rowversion) columns are maintained by triggers from a database
+wide counter, and sys.objects / INFORMATION_SCHEMA lookups are answered
+from a metadata table filled in by the DDL handlers.
+
+Change tracking is emulated the same way: enabling it on a table adds a
+"__ct.schema.name" log keyed by pk that triggers keep up to date with the
+last version and operation of each row, and CHANGETABLE(CHANGES ...) reads
+from that log.
+
+Install it with sys.modules['pyodbc'] = fakeodbc before importing mssql.
+"""
+import re
+import sqlite3
+import threading
+import zlib
+from datetime import datetime
+
+
+version = 'fake'
+
+SQL_WVARCHAR = -9
+SQL_WLONGVARCHAR = -10
+SQL_VARBINARY = -3
+SQL_BINARY = -2
+
+
+class Error(Exception):
+    pass
+
+
+def rowverBytes(value):
+    return int(value).to_bytes(8, 'big')
+
+
+def dataLength(value):
+    """datalength, strings are taken as nvarchar"""
+    if value is None:
+        return None
+
+    if isinstance(value, str):
+        return len(value.encode('utf-16-le'))
+
+    return len(value)
+
+
+def binaryChecksum(*values):
+    """A signed 32 bit hash of a row, like binary_checksum"""
+    checksum = zlib.crc32(repr(values).encode())
+    return checksum - 2 ** 32 if checksum >= 2 ** 31 else checksum
+
+
+class ChecksumAgg:
+    """checksum_agg, xor of the values"""
+
+    def __init__(self):
+        self.value = None
+
+    def step(self, value):
+        if value is not None:
+            self.value = (self.value or 0) ^ value
+
+    def finalize(self):
+        return self.value
+
+
+class CountBig:
+
+    def __init__(self):
+        self.value = 0
+
+    def step(self, *values):
+        self.value += 1
+
+    def finalize(self):
+        return self.value
+
+
+def now():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')
+
+
+def connect(connStr, autocommit=False):
+    parts = dict(p.split('=', 1) for p in connStr.split(';') if '=' in p)
+    return Connection(parts['DATABASE'], autocommit)
+
+
+class Row(tuple):
+    """Tuple with attribute access by column name, like pyodbc.Row"""
+
+    def __new__(cls, values, names):
+        row = tuple.__new__(cls, values)
+        row._names = names
+        return row
+
+    def __getattr__(self, name):
+        try:
+            return self[self._names[name]]
+        except KeyError:
+            raise AttributeError(name)
+
+
+class Connection:
+
+    def __init__(self, database, autocommit=False):
+        self.database = database
+        self.autocommit = autocommit
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(database, timeout=60,
+                                   check_same_thread=False,
+                                   isolation_level=None)
+        self._db.create_function('rv', 1, rowverBytes)
+        self._db.create_function('binary_checksum', -1, binaryChecksum)
+        self._db.create_function('datalength', 1, dataLength)
+        self._db.create_aggregate('checksum_agg', 1, ChecksumAgg)
+        self._db.create_aggregate('count_big', -1, CountBig)
+        self._db.execute('pragma journal_mode=wal;')
+        self._db.execute('pragma synchronous=off;')
+        self._db.executescript("""
+            create table if not exists __rowver (value integer);
+            insert into __rowver (value)
+                select 0 where not exists (select 1 from __rowver);
+            create table if not exists __ctversion (value integer);
+            insert into __ctversion (value)
+                select 0 where not exists (select 1 from __ctversion);
+            create table if not exists __ctmin (
+                name text primary key,
+                version integer
+            );
+            create table if not exists __objects (
+                name text primary key,
+                schemaName text,
+                tableName text,
+                modifyDate text
+            );
+            create table if not exists __columns (
+                name text,
+                ordinal integer,
+                columnName text,
+                nullable text,
+                dataType text,
+                maxLength integer,
+                numPrecision integer,
+                numScale integer,
+                pkOrdinal integer
+            );
+        """)
+        self._inTran = False
+        self.closed = False
+
+    def add_output_converter(self, sqlType, func):
+        pass
+
+    def cursor(self):
+        return Cursor(self)
+
+    def begin(self):
+        if not self.autocommit and not self._inTran:
+            self._db.execute('begin;')
+            self._inTran = True
+
+    def commit(self):
+        if self._inTran:
+            self._db.execute('commit;')
+            self._inTran = False
+
+    def rollback(self):
+        if self._inTran:
+            self._db.execute('rollback;')
+            self._inTran = False
+
+    def close(self):
+        if not self.closed:
+            self.rollback()
+            self._db.close()
+            self.closed = True
+
+    def execute(self, query, *params):
+        cursor = self.cursor()
+        cursor.execute(query, *params)
+        return cursor
+
+
+class Cursor:
+
+    def __init__(self, connection):
+        self.connection = connection
+        self._db = connection._db
+        self.fast_executemany = False
+        self.rowcount = -1
+        self.description = None
+        self._results = []
+        self._current = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None and not self.connection.autocommit:
+            self.connection.commit()
+        self.close()
+
+    def setinputsizes(self, sizes):
+        pass
+
+    def close(self):
+        self._current = None
+        self._results = []
+
+    def commit(self):
+        self.connection.commit()
+
+    # results ---------------------------------------------------------------
+
+    def _setResult(self, result):
+        self._current = result
+        if result is None:
+            self.description = None
+            self.rowcount = -1
+            return
+
+        cursor, names, rowcount = result
+        self.rowcount = rowcount
+        self.description = [(n,) for n in names] if names else None
+
+    def _row(self, values):
+        return Row(values, self._current[1])
+
+    def fetchone(self):
+        if self._current is None or self._current[0] is None:
+            raise Error('No results.  Previous SQL was not a query.')
+
+        values = self._current[0].fetchone()
+        return self._row(values) if values is not None else None
+
+    def fetchval(self):
+        row = self.fetchone()
+        return row[0] if row is not None else None
+
+    def fetchmany(self, count=1):
+        if self._current is None or self._current[0] is None:
+            raise Error('No results.  Previous SQL was not a query.')
+
+        return [self._row(v) for v in self._current[0].fetchmany(count)]
+
+    def fetchall(self):
+        if self._current is None or self._current[0] is None:
+            raise Error('No results.  Previous SQL was not a query.')
+
+        return [self._row(v) for v in self._current[0].fetchall()]
+
+    def nextset(self):
+        if not self._results:
+            self._setResult(None)
+            return False
+
+        self._setResult(self._results.pop(0))
+        return True
+
+    def __iter__(self):
+        while True:
+            row = self.fetchone()
+            if row is None:
+                return
+            yield row
+
+    # execution -------------------------------------------------------------
+
+    def execute(self, query, *params):
+        if len(params) == 1 and isinstance(params[0], (tuple, list)):
+            params = tuple(params[0])
+
+        with self.connection._lock:
+            results = Emulator(self.connection).run(query, list(params))
+
+        self._results = results[1:]
+        self._setResult(results[0] if results else None)
+        return self
+
+    def executemany(self, query, seqOfParams):
+        with self.connection._lock:
+            Emulator(self.connection).runMany(query, seqOfParams)
+
+        self._results = []
+        self._setResult(None)
+
+
+class ListResult:
+    """Cursor-like access to a list of tuples"""
+
+    def __init__(self, values):
+        self._values = list(values)
+
+    def fetchone(self):
+        return self._values.pop(0) if self._values else None
+
+    def fetchmany(self, count):
+        out, self._values = self._values[:count], self._values[count:]
+        return out
+
+    def fetchall(self):
+        out, self._values = self._values, []
+        return out
+
+
+def ident(sql):
+    """Translates T-SQL identifiers to sqlite"""
+    sql = re.sub(r'\[([^\]]+)\]\.\[([^\]]+)\]', r'"\1.\2"', sql)
+    sql = re.sub(r'\[([^\]]+)\]', r'"\1"', sql)
+    sql = re.sub(r'(?<!["\w])#(\w+)', r'"#\1"', sql)
+    return sql
+
+
+def objectName(name):
+    """[s].[t] / s.t / #t -> name used in sqlite"""
+    name = name.strip().strip("'")
+    if name.startswith('tempdb..'):
+        name = name[len('tempdb..'):]
+
+    parts = re.findall(r'\[([^\]]+)\]|([^.\[\]]+)', name)
+    parts = [a or b for a, b in parts]
+    return '.'.join(parts)
+
+
+def splitStatements(sql):
+    return [s.strip() for s in sql.split(';') if s.strip()]
+
+
+def parseType(typeSql):
+    """'nvarchar (max)' -> (dataType, maxLength, precision, scale)"""
+    m = re.match(r'\s*(\w+)\s*(?:\(\s*([\w-]+)\s*(?:,\s*(\d+)\s*)?\))?',
+                 typeSql)
+    base = m.group(1).lower()
+    size = m.group(2)
+    scale = m.group(3)
+
+    if base in ('numeric', 'decimal'):
+        return base, None, int(size or 18), int(scale or 0)
+
+    if size is not None:
+        length = -1 if size.lower() == 'max' else int(size)
+        return base, length, None, None
+
+    precision = {'tinyint': 3, 'smallint': 5, 'int': 10,
+                 'bigint': 19, 'float': 53, 'real': 24}.get(base)
+    return base, None, precision, 0 if precision else None
+
+
+def splitDefs(defs):
+    """Splits column definitions on top level commas"""
+    out, depth, cur = [], 0, ''
+    for ch in defs:
+        if ch == '(':
+            depth += 1
+        elif ch == ')':
+            depth -= 1
+
+        if ch == ',' and depth == 0:
+            out.append(cur.strip())
+            cur = ''
+        else:
+            cur += ch
+
+    if cur.strip():
+        out.append(cur.strip())
+
+    return out
+
+
+class Emulator:
+    """Executes one T-SQL batch against a sqlite connection"""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.db = connection._db
+
+    # entry points ----------------------------------------------------------
+
+    def run(self, query, params):
+        # imported late, mssql.table imports pyodbc (this module)
+        from mssql.table import templates
+
+        for name, template in templates.items():
+            if query == template:
+                return [getattr(self, f'template_{name}')(*params)]
+
+        flat = ' '.join(query.split())
+        results = []
+        for stmt in splitStatements(flat):
+            count = stmt.count('?')
+            stmtParams, params = params[:count], params[count:]
+            result = self.statement(stmt, stmtParams)
+            if result is not None:
+                results.append(result)
+
+        return results
+
+    def runMany(self, query, seqOfParams):
+        flat = ' '.join(query.split())
+        stmt = splitStatements(flat)[0]
+        m = re.match(r'insert (?:into )?(\S+) \((.*?)\) values', stmt, re.I)
+        if m:
+            sql = ident(f'insert into {m.group(1)} ({m.group(2)})'
+                        f' values ({", ".join("?" * stmt.count("?"))})')
+        elif re.match(r'(update|delete)\b', stmt, re.I):
+            sql = ident(stmt)
+        else:
+            raise Error(f'executemany not emulated: {stmt}')
+
+        self.connection.begin()
+        self.db.executemany(sql, [tuple(p) for p in seqOfParams])
+
+    def query(self, sql, params=()):
+        cursor = self.db.execute(sql, params)
+        names = {d[0]: i for i, d in enumerate(cursor.description or [])}
+        return (cursor, names, -1)
+
+    def rows(self, names, values):
+        """Result for rows computed in python"""
+        return (ListResult(values), {n: i for i, n in enumerate(names)}, -1)
+
+    def dml(self, sql, params=()):
+        self.connection.begin()
+        cursor = self.db.execute(sql, params)
+        return (None, None, cursor.rowcount)
+
+    # catalog ---------------------------------------------------------------
+
+    def columnsOf(self, name):
+        return self.db.execute(
+            """select ordinal, columnName, nullable, dataType, maxLength,
+                      numPrecision, numScale, pkOrdinal
+               from __columns where name = ? order by ordinal;""",
+            (name,)).fetchall()
+
+    def template_tableSchema(self, schemaName, tableName):
+        cols = self.columnsOf(f'{schemaName}.{tableName}')
+        return self.rows(
+            ['ORDINAL_POSITION', 'COLUMN_NAME', 'IS_NULLABLE', 'DATA_TYPE',
+             'CHARACTER_MAXIMUM_LENGTH', 'NUMERIC_PRECISION',
+             'NUMERIC_SCALE'],
+            [c[:7] for c in cols])
+
+    def template_tableColumns(self, schemaName, tableName):
+        cols = self.columnsOf(f'{schemaName}.{tableName}')
+        cols = sorted(cols, key=lambda c: (c[7] is not None, c[7] or 0,
+                                           c[0]))
+        return self.rows(['COLUMN_NAME'], [(c[1],) for c in cols])
+
+    def template_tablePk(self, schemaName, tableName):
+        cols = self.columnsOf(f'{schemaName}.{tableName}')
+        cols = sorted([c for c in cols if c[7] is not None],
+                      key=lambda c: c[7])
+        return self.rows(['COLUMN_NAME'], [(c[1],) for c in cols])
+
+    def template_catalogDates(self):
+        return self.query(
+            """select schemaName as TABLE_SCHEMA, tableName as TABLE_NAME,
+                      modifyDate as MODIFY_DATE
+               from __objects;""")
+
+    def template_catalog(self, since):
+        return self.query(
+            """select o.schemaName as TABLE_SCHEMA,
+                      o.tableName as TABLE_NAME,
+                      c.ordinal as ORDINAL_POSITION,
+                      c.columnName as COLUMN_NAME,
+                      c.nullable as IS_NULLABLE,
+                      c.dataType as DATA_TYPE,
+                      c.maxLength as CHARACTER_MAXIMUM_LENGTH,
+                      c.numPrecision as NUMERIC_PRECISION,
+                      c.numScale as NUMERIC_SCALE,
+                      c.pkOrdinal as PK_ORDINAL
+               from __objects o
+               inner join __columns c on c.name = o.name
+               where o.modifyDate >= ?
+               order by o.schemaName, o.tableName, c.ordinal;""",
+            (str(since),))
+
+    # statements ------------------------------------------------------------
+
+    def statement(self, stmt, params):
+        low = stmt.lower()
+
+        if low.startswith('set transaction') or low.startswith('declare'):
+            return None
+
+        m = re.match(r"select objectid = object_id\(\?\)$", low)
+        if m:
+            found = self.db.execute(
+                'select 1 from __objects where name = ?;',
+                (objectName(params[0]),)).fetchone()
+            return self.rows(['objectID'], [(1 if found else None,)])
+
+        m = re.match(r"select modify_date from sys.objects"
+                     r" where object_id = object_id\(\?\)$", low)
+        if m:
+            found = self.db.execute(
+                'select modifyDate from __objects where name = ?;',
+                (objectName(params[0]),)).fetchone()
+            return self.rows(['modify_date'], [(found[0] if found else None,)])
+
+        m = re.match(r"if object_id\('([^']+)'\) is not null drop table (.+)$",
+                     stmt, re.I)
+        if m:
+            name = objectName(m.group(1))
+            self.db.execute(f'drop table if exists temp."{name}";')
+            return None
+
+        m = re.match(r"if object_id\('([^']+)'\) is null (create table .+)$",
+                     stmt, re.I)
+        if m:
+            exists = self.db.execute(
+                'select 1 from __objects where name = ?;',
+                (objectName(m.group(1)),)).fetchone()
+            if not exists:
+                self.createTable(m.group(2))
+            return None
+
+        if low.startswith('create table'):
+            self.createTable(stmt)
+            return None
+
+        if re.match(r"alter database .+ set change_tracking", low):
+            return None
+
+        m = re.match(r"alter table (.+?) enable change_tracking", stmt, re.I)
+        if m:
+            self.enableChangeTracking(objectName(m.group(1)))
+            return None
+
+        if low == 'select version = change_tracking_current_version()':
+            return self.query('select value as version from __ctversion;')
+
+        if low == ('select version = change_tracking_min_valid_version('
+                   'object_id(?))'):
+            return self.query('select version from __ctmin where name = ?;',
+                              (objectName(params[0]),))
+
+        m = re.search(r"changetable\(changes (\S+), \?\) as ct", stmt, re.I)
+        if m:
+            stmt = f'{stmt[:m.start()]}(select * from' \
+                f' "__ct.{objectName(m.group(1))}"' \
+                f' where SYS_CHANGE_VERSION > ?) as ct{stmt[m.end():]}'
+            low = stmt.lower()
+
+        m = re.match(r"select sum\(row_count\) from sys.dm_db_partition_stats"
+                     r" where object_id = object_id\(\?\) and index_id < 2$",
+                     low)
+        if m:
+            return self.query(f'select count(*)'
+                              f' from "{objectName(params[0])}";')
+
+        if 'from sys.index_columns' in low:
+            return self.rows([''], [(self.rowverIndexed(
+                objectName(params[0])),)])
+
+        m = re.match(r"create (?:nonclustered )?index (.+)$", stmt, re.I)
+        if m:
+            self.db.execute(ident(f'create index {m.group(1)};'))
+            return None
+
+        # the server formats datetimeoffset values, they are stored as
+        # strings here already
+        stmt = re.sub(r"convert\(nvarchar\(34\), (\S+), 121\)", r"\1", stmt,
+                      flags=re.I)
+        low = stmt.lower()
+
+        m = re.search(r" tablesample \([\d.]+ percent\)", stmt, re.I)
+        if m:
+            # sqlite can't sample pages, read the whole table
+            stmt = stmt[:m.start()] + stmt[m.end():]
+            low = stmt.lower()
+
+        m = re.match(r"alter table (.+?) add (\[[^\]]+\]|\w+) (.+?)"
+                     r"(?: (not )?null)?$", stmt, re.I)
+        if m:
+            self.addColumn(objectName(m.group(1)), m.group(2).strip('[]'),
+                           m.group(3), m.group(4) is None)
+            return None
+
+        m = re.match(r"update (\S+) set (\S+)\.write\(\?, \?, null\)"
+                     r" where (.+)$", stmt, re.I)
+        if m:
+            # replaces the value from the offset on with the chunk
+            table, col, where = (ident(g) for g in m.groups())
+            return self.dml(f'update {table}'
+                            f' set {col} = substr({col}, 1, ?2) || ?1'
+                            f' where {where};', params)
+
+        m = re.match(r"truncate table (.+)$", stmt, re.I)
+        if m:
+            return self.dml(f'delete from {ident(m.group(1))};')
+
+        m = re.match(r"update t set (.+) output (.+) into (\S+) \((.+?)\)"
+                     r" from (\S+) t inner join (\S+) s on (.+)$", stmt, re.I)
+        if m:
+            return self.updateOutput(*m.groups())
+
+        m = re.match(r"merge (\S+) with \(holdlock\) as t using (\S+) as s"
+                     r" on (.+?)(?: when matched then update set (.+?))?"
+                     r" when not matched by target then"
+                     r" insert \((.+?)\) values \((.+?)\)$", stmt, re.I)
+        if m:
+            return self.merge(*m.groups())
+
+        m = re.match(r"delete t from (\S+) t inner join (\S+) s on (.+)$",
+                     stmt, re.I)
+        if m:
+            table, staging, join = m.groups()
+            return self.dml(f'delete from {ident(table)} as t where exists'
+                            f' (select 1 from {ident(staging)} s'
+                            f' where {ident(join)});')
+
+        m = re.match(r"select rowver = max\(rowver\) from (.+)$", stmt, re.I)
+        if m:
+            return self.query(f'select max(rowver) as rowver'
+                              f' from {ident(m.group(1))};')
+
+        m = re.match(r"select top \((\?|\d+)\) (.+)$", stmt, re.I)
+        if m:
+            if m.group(1) == '?':
+                params = params[1:] + params[:1]
+                limit = '?'
+            else:
+                limit = m.group(1)
+            return self.query(f'select {ident(m.group(2))} limit {limit};',
+                              params)
+
+        if low.startswith('select'):
+            return self.query(ident(stmt) + ';', params)
+
+        m = re.match(r"insert (?!into )(.+)$", stmt, re.I)
+        if m:
+            stmt = f'insert into {m.group(1)}'
+
+        if re.match(r"(insert|update|delete)\b", stmt, re.I):
+            return self.dml(ident(stmt) + ';', params)
+
+        raise Error(f'Statement not emulated: {stmt}')
+
+    # ddl -------------------------------------------------------------------
+
+    def createTable(self, stmt):
+        m = re.match(r"create table (.+?)\s*\((.*)\)$", stmt, re.I)
+        name = objectName(m.group(1))
+        temp = name.startswith('#')
+
+        cols, pk = [], []
+        for part in splitDefs(m.group(2)):
+            pkm = re.match(r"primary key(?: clustered)?\s*\((.+)\)$",
+                           part, re.I)
+            if pkm:
+                pk = [c.strip().strip('[]') for c in pkm.group(1).split(',')]
+                continue
+
+            cm = re.match(r"(\[[^\]]+\]|\w+)\s+(.+?)(?:\s+(not\s+)?null)?$",
+                          part, re.I)
+            cols.append((cm.group(1).strip('[]'), cm.group(2),
+                         cm.group(3) is None))
+
+        colSql = ', '.join(f'"{c}"' for c, _, _ in cols)
+        pkSql = ', '.join(f'"{c}"' for c in pk)
+        pkSql = f', primary key ({pkSql})' if pk else ''
+        self.db.execute(f'create {"temp " if temp else ""}table'
+                        f' "{name}" ({colSql}{pkSql});')
+
+        if temp:
+            return
+
+        schemaName, tableName = name.split('.', 1)
+        self.db.execute(
+            'insert or replace into __objects values (?, ?, ?, ?);',
+            (name, schemaName, tableName, now()))
+        self.db.execute('delete from __columns where name = ?;', (name,))
+        for ordinal, (col, typeSql, nullable) in enumerate(cols, 1):
+            self.columnMeta(name, ordinal, col, typeSql,
+                            nullable and col not in pk,
+                            pk.index(col) + 1 if col in pk else None)
+
+        self.rowverTriggers(name, cols)
+
+    def addColumn(self, name, col, typeSql, nullable):
+        self.db.execute(f'alter table "{name}" add column "{col}";')
+        ordinal = self.db.execute(
+            'select coalesce(max(ordinal), 0) + 1 from __columns'
+            ' where name = ?;', (name,)).fetchone()[0]
+        self.columnMeta(name, ordinal, col, typeSql, nullable, None)
+        self.db.execute('update __objects set modifyDate = ? where name = ?;',
+                        (now(), name))
+
+    def columnMeta(self, name, ordinal, col, typeSql, nullable, pkOrdinal):
+        dataType, length, precision, scale = parseType(typeSql)
+        self.db.execute(
+            'insert into __columns values (?, ?, ?, ?, ?, ?, ?, ?, ?);',
+            (name, ordinal, col, 'YES' if nullable else 'NO', dataType,
+             length, precision, scale, pkOrdinal))
+
+    def rowverTriggers(self, name, cols):
+        """timestamp columns get the next database rowversion on write"""
+        for col, typeSql, _ in cols:
+            if parseType(typeSql)[0] not in ('timestamp', 'rowversion'):
+                continue
+
+            for event in ('insert', 'update'):
+                self.db.execute(f"""
+                    create trigger "{name}_{col}_{event}"
+                    after {event} on "{name}"
+                    begin
+                        update __rowver set value = value + 1;
+                        update "{name}"
+                        set "{col}" = rv((select value from __rowver))
+                        where rowid = new.rowid;
+                    end;
+                """)
+
+    def enableChangeTracking(self, name):
+        """Logs the last change of each pk of name from now on"""
+        pk = [c[1] for c in sorted(self.columnsOf(name),
+                                   key=lambda c: c[7] or 0)
+              if c[7] is not None]
+        if not pk:
+            raise Error(f'change tracking needs a primary key: {name}')
+
+        log = f'__ct.{name}'
+        pkSql = ', '.join(f'"{c}"' for c in pk)
+        self.db.execute(f'create table "{log}" (SYS_CHANGE_VERSION integer,'
+                        f' SYS_CHANGE_OPERATION text, {pkSql},'
+                        f' primary key ({pkSql}));')
+        self.db.execute(
+            'insert or replace into __ctmin'
+            ' select ?, value from __ctversion;', (name,))
+
+        for event, op, ref in (('insert', 'I', 'new'), ('update', 'U', 'new'),
+                               ('delete', 'D', 'old')):
+            self.db.execute(f"""
+                create trigger "{log}_{event}"
+                after {event} on "{name}"
+                begin
+                    update __ctversion set value = value + 1;
+                    insert or replace into "{log}"
+                    select value, '{op}',
+                        {', '.join(f'{ref}."{c}"' for c in pk)}
+                    from __ctversion;
+                end;
+            """)
+
+    def rowverIndexed(self, name):
+        """1 if an index of name leads on rowver"""
+        for index in self.db.execute(f'pragma index_list("{name}");'):
+            info = self.db.execute(
+                f'pragma index_info("{index[1]}");').fetchall()
+            if info and min(info)[2] == 'rowver':
+                return 1
+
+        return 0
+
+    # dml -------------------------------------------------------------------
+
+    def updateOutput(self, setSql, outputSql, outTable, outCols, table,
+                     staging, joinSql):
+        """
+        update t set ... output inserted.pk into #out (pk)
+        from table t inner join #staging s on ...
+        """
+        setSql = re.sub(r'\bt\.(\[[^\]]+\])', r'\1', setSql)
+        outCols = ident(outCols)
+        keys = ', '.join(f's.{c}' for c in
+                         ident(outputSql.replace('inserted.', '')).split(', '))
+        join = ident(joinSql)
+
+        self.connection.begin()
+        self.db.execute(
+            f'insert into {ident(outTable)} ({outCols})'
+            f' select {keys} from {ident(staging)} s'
+            f' inner join {ident(table)} t on {join};')
+        cursor = self.db.execute(
+            f'update {ident(table)} as t set {ident(setSql)}'
+            f' from {ident(staging)} as s where {join};')
+        return (None, None, cursor.rowcount)
+
+    def merge(self, table, staging, joinSql, setSql, insertCols, values):
+        """merge ... using #staging as an upsert on the pk"""
+        pk = re.findall(r's\.(\[[^\]]+\]) = t\.', joinSql)
+        if setSql:
+            sets = re.sub(r'(\[[^\]]+\]) = s\.(\[[^\]]+\])',
+                          r'\1 = excluded.\2', setSql)
+            conflict = f'do update set {ident(sets)}'
+        else:
+            conflict = 'do nothing'
+
+        return self.dml(
+            f'insert into {ident(table)} ({ident(insertCols)})'
+            f' select {ident(values)} from {ident(staging)} s where true'
+            f' on conflict ({ident(", ".join(pk))}) {conflict};')
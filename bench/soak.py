@@ -0,0 +1,418 @@
+"""
+Replication lag soak test.
+
+Runs the full replicator.main scheduler, with its worker processes, against
+synthetic source tables that keep changing, using the sqlite stand-in for
+pyodbc.  Once the initial rows are replicated, a writer inserts and updates
+rows at --rate changes per second per table for --seconds.  Halfway through
+it inserts a --burst of rows into every table at once.
+
+Each write is timed from its commit on the source until the target's
+max(rowver) reaches it, polled every --probe seconds.  The report gives the
+end-to-end lag percentiles of the steady writes, the time to catch up with
+the burst and the resident memory of the workers, sampled every --sample
+seconds.
+
+    python -m bench.soak --tables 4 --rate 200 --seconds 60 --burst 20000
+
+Exits 1 when the target has not caught up --timeout seconds after the
+writes stop.
+"""
+import bench
+import argparse
+import json
+import logging
+import multiprocessing as mp
+import os
+import random
+import signal
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from os import path
+
+import pyodbc
+import replicator
+from bench import synthetic
+from bench.__main__ import jobConfig
+from mssql.table import Table as sqlTable
+
+
+def supervise(configF, argv, logQ, debug):
+    """Runs replicator.main as replicator.py does, in its own process"""
+    logging.basicConfig(level=logging.DEBUG if debug else logging.WARNING,
+                        format='%(asctime)s %(message)s')
+    replicator.rLog = logging.getLogger('replicator')
+    threading.Thread(target=replicator.logger_thread, args=(logQ,),
+                     daemon=True).start()
+    replicator.main(replicator.argParser().parse_args(argv), logQ, configF)
+
+
+def workerMemory(pid):
+    """Resident MB of each child process of pid, empty without /proc"""
+    if not path.isdir('/proc'):
+        return {}
+
+    rss = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+
+        try:
+            with open(f'/proc/{entry}/status', 'r') as f:
+                status = dict(line.split(':', 1) for line in f if ':' in line)
+        except OSError:
+            continue
+
+        if int(status['PPid']) == pid:
+            rss[int(entry)] = int(status.get('VmRSS', '0 kB').split()[0]) \
+                / 1024
+
+    return rss
+
+
+def percentile(values, p):
+    """Nearest rank percentile, None for no values"""
+    if not values:
+        return None
+
+    values = sorted(values)
+    return values[max(0, -(-len(values) * p // 100) - 1)]
+
+
+class Writer:
+    """
+    Changes the source tables and remembers when each change committed and
+    the source max(rowver) it left behind.
+    """
+
+    def __init__(self, connStr, tables, width, rows, updates, seed=0):
+        self._connection = pyodbc.connect(connStr)
+        self._width = width
+        self._updates = updates
+        self._random = random.Random(seed)
+        self._seed = seed
+        self._next = {table: rows + 1 for table in tables}
+        self._tables = {table: sqlTable(connection=self._connection,
+                                        schemaName='dbo', tableName=table)
+                        for table in tables}
+        self._lock = threading.Lock()
+        self.pending = {table: deque() for table in tables}
+
+    def write(self, table, count, burst=False):
+        """Inserts and updates count rows of table, one commit each"""
+        updates = int(count * self._updates) if not burst else 0
+        inserts = count - updates
+
+        if inserts:
+            synthetic.insert(self._connection, 'dbo', table,
+                             self._next[table], inserts, self._width,
+                             seed=self._seed)
+            self._next[table] += inserts
+
+        if updates:
+            ids = [self._random.randrange(1, self._next[table])
+                   for _ in range(updates)]
+            synthetic.update(self._connection, 'dbo', table, ids,
+                             self._width, self._random.random())
+
+        committed = time.time()
+        rowver = self._tables[table].rowver()
+        with self._lock:
+            self.pending[table].append((committed, rowver, burst))
+
+    def resolve(self, table, rowver, now):
+        """
+        Pops the writes of table the target reached, returns their
+        (lag, burst) pairs.
+        """
+        resolved = []
+        with self._lock:
+            queue = self.pending[table]
+            while queue and rowver is not None and queue[0][1] <= rowver:
+                committed, _, burst = queue.popleft()
+                resolved.append((now - committed, burst))
+
+        return resolved
+
+    def oldest(self, now):
+        """Age of the oldest write the target has not reached"""
+        with self._lock:
+            ages = [max(0, now - queue[0][0])
+                    for queue in self.pending.values() if queue]
+
+        return max(ages, default=0)
+
+    def behind(self):
+        with self._lock:
+            return sum(len(queue) for queue in self.pending.values())
+
+    def close(self):
+        self._connection.close()
+
+
+class Monitor(threading.Thread):
+    """Polls the target watermarks and samples worker memory"""
+
+    def __init__(self, writer, connStr, tables, pid, probe, sample):
+        super().__init__(daemon=True)
+        self._writer = writer
+        self._connection = pyodbc.connect(connStr)
+        self._tables = {table: sqlTable(connection=self._connection,
+                                        schemaName='dbo', tableName=table)
+                        for table in tables}
+        self._pid = pid
+        self._probe = probe
+        self._sample = sample
+        self._done = threading.Event()
+        self.started = time.time()
+        self.lags = []
+        self.burstLags = []
+        self.samples = []
+
+    def run(self):
+        nextSample = self.started
+        while not self._done.is_set():
+            now = time.time()
+            for table, trgtTable in self._tables.items():
+                for lag, burst in self._writer.resolve(
+                        table, trgtTable.rowver(), now):
+                    (self.burstLags if burst else self.lags).append(lag)
+
+            if now >= nextSample:
+                rss = workerMemory(self._pid)
+                sample = {
+                    'seconds': round(now - self.started, 1),
+                    'lag': round(self._writer.oldest(now), 3),
+                    'behind': self._writer.behind(),
+                    'workers': len(rss),
+                    'rssMB': round(sum(rss.values()), 1),
+                    'maxWorkerMB': round(max(rss.values(), default=0), 1),
+                }
+                self.samples.append(sample)
+                print(f"{sample['seconds']:>8} {sample['lag']:>8}"
+                      f" {sample['behind']:>8} {sample['workers']:>8}"
+                      f" {sample['rssMB']:>10} {sample['maxWorkerMB']:>10}")
+                nextSample += self._sample
+
+            self._done.wait(self._probe)
+
+    def stop(self):
+        self._done.set()
+        self.join()
+        self._connection.close()
+
+
+def caughtUp(source, target, tables):
+    """True once every target table reached its source max(rowver)"""
+    for table in tables:
+        try:
+            trgtRowver = sqlTable(connection=target, schemaName='dbo',
+                                  tableName=table).rowver()
+        except Exception:
+            return False  # not created yet
+
+        srcRowver = sqlTable(connection=source, schemaName='dbo',
+                             tableName=table).rowver()
+        if trgtRowver is None or trgtRowver < srcRowver:
+            return False
+
+    return True
+
+
+def wait(until, timeout, interval=0.1):
+    """Seconds until until() held, None after timeout"""
+    started = time.time()
+    while time.time() - started < timeout:
+        if until():
+            return time.time() - started
+        time.sleep(interval)
+
+    return None
+
+
+def soak(opts, workDir):
+    tables = [f'soak{i}' for i in range(opts.tables)]
+    configF = jobConfig(workDir, {
+        'batch': opts.batch,
+        'commit': opts.commit,
+        'idleMin': opts.idleMin,
+        'idleMax': opts.idleMax,
+        'spool': path.join(workDir, 'spool') if opts.spool else None,
+    }, tables=tables)
+    job = configF['jobs']['bench']
+    srcConnStr = job['source']['connStr']
+    trgtConnStr = job['target']['connStr']
+
+    source = pyodbc.connect(srcConnStr)
+    for i, table in enumerate(tables):
+        synthetic.createTable(source, 'dbo', table, opts.width)
+        synthetic.insert(source, 'dbo', table, 1, opts.rows, opts.width,
+                         seed=opts.seed + i)
+
+    argv = ['-p', str(opts.proc)] + (['-d'] if opts.debug else [])
+    logQ = mp.Queue()
+    supervisor = mp.Process(target=supervise, name='replicator',
+                            args=(configF, argv, logQ, opts.debug))
+    supervisor.start()
+
+    target = pyodbc.connect(trgtConnStr)
+    writer = None
+    monitor = None
+    try:
+        initial = wait(lambda: caughtUp(source, target, tables),
+                       opts.timeout)
+        if initial is None:
+            print(f'initial load not replicated in {opts.timeout}s')
+            return None
+
+        print(f'initial load: {opts.tables} x {opts.rows} rows in'
+              f' {initial:.1f}s')
+        print(f'{"seconds":>8} {"lag":>8} {"behind":>8} {"workers":>8}'
+              f' {"rss MB":>10} {"max MB":>10}')
+
+        writer = Writer(srcConnStr, tables, opts.width, opts.rows,
+                        opts.updates, opts.seed)
+        monitor = Monitor(writer, trgtConnStr, tables, supervisor.pid,
+                          opts.probe, opts.sample)
+        monitor.start()
+
+        # carry the fractions of a change so low rates still write
+        owed = 0.0
+        burstAt = monitor.started + opts.seconds / 2
+        burst = None
+        tick = monitor.started
+        while time.time() - monitor.started < opts.seconds:
+            tick += opts.tick
+            owed += opts.rate * opts.tick
+            count = int(owed)
+            owed -= count
+            if count:
+                for table in tables:
+                    writer.write(table, count)
+
+            if burst is None and opts.burst and time.time() >= burstAt:
+                burst = time.time()
+                for table in tables:
+                    writer.write(table, opts.burst, burst=True)
+
+            time.sleep(max(0, tick - time.time()))
+
+        drained = wait(lambda: writer.behind() == 0, opts.timeout)
+        monitor.stop()
+
+    finally:
+        if monitor is not None and monitor.is_alive():
+            monitor.stop()
+        if writer is not None:
+            writer.close()
+        # forked workers keep their end of the pipe open, so they would
+        # outlive the supervisor
+        workers = workerMemory(supervisor.pid)
+        supervisor.terminate()
+        supervisor.join()
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+        source.close()
+        target.close()
+
+    memory = [s['rssMB'] for s in monitor.samples if s['workers']]
+    return {
+        'tables': opts.tables,
+        'rate': opts.rate,
+        'width': opts.width,
+        'writes': len(monitor.lags),
+        'p50': percentile(monitor.lags, 50),
+        'p95': percentile(monitor.lags, 95),
+        'p99': percentile(monitor.lags, 99),
+        'max': max(monitor.lags, default=None),
+        'burstRows': opts.burst * opts.tables if burst else 0,
+        'burstCatchUp': max(monitor.burstLags, default=None),
+        'drainSeconds': drained,
+        'rssStartMB': memory[0] if memory else None,
+        'rssPeakMB': max(memory, default=None),
+        'rssEndMB': memory[-1] if memory else None,
+        'samples': monitor.samples,
+    }
+
+
+def seconds(value):
+    return '-' if value is None else f'{value:.3f}s'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Replicator lag soak test')
+    parser.add_argument('--tables', type=int, default=2)
+    parser.add_argument('--rows', type=int, default=10000,
+                        help='rows per table before the writes start')
+    parser.add_argument('--width', type=int, default=10)
+    parser.add_argument('--rate', type=float, default=100,
+                        help='changes per second per table')
+    parser.add_argument('--updates', type=float, default=0.5,
+                        help='fraction of the changes that are updates')
+    parser.add_argument('--seconds', type=float, default=30,
+                        help='how long the writes go on')
+    parser.add_argument('--burst', type=int, default=10000,
+                        help='rows inserted per table at once halfway'
+                        ' through, 0 for none')
+    parser.add_argument('--tick', type=float, default=0.1,
+                        help='seconds between writes')
+    parser.add_argument('--probe', type=float, default=0.05,
+                        help='seconds between target watermark polls')
+    parser.add_argument('--sample', type=float, default=5,
+                        help='seconds between lag and memory samples')
+    parser.add_argument('--timeout', type=float, default=300,
+                        help='seconds to wait for the target to catch up')
+    parser.add_argument('--proc', type=int, default=2)
+    parser.add_argument('--batch', type=int, default=None)
+    parser.add_argument('--commit', type=int, default=None)
+    parser.add_argument('--idleMin', type=float, default=None)
+    parser.add_argument('--idleMax', type=float, default=None)
+    parser.add_argument('--spool', action='store_true',
+                        help='buffer row sets in a local spool')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--debug', action='store_true')
+    parser.add_argument('--save', help='write the report to a json file')
+    opts = parser.parse_args(argv)
+
+    print(f'{opts.tables} tables x {opts.width} columns,'
+          f' {opts.rate:g} changes/s per table for {opts.seconds:g}s'
+          f' ({opts.updates:.0%} updates),'
+          f' burst of {opts.burst} rows per table')
+
+    with tempfile.TemporaryDirectory() as workDir:
+        report = soak(opts, workDir)
+
+    if report is None:
+        return 1
+
+    print(f"lag over {report['writes']} writes:"
+          f" p50 {seconds(report['p50'])} p95 {seconds(report['p95'])}"
+          f" p99 {seconds(report['p99'])} max {seconds(report['max'])}")
+    if report['burstRows']:
+        print(f"burst of {report['burstRows']} rows caught up in"
+              f" {seconds(report['burstCatchUp'])}")
+    if report['rssPeakMB'] is not None:
+        print(f"worker memory: {report['rssStartMB']} MB at start,"
+              f" {report['rssPeakMB']} MB peak,"
+              f" {report['rssEndMB']} MB at end")
+
+    if opts.save:
+        with open(opts.save, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if report['drainSeconds'] is None:
+        print(f'target still behind {opts.timeout}s after the writes'
+              ' stopped')
+        return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,107 @@
+"""
+Synthetic source tables for the benchmarks.
+
+Tables have an int pk, a timestamp rowver (or change tracking instead) and
+`width` data columns cycling through a few common types.  Values are
+generated from a seeded random so runs are reproducible.
+"""
+import random
+from datetime import datetime, timedelta
+
+
+def offsetTime(r):
+    """A datetimeoffset as handle_datetimeoffset formats it"""
+    value = datetime(2018, 1, 1) + timedelta(seconds=r.randint(0, 10 ** 8))
+    return f'{value:%Y-%m-%d %H:%M:%S}.0000000 +00:00'
+
+
+COLUMN_TYPES = (
+    ('int', lambda r, i: r.randint(-2 ** 31, 2 ** 31 - 1)),
+    ('nvarchar (50)', lambda r, i: f'value {i} {r.random():.8f}'),
+    ('float', lambda r, i: r.random() * 1e6),
+    ('datetime2', lambda r, i: str(datetime(2018, 1, 1) +
+                                   timedelta(seconds=r.randint(0, 10 ** 8)))),
+    ('varbinary (16)', lambda r, i: r.randbytes(16)),
+    ('datetimeoffset', lambda r, i: offsetTime(r)),
+)
+
+LOB_TYPE = ('nvarchar (max)', lambda r, i: 'x' * r.randint(1000, 20000))
+
+
+def columnTypes(width, lob=False):
+    types = [COLUMN_TYPES[i % len(COLUMN_TYPES)] for i in range(width)]
+    if lob and width:
+        types[-1] = LOB_TYPE
+
+    return types
+
+
+def createTable(connection, schemaName, tableName, width, lob=False,
+                changeTracking=False):
+    """With changeTracking the table has no rowver and is change tracked"""
+    cols = ', '.join(f'[c{i}] {t}' for i, (t, _) in
+                     enumerate(columnTypes(width, lob), 1))
+    rowver = '' if changeTracking else '[rowver] timestamp,'
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+            CREATE TABLE [{schemaName}].[{tableName}](
+                [id] int NOT NULL,
+                {rowver}
+                {cols},
+                primary key clustered ([id])
+            );
+        """)
+
+        if changeTracking:
+            cursor.execute(f"Alter Table [{schemaName}].[{tableName}]"
+                           " Enable Change_Tracking;")
+
+
+def columns(width):
+    return ['[id]'] + [f'[c{i}]' for i in range(1, width + 1)]
+
+
+def rows(start, count, width, lob=False, seed=0):
+    r = random.Random(seed + start)
+    gens = [g for _, g in columnTypes(width, lob)]
+    for i in range(start, start + count):
+        yield (i, *[g(r, i) for g in gens])
+
+
+def insert(connection, schemaName, tableName, start, count, width,
+           lob=False, seed=0, chunk=5000):
+    """Inserts rows with ids start .. start + count - 1"""
+    cols = columns(width)
+    query = f"Insert [{schemaName}].[{tableName}] ({', '.join(cols)})" \
+        f" values ({', '.join('?' * len(cols))});"
+
+    data = rows(start, count, width, lob, seed)
+    with connection.cursor() as cursor:
+        while True:
+            chunkRows = [row for _, row in zip(range(chunk), data)]
+            if not chunkRows:
+                break
+
+            cursor.executemany(query, chunkRows)
+            connection.commit()
+
+
+def update(connection, schemaName, tableName, ids, width, seed=0):
+    """Rewrites the first data column of the given ids"""
+    _, gen = columnTypes(width)[0]
+    r = random.Random(seed)
+    query = f"update [{schemaName}].[{tableName}]" \
+        " set [c1] = ? where [id] = ?;"
+
+    with connection.cursor() as cursor:
+        cursor.executemany(query, [(gen(r, i), i) for i in ids])
+        connection.commit()
+
+
+def delete(connection, schemaName, tableName, ids):
+    """Deletes the given ids"""
+    query = f"delete from [{schemaName}].[{tableName}] where [id] = ?;"
+
+    with connection.cursor() as cursor:
+        cursor.executemany(query, [(i,) for i in ids])
+        connection.commit()
@@ -0,0 +1,319 @@
+"""
+Replicates synthetic tables through Dataflow against the sqlite stand-in
+for pyodbc and checks the target ends up identical to the source.
+
+    python -m unittest bench.test_dataflow
+"""
+import bench
+import tempfile
+import unittest
+
+import pyodbc
+import confighelper as cfgh
+import replicator
+from bench import synthetic
+from bench.__main__ import contents, drain, jobConfig
+from checkpoint import CheckpointStore
+from dataflow import Dataflow, Fanout
+from mssql.pool import Pool
+from mssql.table import Table
+
+WIDTH = len(synthetic.COLUMN_TYPES)
+
+
+class FlowCase(unittest.TestCase):
+    """Builds a job against a fresh source and target for every test"""
+
+    mode = 'rowver'
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.workDir = self._tmp.name
+        self.flows = []
+        self.store = None
+        self.pool = None
+        self.src = None
+
+    def tearDown(self):
+        for flow in self.flows:
+            flow.close()
+        if self.pool is not None:
+            self.pool.close()
+        if self.store is not None:
+            self.store.close()
+        if self.src is not None:
+            self.src.close()
+        self._tmp.cleanup()
+
+    def job(self, targets=1, **extra):
+        extra = dict({'batch': 100, 'commit': 40}, **extra)
+        configF = jobConfig(self.workDir, extra, targets, self.mode)
+        config = cfgh.config(replicator.argParser().parse_args([]), configF)
+        self.jobName, self.conf = next(iter(config.jobs.items()))
+        self.commons = config.commons
+
+        self.src = pyodbc.connect(self.conf['source']['connStr'])
+        self.store = CheckpointStore(self.commons['checkpoint'])
+        self.pool = Pool(self.commons['poolSize'], self.commons['poolCheck'],
+                         self.commons['shareConnections'])
+
+    def flow(self):
+        flow = Dataflow(self.jobName, self.conf, self.commons, self.store,
+                        {}, self.pool)
+        self.flows.append(flow)
+        return flow
+
+    def assertMatches(self, rowver=True):
+        expected = contents(self.src, WIDTH, rowver)
+        for target in self.conf.get('targets', [self.conf.get('target')]):
+            trgt = pyodbc.connect(target['connStr'])
+            try:
+                self.assertEqual(contents(trgt, WIDTH, rowver), expected)
+            finally:
+                trgt.close()
+
+
+class StrategyTest(FlowCase):
+
+    def replicate(self, strategy, updates=True, **extra):
+        self.job(strategy=strategy, **extra)
+        synthetic.createTable(self.src, 'dbo', 'synthetic', WIDTH)
+        synthetic.insert(self.src, 'dbo', 'synthetic', 1, 500, WIDTH)
+
+        flow = self.flow()
+        self.assertEqual(drain(flow), 500)
+        self.assertMatches()
+
+        changed = 0
+        if updates:
+            ids = range(1, 501, 7)
+            synthetic.update(self.src, 'dbo', 'synthetic', ids, WIDTH,
+                             seed=1)
+            changed += len(ids)
+
+        synthetic.insert(self.src, 'dbo', 'synthetic', 501, 150, WIDTH)
+        changed += 150
+
+        self.assertEqual(drain(flow), changed)
+        self.assertMatches()
+        return flow
+
+    def testUpdate(self):
+        self.replicate('update')
+
+    def testMerge(self):
+        self.replicate('merge')
+
+    def testDelete(self):
+        self.replicate('delete')
+
+    def testInsert(self):
+        self.replicate('insert', updates=False)
+
+    def testAuto(self):
+        flow = self.replicate('auto')
+        self.assertEqual(flow.target.applyStrategy(), 'update')
+
+    def testPrefetch(self):
+        self.replicate('update', depth=2)
+
+    def testColumnar(self):
+        self.replicate('merge', columnar=True)
+
+    def testPassThrough(self):
+        flow = self.replicate('update', passThrough=True)
+        self.assertTrue(flow.source.passThrough)
+
+    def testPklessInsert(self):
+        self.pkless('insert')
+
+    def testPklessAuto(self):
+        self.pkless('auto')
+
+    def pkless(self, strategy):
+        self.job(strategy=strategy)
+        cols = ', '.join(f'[c{i}] {t}' for i, (t, _) in
+                         enumerate(synthetic.columnTypes(WIDTH), 1))
+        self.src.execute(f'create table [dbo].[synthetic]([id] int not null,'
+                         f' [rowver] timestamp, {cols});')
+        self.src.commit()
+        synthetic.insert(self.src, 'dbo', 'synthetic', 1, 300, WIDTH)
+
+        flow = self.flow()
+        self.assertEqual(drain(flow), 300)
+        self.assertEqual(flow.target.pkColumns, ())
+        self.assertEqual(flow.target.applyStrategy(), 'insert')
+
+        synthetic.insert(self.src, 'dbo', 'synthetic', 301, 120, WIDTH)
+        self.assertEqual(drain(flow), 120)
+        self.assertMatches()
+
+
+class FanoutTest(FlowCase):
+
+    def setUp(self):
+        super().setUp()
+        self.job(targets=3, lagInterval=0.001)
+        synthetic.createTable(self.src, 'dbo', 'synthetic', WIDTH)
+        synthetic.insert(self.src, 'dbo', 'synthetic', 1, 500, WIDTH)
+
+        self.roles = []
+        acquire = self.pool.acquire
+
+        def counted(connStr, role=None, group=None, timeout=None):
+            self.roles.append(role)
+            return acquire(connStr, role, group, timeout)
+
+        self.pool.acquire = counted
+
+    def fanout(self):
+        flow = Fanout(self.jobName, self.conf, self.commons, self.store, {},
+                      self.pool)
+        self.flows.append(flow)
+        return flow
+
+    def change(self):
+        synthetic.update(self.src, 'dbo', 'synthetic', range(1, 501, 5),
+                         WIDTH, seed=1)
+        synthetic.insert(self.src, 'dbo', 'synthetic', 501, 100, WIDTH)
+
+    def testTargetsShareTheSource(self):
+        flow = self.fanout()
+        drain(flow)
+        self.change()
+
+        scans = []
+        rowver = Table.rowver
+
+        def counted(table, *args, **kwargs):
+            if table is flow.flows[0].source:
+                scans.append(table)
+            return rowver(table, *args, **kwargs)
+
+        Table.rowver = counted
+        try:
+            self.assertEqual(flow.run(), 3 * 200)
+        finally:
+            Table.rowver = rowver
+
+        self.assertMatches()
+        self.assertEqual(self.roles.count('source'), 1)
+        self.assertEqual(len(scans), 1)
+        self.assertEqual(flow.stats.lag, 0)
+
+    def testFailedTargetLeavesTheSourceOpen(self):
+        flow = self.fanout()
+        drain(flow)
+        self.change()
+
+        failing = flow.flows[1].target
+        merge = Table.merge
+
+        def failOnce(table, *args, **kwargs):
+            if table is failing:
+                raise RuntimeError('target failed')
+            return merge(table, *args, **kwargs)
+
+        Table.merge = failOnce
+        try:
+            flow.run()
+        finally:
+            Table.merge = merge
+
+        self.assertFalse(flow.flows[1].connected)
+        self.assertTrue(flow.flows[0].connected)
+
+        drain(flow)
+        self.assertMatches()
+        self.assertEqual(self.roles.count('source'), 1)
+
+
+class ChangeTrackingTest(FlowCase):
+
+    mode = 'changeTracking'
+
+    def setUp(self):
+        super().setUp()
+        self.job()
+        synthetic.createTable(self.src, 'dbo', 'synthetic', WIDTH,
+                              changeTracking=True)
+        synthetic.insert(self.src, 'dbo', 'synthetic', 1, 400, WIDTH)
+
+    def version(self):
+        return self.src.execute(
+            'select version = change_tracking_current_version()'
+        ).fetchone()[0]
+
+    def change(self):
+        """Updates, deletes and inserts rows, returns how many changed"""
+        updated = range(2, 401, 9)
+        deleted = range(5, 401, 11)
+        synthetic.update(self.src, 'dbo', 'synthetic', updated, WIDTH,
+                         seed=1)
+        synthetic.delete(self.src, 'dbo', 'synthetic', deleted)
+        synthetic.insert(self.src, 'dbo', 'synthetic', 401, 60, WIDTH)
+
+        # rows both updated and deleted only show up as deletes
+        return len(set(updated) | set(deleted)) + 60
+
+    def testInitialLoad(self):
+        flow = self.flow()
+        version = self.version()
+
+        self.assertEqual(drain(flow), 400)
+        self.assertMatches(rowver=False)
+        self.assertEqual(self.store.get(self.jobName), version)
+
+    def testChanges(self):
+        flow = self.flow()
+        drain(flow)
+
+        changed = self.change()
+        self.assertEqual(drain(flow), changed)
+        self.assertMatches(rowver=False)
+        self.assertEqual(self.store.get(self.jobName), self.version())
+
+        # nothing new, nothing moves
+        self.assertEqual(drain(flow), 0)
+
+    def testPages(self):
+        self.commons['drain'] = False
+        self.commons['batch'] = 25
+        flow = self.flow()
+        drain(flow)
+
+        # a page stops short of its last version, which the next page
+        # reads again
+        changed = self.change()
+        self.assertGreaterEqual(drain(flow), changed)
+        self.assertMatches(rowver=False)
+        self.assertEqual(self.store.get(self.jobName), self.version())
+
+    def testResumesFromStoredVersion(self):
+        flow = self.flow()
+        drain(flow)
+        flow.close()
+        self.flows.remove(flow)
+
+        changed = self.change()
+        flow = self.flow()
+        self.assertEqual(drain(flow), changed)
+        self.assertMatches(rowver=False)
+
+    def testReloadsOnceChangesAreCleanedUp(self):
+        flow = self.flow()
+        drain(flow)
+        flow.close()
+        self.flows.remove(flow)
+
+        self.change()
+        self.src._db.execute('update __ctmin set version = ?;',
+                             (self.version(),))
+
+        flow = self.flow()
+        self.assertEqual(drain(flow), 400 - len(range(5, 401, 11)) + 60)
+        self.assertMatches(rowver=False)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,153 @@
+"""
+Lease assignment, hand-over and expiry between nodes.
+
+    python -m unittest bench.test_lease
+"""
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import lease
+from lease import Leases
+
+
+class Clock:
+    """Stands in for the time module so expiry needs no sleeping"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+class LeasesTest(unittest.TestCase):
+
+    jobs = [f'job{i}' for i in range(12)]
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self._tmp.name, 'leases.db')
+        self.clock = Clock()
+        patcher = mock.patch.object(lease, 'time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.nodes = []
+
+    def tearDown(self):
+        for node in self.nodes:
+            node._connection.close()
+        self._tmp.cleanup()
+
+    def node(self, name, seconds=30):
+        node = Leases(self.path, node=name, seconds=seconds)
+        self.nodes.append(node)
+        return node
+
+    def holders(self):
+        db = self.nodes[0]._connection
+        return dict(db.execute('select job, node from leases;'))
+
+    def testOwnersCapsAtFairShare(self):
+        owners = self.node('a').owners(self.jobs, ['a', 'b', 'c'])
+
+        self.assertEqual(sorted(owners), sorted(self.jobs))
+        counts = [list(owners.values()).count(n) for n in ('a', 'b', 'c')]
+        self.assertEqual(counts, [4, 4, 4])
+
+        owners = self.node('a').owners(self.jobs[:10], ['a', 'b', 'c'])
+        counts = [list(owners.values()).count(n) for n in ('a', 'b', 'c')]
+        self.assertEqual(sum(counts), 10)
+        self.assertLessEqual(max(counts), 4)
+
+    def testOwnersAgree(self):
+        a, b = self.node('a'), self.node('b')
+        owners = a.owners(self.jobs, ['a', 'b', 'c'])
+
+        self.assertEqual(
+            b.owners(list(reversed(self.jobs)), ['c', 'a', 'b']), owners)
+
+    def testSingleNodeHoldsEveryJob(self):
+        a = self.node('a')
+
+        self.assertEqual(a.held(self.jobs), set(self.jobs))
+        self.assertEqual(set(self.holders().values()), {'a'})
+
+    def testJoiningNodeTakesItsShare(self):
+        a, b = self.node('a'), self.node('b')
+        a.renew(self.jobs)
+
+        # b is wanted for some jobs but a still holds them
+        self.assertEqual(b.renew(self.jobs), set())
+
+        mineA = a.renew(self.jobs)
+        mineB = b.renew(self.jobs)
+        owners = a.owners(self.jobs, ['a', 'b'])
+
+        self.assertEqual(mineA, {j for j in self.jobs if owners[j] == 'a'})
+        self.assertEqual(mineB, {j for j in self.jobs if owners[j] == 'b'})
+        self.assertEqual(self.holders(), owners)
+
+    def testBusyJobIsNotGivenUp(self):
+        a, b = self.node('a'), self.node('b')
+        a.renew(self.jobs)
+        b.renew(self.jobs)
+
+        owners = a.owners(self.jobs, ['a', 'b'])
+        busy = next(j for j in self.jobs if owners[j] == 'b')
+
+        # a keeps the lease while its cycle runs, but no longer runs it
+        self.assertNotIn(busy, a.renew(self.jobs, busy={busy}))
+        self.assertNotIn(busy, b.renew(self.jobs))
+        self.assertEqual(self.holders()[busy], 'a')
+
+        # and hands it over once the cycle is done
+        a.renew(self.jobs)
+        self.assertIn(busy, b.renew(self.jobs))
+        self.assertEqual(self.holders()[busy], 'b')
+
+    def testExpiredLeasesAreTakenOver(self):
+        a, b = self.node('a', seconds=30), self.node('b', seconds=30)
+        a.renew(self.jobs)
+        b.renew(self.jobs)
+        a.renew(self.jobs)
+        b.renew(self.jobs)
+        ofA = {j for j, n in self.holders().items() if n == 'a'}
+        self.assertTrue(ofA)
+
+        # a stops renewing: its leases hold until they expire
+        self.clock.now += 20
+        self.assertFalse(b.renew(self.jobs) & ofA)
+
+        self.clock.now += 11
+        self.assertEqual(b.renew(self.jobs), set(self.jobs))
+        self.assertEqual(set(self.holders().values()), {'b'})
+
+    def testCloseReleasesLeases(self):
+        a, b = self.node('a'), self.node('b')
+        a.renew(self.jobs)
+        b.renew(self.jobs)
+
+        a.close()
+        self.nodes.remove(a)
+
+        self.assertEqual(b.renew(self.jobs), set(self.jobs))
+
+    def testHeldRenewsOnlyWhenDue(self):
+        a, b = self.node('a', seconds=30), self.node('b', seconds=30)
+        a.held(self.jobs)
+        b.renew(self.jobs)
+        self.assertEqual(a.due(), 10)
+
+        # a doesn't look at the leases again until the interval has passed
+        self.clock.now += 5
+        self.assertEqual(a.held(self.jobs), set(self.jobs))
+
+        self.clock.now += 5
+        self.assertEqual(a.due(), 0)
+        self.assertLess(a.held(self.jobs), set(self.jobs))
+
+
+if __name__ == '__main__':
+    unittest.main()
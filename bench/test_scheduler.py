@@ -0,0 +1,98 @@
+"""
+Scheduler ordering and the supervisor's wait timeout.
+
+    python -m unittest bench.test_scheduler
+"""
+import unittest
+from unittest import mock
+
+import scheduler
+from scheduler import Scheduler
+
+
+class Clock:
+    """Stands in for the time module so backoff needs no sleeping"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+class SchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        patcher = mock.patch.object(scheduler, 'time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def testIdleJobsBackOff(self):
+        sched = Scheduler(['a'], idleMin=1, idleMax=4)
+
+        delays = []
+        for _ in range(4):
+            self.clock.now += 10
+            self.assertEqual(sched.next(), 'a')
+            sched.done('a')
+            delays.append(sched.delay('a'))
+
+        self.assertEqual(delays, [1, 2, 4, 4])
+
+        self.assertEqual(sched.next(), None)
+        sched.done('a', backlog=True)
+        self.assertEqual(sched.delay('a'), 0)
+
+    def testTimeoutWaitsForNextDueJob(self):
+        sched = Scheduler(['a', 'b'], idleMin=5)
+        self.assertEqual(sched.next(), 'a')
+        self.assertEqual(sched.next(), 'b')
+        self.assertIsNone(sched.timeout())
+
+        sched.done('a')
+        self.clock.now += 2
+        self.assertEqual(sched.timeout(), 3)
+
+    def testDueJobsWaitingOnWorkersDontSpin(self):
+        sched = Scheduler(['a', 'b'], idleMin=1)
+
+        # a runs on the only worker while b comes due
+        self.assertEqual(sched.next(lambda job: job == 'a'), 'a')
+        self.clock.now += 1
+        sched.promote()
+        self.assertIsNone(sched.timeout())
+
+        # once a is back b goes first
+        sched.done('a')
+        self.assertEqual(sched.timeout(), 1)
+        self.assertEqual(sched.next(), 'b')
+
+    def testLaggingJobGoesFirst(self):
+        sched = Scheduler(['a', 'b'], idleMin=1)
+        sched.next()
+        sched.next()
+        sched.done('a', lag=10)
+        sched.done('b', lag=1000)
+
+        self.clock.now += 1
+        self.assertEqual(sched.next(), 'b')
+
+    def testLongWaitBeatsPriority(self):
+        settings = {'a': {'priority': 100}}
+        sched = Scheduler(['a', 'b'], idleMin=1, settings=settings,
+                          maxWait=60)
+        sched.next(lambda job: job == 'a')
+        self.clock.now += 1
+        sched.done('a')
+
+        self.clock.now += 1
+        self.assertEqual(sched.next(), 'a')
+        sched.done('a')
+
+        self.clock.now += 60
+        self.assertEqual(sched.next(), 'b')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,185 @@
+"""
+Spool recovery and segment handling.
+
+    python -m unittest bench.test_spool
+"""
+import os
+import tempfile
+import unittest
+
+from spool import Spool
+
+
+def rowver(i):
+    return i.to_bytes(8, 'big')
+
+
+class SpoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.dir = self._tmp.name
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def fill(self, spool, count, start=1):
+        for i in range(start, start + count):
+            spool.append(rowver(i), ['[id]', '[v]'], [(i, f'value {i}')])
+
+    def segments(self):
+        return sorted(name for name in os.listdir(self.dir)
+                      if name.endswith('.seg'))
+
+    def testReadsBackRecords(self):
+        spool = Spool(self.dir)
+        self.fill(spool, 3)
+
+        records = list(spool.records())
+        self.assertEqual([r for r, _, _ in records],
+                         [rowver(1), rowver(2), rowver(3)])
+        self.assertEqual(records[1][1:], (['[id]', '[v]'], [(2, 'value 2')]))
+        self.assertEqual([r for r, _, _ in spool.records(after=rowver(2))],
+                         [rowver(3)])
+        spool.close()
+
+    def testTornRecordIsCutOnReopen(self):
+        spool = Spool(self.dir)
+        self.fill(spool, 3)
+        spool.close()
+
+        path = os.path.join(self.dir, self.segments()[0])
+        size = os.path.getsize(path)
+        with open(path, 'r+b') as f:
+            f.truncate(size - 5)
+
+        spool = Spool(self.dir)
+        self.assertEqual(spool.rowver, rowver(2))
+        self.assertEqual([r for r, _, _ in spool.records()],
+                         [rowver(1), rowver(2)])
+        self.assertEqual(os.path.getsize(path), spool.size)
+
+        # appends carry on after the last complete record
+        self.fill(spool, 1, start=3)
+        self.assertEqual([r for r, _, _ in spool.records()],
+                         [rowver(1), rowver(2), rowver(3)])
+        spool.close()
+
+    def testTornHeaderIsCutOnReopen(self):
+        spool = Spool(self.dir)
+        self.fill(spool, 1)
+        size = spool.size
+        spool.close()
+
+        path = os.path.join(self.dir, self.segments()[0])
+        with open(path, 'ab') as f:
+            f.write(b'\x01\x02\x03')
+
+        spool = Spool(self.dir)
+        self.assertEqual(spool.rowver, rowver(1))
+        self.assertEqual(os.path.getsize(path), size)
+        spool.close()
+
+    def testBadCrcIsCutOnReopen(self):
+        spool = Spool(self.dir)
+        self.fill(spool, 1)
+        first = spool.size
+        self.fill(spool, 2, start=2)
+        spool.close()
+
+        # flip the last payload byte of the second record
+        path = os.path.join(self.dir, self.segments()[0])
+        with open(path, 'r+b') as f:
+            f.seek(first)
+            length = Spool.header.unpack(f.read(Spool.header.size))[0]
+            f.seek(length - 1, os.SEEK_CUR)
+            byte = f.read(1)
+            f.seek(-1, os.SEEK_CUR)
+            f.write(bytes([byte[0] ^ 0xff]))
+
+        spool = Spool(self.dir)
+        self.assertEqual(spool.rowver, rowver(1))
+        self.assertEqual([r for r, _, _ in spool.records()], [rowver(1)])
+        self.assertEqual(os.path.getsize(path), first)
+        spool.close()
+
+    def testBadCrcRaisesOnRead(self):
+        spool = Spool(self.dir)
+        self.fill(spool, 2)
+
+        path = os.path.join(self.dir, self.segments()[0])
+        with open(path, 'r+b') as f:
+            f.seek(-1, os.SEEK_END)
+            byte = f.read(1)
+            f.seek(-1, os.SEEK_END)
+            f.write(bytes([byte[0] ^ 0xff]))
+
+        with self.assertRaises(ValueError):
+            list(spool.records())
+        spool.close()
+
+    def testEmptySegmentIsDroppedOnReopen(self):
+        open(os.path.join(self.dir, '000000000001.seg'), 'wb').close()
+
+        spool = Spool(self.dir)
+        self.assertIsNone(spool.rowver)
+        self.assertEqual(self.segments(), [])
+        spool.close()
+
+    def testSegmentsRollOver(self):
+        spool = Spool(self.dir, segmentBytes=1)
+        self.fill(spool, 3)
+        self.assertEqual(len(self.segments()), 3)
+
+        # only segments applied all the way are deleted
+        spool.release(rowver(2))
+        self.assertEqual(len(self.segments()), 1)
+        self.assertEqual([r for r, _, _ in spool.records()], [rowver(3)])
+
+        self.fill(spool, 1, start=4)
+        self.assertEqual(self.segments(),
+                         ['000000000003.seg', '000000000004.seg'])
+        spool.close()
+
+        spool = Spool(self.dir, segmentBytes=1)
+        self.assertEqual(spool.rowver, rowver(4))
+        self.assertEqual([r for r, _, _ in spool.records()],
+                         [rowver(3), rowver(4)])
+
+        spool.release(rowver(4))
+        self.assertEqual(self.segments(), [])
+        self.assertFalse(spool.pending)
+
+        # the next append starts a new segment
+        self.fill(spool, 1, start=5)
+        self.assertEqual(self.segments(), ['000000000001.seg'])
+        spool.close()
+
+    def testSegmentFillsUpToSize(self):
+        spool = Spool(self.dir)
+        self.fill(spool, 1)
+        spool.close()
+
+        spool = Spool(self.dir, segmentBytes=spool.size * 3)
+        self.fill(spool, 3, start=2)
+        self.assertEqual(len(self.segments()), 2)
+        self.assertEqual([r for r, _, _ in spool.records()],
+                         [rowver(i) for i in range(1, 5)])
+        spool.close()
+
+    def testClear(self):
+        spool = Spool(self.dir, segmentBytes=1)
+        self.fill(spool, 3)
+
+        spool.clear()
+        self.assertIsNone(spool.rowver)
+        self.assertEqual(self.segments(), [])
+        self.assertEqual(list(spool.records()), [])
+
+        self.fill(spool, 1, start=7)
+        self.assertEqual([r for r, _, _ in spool.records()], [rowver(7)])
+        spool.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
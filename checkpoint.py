@@ -0,0 +1,66 @@
+import sqlite3
+import threading
+
+
+class CheckpointStore:
+    """
+    Durable record of the last rowver applied to each job's target.
+
+    Backed by a local sqlite file shared by all worker processes.  A
+    checkpoint is written right after the target commits a merge, so it can
+    lag the target but is never ahead of it; re-applying rows after a crash
+    is harmless since merges are upserts.
+
+    Fan-out targets checkpoint from their own threads, so the connection
+    is shared between threads behind a lock.
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=30,
+                                           isolation_level=None,
+                                           check_same_thread=False)
+        self._connection.execute('pragma journal_mode=wal;')
+        self._connection.execute("""
+            create table if not exists checkpoint (
+                job text primary key,
+                rowver blob,
+                updated real default (julianday('now'))
+            );
+        """)
+
+    @property
+    def path(self):
+        return self._path
+
+    def get(self, job):
+        """Returns the last applied rowver for job, None if unknown"""
+        with self._lock:
+            row = self._connection.execute(
+                'select rowver from checkpoint where job = ?;', (job,)
+            ).fetchone()
+
+        return row[0] if row else None
+
+    def set(self, job, rowver):
+        with self._lock:
+            self._connection.execute("""
+                insert into checkpoint (job, rowver) values (?, ?)
+                on conflict (job) do update
+                set rowver = excluded.rowver, updated = julianday('now');
+            """, (job, rowver))
+
+    def clear(self, job):
+        with self._lock:
+            self._connection.execute(
+                'delete from checkpoint where job = ?;', (job,))
+
+    def all(self):
+        """Returns a dictionary of job: rowver"""
+        with self._lock:
+            return dict(self._connection.execute(
+                'select job, rowver from checkpoint;').fetchall())
+
+    def close(self):
+        self._connection.close()
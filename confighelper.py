@@ -6,8 +6,9 @@ from os import path
 
 class config():
 
-    def __init__(self, args, configF):
+    def __init__(self, args, configF, baseDir=None):
         self._args = args
+        self._baseDir = baseDir
 
         if 'jobs' not in configF:
             raise KeyError('No jobs found in config file.')
@@ -15,6 +16,16 @@ class config():
         self._jobConfigs = configF['jobs']
         self._global = configF['global'] if 'global' in configF else {}
 
+    def resolve(self, filePath):
+        """
+        A relative path against the directory the config files are read
+        from rather than the working directory
+        """
+        if filePath is None or self._baseDir is None:
+            return filePath
+
+        return path.join(self._baseDir, filePath)
+
     @property
     def auto(self):
         if self._args.auto:
@@ -26,13 +37,24 @@ class config():
 
         return False
 
+    @property
+    def fast(self):
+        if self._args.fast:
+            return self._args.fast
+
+        if (self._global and 'fast' in self._global and
+                self._global['fast']):
+            return self._global['fast']
+
+        return False
+
     @property
     def batch(self):
         if self._args.batch:
-            return self._args.batch
+            return int(self._args.batch)
 
         if self._global and 'batch' in self._global and self._global['batch']:
-            return self._global['batch']
+            return int(self._global['batch'])
 
         return 10000
 
@@ -52,14 +74,400 @@ class config():
     @property
     def commit(self):
         if self._args.commit:
-            return self._args.commit
+            return int(self._args.commit)
 
         if (self._global and 'commit' in self._global and
                 self._global['commit']):
-            return self._global['commit']
+            return int(self._global['commit'])
 
         return 500
 
+    @property
+    def adaptive(self):
+        """Size batch and commit per table from observed latency"""
+        if (self._global and 'adaptive' in self._global and
+                self._global['adaptive']):
+            return self._global['adaptive']
+
+        return False
+
+    @property
+    def batchSeconds(self):
+        """Time an adaptive page or merge should take"""
+        if (self._global and 'batchSeconds' in self._global and
+                self._global['batchSeconds']):
+            return self._global['batchSeconds']
+
+        return 1.0
+
+    @property
+    def batchBytes(self):
+        """Most bytes an adaptive merge may hold"""
+        if (self._global and 'batchBytes' in self._global and
+                self._global['batchBytes']):
+            return self._global['batchBytes']
+
+        return 8 * 2 ** 20
+
+    @property
+    def minRows(self):
+        """Lower bound for adaptive batch and commit sizes"""
+        if (self._global and 'minRows' in self._global and
+                self._global['minRows']):
+            return int(self._global['minRows'])
+
+        return 100
+
+    @property
+    def maxRows(self):
+        """Upper bound for adaptive batch and commit sizes"""
+        maxRows = 50000
+        if (self._global and 'maxRows' in self._global and
+                self._global['maxRows']):
+            maxRows = int(self._global['maxRows'])
+
+        if maxRows < self.minRows:
+            raise ValueError(f'maxRows ({maxRows}) is below minRows'
+                             f' ({self.minRows}).')
+
+        return maxRows
+
+    @property
+    def depth(self):
+        """Row sets buffered between fetch and merge, 0 runs serially"""
+        if self._args.depth:
+            return int(self._args.depth)
+
+        if (self._global and 'depth' in self._global and
+                self._global['depth']):
+            return self._global['depth']
+
+        return 0
+
+    @property
+    def strategy(self):
+        """Default apply strategy, tables may override it"""
+        if (self._global and 'strategy' in self._global and
+                self._global['strategy']):
+            return self._global['strategy']
+
+        return 'update'
+
+    @property
+    def drain(self):
+        if self._args.drain:
+            return self._args.drain
+
+        if (self._global and 'drain' in self._global and
+                self._global['drain']):
+            return self._global['drain']
+
+        return False
+
+    @property
+    def drainRows(self):
+        """Row budget for a drain run, 0 for no limit"""
+        if (self._global and 'drainRows' in self._global and
+                self._global['drainRows']):
+            return self._global['drainRows']
+
+        return 0
+
+    @property
+    def drainSeconds(self):
+        """Time budget for a drain run, 0 for no limit"""
+        if (self._global and 'drainSeconds' in self._global and
+                self._global['drainSeconds']):
+            return self._global['drainSeconds']
+
+        return 300
+
+    @property
+    def columnar(self):
+        """Hold fetched row sets by column instead of as pyodbc rows"""
+        if (self._global and 'columnar' in self._global and
+                self._global['columnar']):
+            return self._global['columnar']
+
+        return False
+
+    @property
+    def rowSetBytes(self):
+        """Estimated bytes a fetched row set may hold, 0 for no limit"""
+        if self._global and 'rowSetBytes' in self._global:
+            return self._global['rowSetBytes'] or 0
+
+        return 64 * 2 ** 20
+
+    @property
+    def lobChunk(self):
+        """Bytes of a (max) value fetched at once, 0 reads values whole"""
+        if (self._global and 'lobChunk' in self._global and
+                self._global['lobChunk']):
+            return self._global['lobChunk']
+
+        return 0
+
+    @property
+    def passThrough(self):
+        """Let the server format datetimeoffset values in the select"""
+        if self._global and 'passThrough' in self._global:
+            return bool(self._global['passThrough'])
+
+        return False
+
+    @property
+    def checkpoint(self):
+        """Path of the checkpoint store, None disables it"""
+        if self._global and 'checkpoint' in self._global:
+            return self.resolve(self._global['checkpoint'] or None)
+
+        return self.resolve('checkpoint.db')
+
+    @property
+    def spool(self):
+        """Directory of the change spool, None disables it"""
+        if (self._global and 'spool' in self._global and
+                self._global['spool']):
+            return self._global['spool']
+
+        return None
+
+    @property
+    def spoolBytes(self):
+        """Size at which the spool stops reading from the source"""
+        if (self._global and 'spoolBytes' in self._global and
+                self._global['spoolBytes']):
+            return self._global['spoolBytes']
+
+        return 2 ** 30
+
+    @property
+    def verify(self):
+        if self._args.verify:
+            return self._args.verify
+
+        if (self._global and 'verify' in self._global and
+                self._global['verify']):
+            return self._global['verify']
+
+        return False
+
+    @property
+    def initial(self):
+        if self._args.initial:
+            return self._args.initial
+
+        if (self._global and 'initial' in self._global and
+                self._global['initial']):
+            return self._global['initial']
+
+        return False
+
+    @property
+    def initialParallel(self):
+        """Number of ranges loaded concurrently by an initial load"""
+        if (self._global and 'initialParallel' in self._global and
+                self._global['initialParallel']):
+            return self._global['initialParallel']
+
+        return 4
+
+    @property
+    def catalog(self):
+        """Path of the shared schema metadata cache, None disables it"""
+        if self._global and 'catalog' in self._global:
+            return self.resolve(self._global['catalog'] or None)
+
+        return self.resolve('catalog.db')
+
+    @property
+    def catalogInterval(self):
+        """Seconds between checks for schema changes"""
+        if (self._global and 'catalogInterval' in self._global and
+                self._global['catalogInterval']):
+            return self._global['catalogInterval']
+
+        return 60
+
+    @property
+    def poolSize(self):
+        """Connections per connection string in a worker, 0 for no cap"""
+        if (self._global and 'poolSize' in self._global and
+                self._global['poolSize']):
+            return self._global['poolSize']
+
+        return 0
+
+    @property
+    def poolCheck(self):
+        """Seconds a pooled connection may sit unused before a check"""
+        if (self._global and 'poolCheck' in self._global and
+                self._global['poolCheck']):
+            return self._global['poolCheck']
+
+        return 60
+
+    @property
+    def shareConnections(self):
+        """Run all tables of a job over one source and target connection"""
+        if (self._global and 'shareConnections' in self._global and
+                self._global['shareConnections']):
+            return self._global['shareConnections']
+
+        return False
+
+    @property
+    def metricsPort(self):
+        """Port of the local metrics endpoint, None disables it"""
+        if (self._global and 'metricsPort' in self._global and
+                self._global['metricsPort']):
+            return int(self._global['metricsPort'])
+
+        return None
+
+    @property
+    def metricsFile(self):
+        """Path of a json file rewritten with metrics, None disables it"""
+        if (self._global and 'metricsFile' in self._global and
+                self._global['metricsFile']):
+            return self._global['metricsFile']
+
+        return None
+
+    @property
+    def metricsInterval(self):
+        """Seconds between rewrites of the metrics file"""
+        if (self._global and 'metricsInterval' in self._global and
+                self._global['metricsInterval']):
+            return self._global['metricsInterval']
+
+        return 15
+
+    @property
+    def lagInterval(self):
+        """Seconds between samples of a job's source max(rowver)"""
+        if self._global and 'lagInterval' in self._global:
+            return self._global['lagInterval'] or 0
+
+        return 60
+
+    @property
+    def idleMin(self):
+        """Seconds to wait before re-running a job that found no rows"""
+        if (self._global and 'idleMin' in self._global and
+                self._global['idleMin']):
+            return self._global['idleMin']
+
+        return 1
+
+    @property
+    def idleMax(self):
+        """Upper bound for the idle backoff of a job"""
+        if (self._global and 'idleMax' in self._global and
+                self._global['idleMax']):
+            return self._global['idleMax']
+
+        return 60
+
+    @property
+    def maxWait(self):
+        """Seconds a due job may wait before it goes ahead of all others"""
+        if (self._global and 'maxWait' in self._global and
+                self._global['maxWait']):
+            return self._global['maxWait']
+
+        return 300
+
+    @property
+    def reconcileParts(self):
+        """Ranges a drifted range is split into when reconciling"""
+        if (self._global and 'reconcileParts' in self._global and
+                self._global['reconcileParts']):
+            return self._global['reconcileParts']
+
+        return 16
+
+    @property
+    def reconcileRows(self):
+        """Rows at which a drifted range is compared row by row"""
+        if (self._global and 'reconcileRows' in self._global and
+                self._global['reconcileRows']):
+            return self._global['reconcileRows']
+
+        return 1000
+
+    @property
+    def planSample(self):
+        """Percent of an unindexed table sampled to estimate its backlog"""
+        if (self._global and 'planSample' in self._global and
+                self._global['planSample']):
+            return self._global['planSample']
+
+        return 1
+
+    @property
+    def leases(self):
+        """Path of the lease file shared by several nodes, None runs alone"""
+        if (self._global and 'leases' in self._global and
+                self._global['leases']):
+            return self._global['leases']
+
+        return None
+
+    @property
+    def leaseSeconds(self):
+        """Seconds before the leases of a silent node expire"""
+        if (self._global and 'leaseSeconds' in self._global and
+                self._global['leaseSeconds']):
+            return self._global['leaseSeconds']
+
+        return 30
+
+    @property
+    def node(self):
+        """Name of this node among those sharing the leases"""
+        if (self._global and 'node' in self._global and
+                self._global['node']):
+            return self._global['node']
+
+        return None
+
+    @property
+    def commons(self):
+        """Settings shared with every dataflow"""
+        return {
+            'batch': self.batch,
+            'auto': self.auto,
+            'commit': self.commit,
+            'adaptive': self.adaptive,
+            'batchSeconds': self.batchSeconds,
+            'batchBytes': self.batchBytes,
+            'minRows': self.minRows,
+            'maxRows': self.maxRows,
+            'depth': self.depth,
+            'fast': self.fast,
+            'drain': self.drain,
+            'drainRows': self.drainRows,
+            'drainSeconds': self.drainSeconds,
+            'columnar': self.columnar,
+            'rowSetBytes': self.rowSetBytes,
+            'lobChunk': self.lobChunk,
+            'passThrough': self.passThrough,
+            'checkpoint': self.checkpoint,
+            'spool': self.spool,
+            'spoolBytes': self.spoolBytes,
+            'verify': self.verify,
+            'initial': self.initial,
+            'initialParallel': self.initialParallel,
+            'catalog': self.catalog,
+            'catalogInterval': self.catalogInterval,
+            'poolSize': self.poolSize,
+            'poolCheck': self.poolCheck,
+            'shareConnections': self.shareConnections,
+            'lagInterval': self.lagInterval,
+        }
+
     @property
     def jobs(self):
         """
@@ -85,7 +493,12 @@ class config():
                 continue
 
             srcConnStr = self.connStr(v['source'])
-            trgtConnStr = self.connStr(v['target'])
+
+            # "targets" fans every table out to several databases
+            targets = v['targets'] if 'targets' in v else [v['target']]
+            labels = [t.get('label', str(i)) for i, t in enumerate(targets)]
+            if len(set(labels)) != len(labels):
+                raise ValueError(f'Duplicate target labels in job {k}.')
 
             for table in v['tables']:
                 srcSchema = table['source']['schema']
@@ -94,19 +507,44 @@ class config():
                 trgtSchema = table['target']['schema']
                 trgtTable = table['target']['name']
 
-                jobs[f"{k}.{srcSchema}.{srcTable}"] = {
+                # rowver scans a rowver column, changeTracking reads
+                # CHANGETABLE and also replicates deletes
+                mode = table.get('mode', 'rowver')
+                if mode not in ('rowver', 'changeTracking'):
+                    raise ValueError(f'Unknown source mode {mode} for'
+                                     f' {srcSchema}.{srcTable}.')
+                if mode == 'changeTracking' and 'targets' in v:
+                    raise ValueError(f'Job {k}: change tracking tables'
+                                     ' can not fan out to several targets.')
+
+                trgts = [{
+                    'label': label,
+                    'connStr': self.connStr(target),
+                    'schema': trgtSchema,
+                    'name': trgtTable,
+                    'strategy': table.get('strategy', self.strategy),
+                    'appendOnly': table.get('appendOnly', False),
+                } for label, target in zip(labels, targets)]
+
+                job = {
+                    "job": k,
+                    "priority": table.get('priority', v.get('priority', 1)),
+                    "sla": table.get('sla', v.get('sla')),
                     "source": {
                         'connStr': srcConnStr,
                         'schema': srcSchema,
                         'name': srcTable,
+                        'mode': mode,
                     },
-                    "target": {
-                        'connStr': trgtConnStr,
-                        'schema': trgtSchema,
-                        'name': trgtTable,
-                    }
                 }
 
+                if 'targets' in v:
+                    job['targets'] = trgts
+                else:
+                    job['target'] = trgts[0]
+
+                jobs[f"{k}.{srcSchema}.{srcTable}"] = job
+
         return jobs
 
     def connStr(self, parts):
@@ -0,0 +1,1217 @@
+import sys
+import time
+import queue
+import threading
+import multiprocessing as mp
+import logging
+import logging.handlers
+import traceback
+from os import path
+from concurrent.futures import ThreadPoolExecutor
+import pyodbc
+from mssql.table import Table as sqlTable
+from mssql.batch import ColumnBatch
+from mssql.catalog import Catalog
+from mssql.pool import Pool
+from checkpoint import CheckpointStore
+from metrics import CycleStats
+from sizing import BatchSizer
+from spool import Spool
+
+
+def prefetch(rowSets, depth):
+    """
+    Iterates rowSets on a background thread, keeping at most depth row
+    sets buffered.  The next fetch from the source overlaps whatever the
+    caller does with the current row set.  Exceptions raised by the
+    producer are re-raised in the caller.
+    """
+    buffer = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    end = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=1)
+                return True
+            except queue.Full:
+                continue
+
+        return False
+
+    def produce():
+        try:
+            for rowSet in rowSets:
+                if not put(rowSet):
+                    return
+
+            put(end)
+        except BaseException as e:
+            put(e)
+        finally:
+            # the caller stopped early, release the source cursor here
+            # rather than whenever the generator is collected
+            rowSets.close()
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+
+    try:
+        while True:
+            item = buffer.get()
+            if item is end:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        producer.join()
+
+
+class Dataflow:
+    """
+    Long-lived state for a single job.
+
+    Connections, Table objects and their cached merge statements are kept
+    between cycles.  They are only rebuilt when the schema of either table
+    changes or when a cycle fails (e.g. a dropped connection).
+    """
+
+    def __init__(self, name, conf, commons, store=None, catalogs=None,
+                 pool=None):
+        self.name = name
+        self._conf = conf
+        self._commons = commons
+        self._store = store
+        self._catalogs = catalogs
+        self._pool = pool
+        self._rowver = None
+        self._verified = not commons['verify']
+        self._srcTable = None
+        self._sharedSource = False
+        self._trgtTable = None
+        self._lobTable = None
+        self._loadLock = threading.Lock()
+        self._modifyDates = None
+        self._lagSampled = 0
+        self._backlog = False
+        self._pageRows = 0
+        self._pageSeconds = 0.0
+        self.sizer = None
+        self.stats = CycleStats()
+        self._log = logging.getLogger('replicator')
+
+        # the spool resumes from what it holds or the checkpoint, without
+        # a store there is nothing to resume from while the target is down
+        self.spool = None
+        if commons['spool'] and self.changeTracking:
+            self._log.warning(f'{name}: change tracking jobs are not'
+                              ' spooled, spool disabled.')
+        elif commons['spool'] and store is not None:
+            self.spool = Spool(path.join(commons['spool'], name))
+        elif commons['spool']:
+            self._log.warning(f'{name}: spooling needs a checkpoint store,'
+                              ' spool disabled.')
+
+        # chunks of long values are copied straight from the source
+        self._lobChunk = commons['lobChunk']
+        if self._lobChunk and self.spool is not None:
+            self._log.warning(f'{name}: LOB values are read whole when'
+                              ' spooling.')
+            self._lobChunk = 0
+
+    @property
+    def backlog(self):
+        """True if the last cycle stopped before the source was caught up"""
+        if self.spool is not None or self.changeTracking:
+            return self._backlog
+
+        return self.connected and not self._srcTable.caughtUp
+
+    @property
+    def changeTracking(self):
+        """True if the source is read through change tracking"""
+        return self._conf['source'].get('mode') == 'changeTracking'
+
+    @property
+    def connected(self):
+        return self._srcTable is not None and self._trgtTable is not None
+
+    @property
+    def source(self):
+        return self._srcTable
+
+    @property
+    def target(self):
+        return self._trgtTable
+
+    def catalog(self, connStr):
+        """Catalog shared by all jobs of this worker on the same database"""
+        if self._catalogs is None:
+            return None
+
+        if connStr not in self._catalogs:
+            self._catalogs[connStr] = Catalog(
+                connStr, self._commons['catalog'],
+                self._commons['catalogInterval'])
+
+        return self._catalogs[connStr]
+
+    def acquire(self, connStr, role, group=None, timeout=None):
+        """A pooled connection if the worker has a pool, else a new one"""
+        if self._pool is None:
+            return pyodbc.connect(connStr)
+
+        return self._pool.acquire(connStr, role, group, timeout)
+
+    def release(self, table):
+        """Hands a table's connection back to the pool or closes it"""
+        if self._pool is None:
+            table.close()
+        else:
+            self._pool.release(table.connection)
+
+    def connect(self):
+        """Opens both connections and syncs the target with the source"""
+        if self._srcTable is None:
+            self.connectSource()
+
+        if self._trgtTable is None:
+            self.connectTarget()
+
+        # chunks are read and written back by pk
+        if self._lobChunk and not (self._srcTable.pkColumns and
+                                   self._trgtTable.pkColumns):
+            self._log.warning(f'{self.name}: LOB values are read whole'
+                              ' without a primary key.')
+            self._lobChunk = 0
+            self._srcTable.lobChunk = 0
+
+        if self._lobChunk and self._lobTable is None:
+            self.connectLob()
+
+    def share(self, srcTable):
+        """
+        Reads from srcTable, a source connected by someone else.  The
+        flow leaves it open when it closes.
+        """
+        self._srcTable = srcTable
+        self._sharedSource = True
+        self._modifyDates = self.modifyDates()
+
+    def connectSource(self):
+        conf = self._conf
+        dfPid = mp.current_process().pid
+
+        self._log.debug(f'({dfPid}) {self.name}: connecting to source db.')
+        self._srcTable = sqlTable(
+            connection=self.acquire(conf['source']['connStr'], 'source',
+                                    conf.get('job')),
+            schemaName=conf['source']['schema'],
+            tableName=conf['source']['name'],
+            catalog=self.catalog(conf['source']['connStr'])
+        )
+        self._srcTable.batch = self._commons['batch']
+        self._srcTable.commit = self._commons['commit']
+        self._srcTable.maxBytes = self._commons['rowSetBytes']
+        self._srcTable.lobChunk = self._lobChunk
+        self._srcTable.passThrough = self._commons['passThrough']
+        self._modifyDates = self.modifyDates()
+
+        if self._commons['adaptive']:
+            # start from the sizes reached so far, the row width may differ
+            sizer = self.sizer
+            self.sizer = BatchSizer(
+                self._srcTable.rowBytes(),
+                sizer.batch if sizer else self._commons['batch'],
+                sizer.commit if sizer else self._commons['commit'],
+                self._commons['batchSeconds'], self._commons['batchBytes'],
+                self._commons['minRows'], self._commons['maxRows'])
+            self._srcTable.batch = self.sizer.batch
+            self._srcTable.commit = self.sizer.commit
+
+    def connectLob(self):
+        """
+        Opens the source connection chunks of long values are read over.
+        Values are read whole until the next connect when the pool is at
+        its cap, rather than wait on connections the job holds itself.
+        """
+        conf = self._conf
+        try:
+            connection = self.acquire(conf['source']['connStr'], 'lob',
+                                      timeout=0)
+        except TimeoutError:
+            self._log.warning(f'{self.name}: no free connection to stream'
+                              ' LOB values, reading them whole.')
+            self._srcTable.lobChunk = 0
+            return
+
+        self._lobTable = sqlTable(
+            connection=connection,
+            schemaName=conf['source']['schema'],
+            tableName=conf['source']['name'],
+            catalog=self.catalog(conf['source']['connStr'])
+        )
+        self._lobTable.lobChunk = self._lobChunk
+
+    def connectTarget(self):
+        """Opens the target connection, the source must be connected"""
+        conf = self._conf
+        dfPid = mp.current_process().pid
+
+        self._log.debug(f'({dfPid}) {self.name}: connecting to target db.')
+        trgtTable = sqlTable(
+            connection=self.acquire(conf['target']['connStr'],
+                                    f"target:{conf['target'].get('label')}",
+                                    conf.get('job')),
+            schemaName=conf['target']['schema'],
+            tableName=conf['target']['name'],
+            catalog=self.catalog(conf['target']['connStr'])
+        )
+
+        try:
+            trgtTable.batch = self._commons['batch']
+            trgtTable.fast = self._commons['fast']
+            trgtTable.strategy = conf['target'].get('strategy', 'update')
+            trgtTable.appendOnly = conf['target'].get('appendOnly', False)
+
+            self._log.debug(f'({dfPid}) {self.name}: synching table.')
+            existed = trgtTable.exists
+            trgtTable.syncWith(self._srcTable, self._commons['auto'])
+
+            # a checkpoint says nothing about a table created or emptied
+            # since, replication starts over from the target
+            if self._store is not None and \
+                    self._store.get(self.name) is not None and \
+                    (not existed or trgtTable.empty):
+                self._log.warning(f'({dfPid}) {self.name}: target is'
+                                  f' {"new" if not existed else "empty"},'
+                                  ' dropping its checkpoint.')
+                self._store.clear(self.name)
+                self._rowver = None
+                if self.spool is not None:
+                    self.spool.clear()
+        except Exception:
+            self.release(trgtTable)
+            raise
+
+        self._trgtTable = trgtTable
+        self._modifyDates = self.modifyDates()
+
+    def close(self):
+        """Drops connections and cached table state"""
+        source = None if self._sharedSource else self._srcTable
+        for table in (source, self._trgtTable, self._lobTable):
+            if table is not None:
+                self.release(table)
+
+        self._srcTable = None
+        self._trgtTable = None
+        self._lobTable = None
+        self._modifyDates = None
+
+    def closeTarget(self):
+        """Drops the target connection only, the source carries on"""
+        if self._trgtTable is not None:
+            self.release(self._trgtTable)
+
+        self._trgtTable = None
+        self._modifyDates = self.modifyDates()
+
+    def watermark(self):
+        """
+        Last rowver applied to the target.
+
+        Without a checkpoint store this is max(rowver) on the target.  With
+        one, the checkpoint is read once and then tracked in memory; the
+        target is only consulted when there is no checkpoint or when
+        verification was requested.
+        """
+        if self._store is None:
+            return self._trgtTable.rowver()
+
+        if self._rowver is None:
+            self._rowver = self._store.get(self.name)
+
+        if self._rowver is None or not self._verified:
+            trgtRowver = self._trgtTable.rowver()
+            if self._rowver is not None and self._rowver != trgtRowver:
+                self._log.warning(f'{self.name}: checkpoint {self._rowver}'
+                                  f' does not match target {trgtRowver},'
+                                  ' using target.')
+
+            self._rowver = trgtRowver
+            self._verified = True
+            self.checkpoint(trgtRowver)
+
+        return self._rowver
+
+    def watermarkKnown(self):
+        """True if watermark() can answer without the target"""
+        if self._trgtTable is not None:
+            return True
+
+        if self._rowver is None and self._store is not None:
+            self._rowver = self._store.get(self.name)
+
+        return self._rowver is not None and self._verified
+
+    def checkpoint(self, rowver):
+        """Records rowver as applied"""
+        self._rowver = rowver
+        if self._store is not None and rowver is not None:
+            self._store.set(self.name, rowver)
+
+    def needsInitialLoad(self):
+        # An initial load needs a checkpoint store, max(rowver) on
+        # the target would skip rows changed while the load ran.
+        return (self._commons['initial'] and self._store is not None and
+                self._store.get(self.name) is None and
+                (self.spool is None or self.spool.rowver is None) and
+                self._trgtTable.empty)
+
+    def initialLoad(self):
+        """
+        Bulk loads an empty target.
+
+        The source is split into pk ranges that are copied concurrently with
+        plain inserts, each over its own pair of connections.  The source
+        max(rowver), or change tracking version, is read before the copy and
+        checkpointed afterwards, so anything that changes during the load is
+        picked up incrementally.
+        """
+        dfPid = mp.current_process().pid
+        parts = self._commons['initialParallel']
+        if self.changeTracking:
+            startRowver = self._srcTable.ctVersion()
+        else:
+            startRowver = self._srcTable.rowver()
+        ranges = self._srcTable.pkRanges(parts)
+
+        self._log.debug(f'({dfPid}) {self.name}: initial load of'
+                        f' {len(ranges)} ranges.')
+
+        try:
+            with ThreadPoolExecutor(max_workers=parts) as pool:
+                rowCount = sum(pool.map(self.loadRange, ranges))
+        except Exception:
+            # start over on the next cycle rather than leave a gap
+            self._trgtTable.truncate()
+            raise
+
+        self.checkpoint(startRowver)
+        self._log.debug(f'({dfPid}) {self.name}: initial load complete.'
+                        f' {rowCount} rows.')
+        return rowCount
+
+    def loadRange(self, bounds):
+        """
+        Copies a range over a pair of connections of its own.  When the
+        pool is at its cap, ranges take turns on the job's connections.
+        """
+        conf = self._conf
+        tables = []
+        try:
+            for side in ('source', 'target'):
+                tables.append(sqlTable(
+                    connection=self.acquire(conf[side]['connStr'], 'load',
+                                            timeout=0),
+                    schemaName=conf[side]['schema'],
+                    tableName=conf[side]['name']
+                ))
+        except TimeoutError:
+            for table in tables:
+                self.release(table)
+
+            with self._loadLock:
+                return self.copyRange(self._srcTable, self._trgtTable,
+                                      bounds)
+
+        srcTable, trgtTable = tables
+        srcTable.passThrough = self._commons['passThrough']
+        try:
+            return self.copyRange(srcTable, trgtTable, bounds)
+        finally:
+            self.release(srcTable)
+            self.release(trgtTable)
+
+    def copyRange(self, srcTable, trgtTable, bounds):
+        rowCount = 0
+        columns = srcTable.columns
+        for rowSet in srcTable.rangeRows(*bounds,
+                                         count=self._commons['commit']):
+            trgtTable.insert(rowSet, columns)
+            rowCount += len(rowSet)
+
+        return rowCount
+
+    def sampleLag(self):
+        """
+        Source max(rowver) minus the applied watermark, sampled at most
+        every lagInterval seconds since it may scan the source.
+        """
+        interval = self._commons['lagInterval']
+        if not interval or time.time() - self._lagSampled < interval:
+            return None
+
+        self._lagSampled = time.time()
+        return self.lag(self.sourceMark())
+
+    def sourceMark(self):
+        """Source max(rowver), or change tracking version"""
+        if self.changeTracking:
+            return self._srcTable.ctVersion()
+
+        return self._srcTable.rowver()
+
+    def lag(self, mark):
+        """The source mark minus the applied watermark"""
+        if self.changeTracking:
+            return max(0, mark - (self._rowver or 0))
+
+        def toInt(rowver):
+            return int.from_bytes(rowver, 'big') if rowver else 0
+
+        return max(0, toInt(mark) - toInt(self.watermark()))
+
+    def modifyDates(self):
+        return tuple(None if table is None else table.modifyDate
+                     for table in (self._srcTable, self._trgtTable))
+
+    def stale(self):
+        """True if either table's schema changed since it was connected"""
+        return self.modifyDates() != self._modifyDates
+
+    def holdRowvers(self, rowSet, rowverIdx, pkIdx):
+        """
+        Nulls the rowver of the rows of a row set from the first one with a
+        long value on, returns (rowver, pk values...) for each of them.
+        Until streamLobs puts them back, max(rowver) on the target stays
+        below every row with an unfinished value, so a failed cycle reads
+        them again even without a checkpoint.
+        """
+        keys = {key for key, _, _ in rowSet.long}
+        first = next(i for i, row in enumerate(rowSet)
+                     if tuple(row[j] for j in pkIdx) in keys)
+
+        rowvers = rowSet.column('[rowver]') \
+            if isinstance(rowSet, ColumnBatch) else None
+        held = []
+        for i in range(first, len(rowSet)):
+            row = rowSet[i]
+            held.append((row[rowverIdx], *(row[j] for j in pkIdx)))
+            if rowvers is None:
+                rowSet[i] = row[:rowverIdx] + (None,) + row[rowverIdx + 1:]
+            else:
+                rowvers[i] = None
+
+        return held
+
+    def streamLobs(self, long, held):
+        """
+        Writes the rest of the values rows() cut at lobChunk to the target,
+        a chunk at a time, then puts back the rowvers holdRowvers held.
+        Chunks are read over a connection of their own, the source one may
+        be busy prefetching.
+        """
+        started = time.perf_counter()
+        for key, column, size in long:
+            self._trgtTable.appendLob(
+                key, column, self._lobTable.lobChunks(key, column, size))
+        self._trgtTable.setRowvers(held)
+        self.stats.add('lob', time.perf_counter() - started)
+
+    def fetched(self, rows):
+        """Feeds source page latency to the sizer, if adaptive"""
+        sizer = self.sizer
+        if sizer is None or not rows:
+            return
+
+        self._pageRows += rows
+        if self._pageRows >= sizer.batch:
+            fetchSeconds = self.stats.seconds['fetch']
+            sizer.paged(self._pageRows, fetchSeconds - self._pageSeconds)
+            self._srcTable.batch = sizer.batch
+            self._pageRows = 0
+            self._pageSeconds = fetchSeconds
+
+    def merged(self, rows, timings):
+        """Feeds merge latency to the sizer, if adaptive"""
+        sizer = self.sizer
+        if sizer is None:
+            return
+
+        sizer.merged(rows, sum(seconds for phase, seconds in timings.items()
+                               if phase != 'connect'))
+        self._srcTable.batch = sizer.batch
+        self._srcTable.commit = sizer.commit
+
+    def run(self):
+        """
+        Runs a single replication cycle, returns the rows moved.
+        Timings and counters for the cycle are left in self.stats.
+        """
+        self.stats = CycleStats()
+        self._pageRows = 0
+        self._pageSeconds = 0.0
+        sizes = (self.sizer.batch, self.sizer.commit) if self.sizer else None
+
+        try:
+            if self.changeTracking:
+                rowCount = self.ctCycle()
+            elif self.spool is not None:
+                rowCount = self.spoolCycle()
+            else:
+                rowCount = self.cycle()
+            self.stats.rows = rowCount
+
+            if self.sizer is not None:
+                self.stats.batch = self.sizer.batch
+                self.stats.commit = self.sizer.commit
+                if sizes != (self.sizer.batch, self.sizer.commit):
+                    self._log.debug(f'{self.name}: batch {self.sizer.batch},'
+                                    f' commit {self.sizer.commit}.')
+
+            return rowCount
+
+        except Exception:
+            self.stats.errors = 1
+            self.close()
+            raise
+
+    def cycle(self):
+        dfPid = mp.current_process().pid
+        stats = self.stats
+
+        if self.connected and self.stale():
+            self._log.debug(
+                f'({dfPid}) {self.name}: schema changed, rebuilding.')
+            self.close()
+
+        if not self.connected:
+            started = time.perf_counter()
+            self.connect()
+            stats.add('connect', time.perf_counter() - started)
+
+        if self.needsInitialLoad():
+            return self.initialLoad()
+
+        srcTable = self._srcTable
+        trgtTable = self._trgtTable
+
+        # resolve the columns before the source connection is handed
+        # to the prefetch thread.
+        columns = srcTable.columns
+        rowverIdx = columns.index('[rowver]')
+        pkIdx = [columns.index(col) for col in srcTable.pkColumns]
+        depth = self._commons['depth']
+
+        rowCount = 0
+        source = srcTable.rows(self.watermark(),
+                               drain=self._commons['drain'],
+                               maxRows=self._commons['drainRows'],
+                               maxSeconds=self._commons['drainSeconds'],
+                               columnar=self._commons['columnar'])
+        rowSets = stats.timed('fetch', source)
+        if depth:
+            rowSets = prefetch(rowSets, depth)
+
+        # a failed merge must stop the producer and its cursor before the
+        # source connection goes back to the pool
+        try:
+            for rowSet in rowSets:
+                if rowSet:
+                    self.fetched(len(rowSet))
+                    rowver = rowSet[-1][rowverIdx]
+                    long = getattr(rowSet, 'long', None)
+                    if long:
+                        held = self.holdRowvers(rowSet, rowverIdx, pkIdx)
+                    trgtTable.merge(rowSet, columns)
+                    stats.merge(trgtTable.timings)
+                    self.merged(len(rowSet), trgtTable.timings)
+                    if long:
+                        self.streamLobs(long, held)
+                    self.checkpoint(rowver)
+                    rowCount += len(rowSet)
+        finally:
+            rowSets.close()
+            source.close()
+
+        stats.lag = self.sampleLag()
+        return rowCount
+
+    def ctCycle(self):
+        """
+        A cycle reading the source through change tracking instead of
+        rowver.  The watermark is the change tracking version applied to
+        the target.  Changed rows are read back from the source by pk and
+        merged, deleted ones are deleted from the target.
+
+        Without a checkpoint, or once the source has cleaned up changes
+        the target has not seen, the target is reloaded from a full copy.
+        Reads a single page of self.batch changes unless drain is set.
+        """
+        dfPid = mp.current_process().pid
+        stats = self.stats
+        commons = self._commons
+
+        if self._store is None:
+            raise ValueError(f'{self.name}: change tracking needs a'
+                             ' checkpoint store.')
+
+        if self.connected and self.stale():
+            self._log.debug(
+                f'({dfPid}) {self.name}: schema changed, rebuilding.')
+            self.close()
+
+        if not self.connected:
+            started = time.perf_counter()
+            self.connect()
+            stats.add('connect', time.perf_counter() - started)
+
+        srcTable = self._srcTable
+        trgtTable = self._trgtTable
+        self._backlog = False
+
+        minVersion = srcTable.ctMinVersion()
+        if minVersion is None:
+            raise ValueError(f'{self.name}: change tracking is not enabled'
+                             f' on {srcTable.name}.')
+
+        if self._rowver is None:
+            self._rowver = self._store.get(self.name)
+
+        version = self._rowver
+        if version is None or version < minVersion:
+            if version is not None:
+                self._log.warning(f'{self.name}: changes after version'
+                                  f' {version} are no longer tracked,'
+                                  ' reloading.')
+            if not trgtTable.empty:
+                trgtTable.truncate()
+            return self.initialLoad()
+
+        upTo = srcTable.ctVersion()
+        columns = srcTable.columns
+        maxRows = commons['drainRows'] if commons['drain'] else \
+            int(srcTable.batch)
+        maxSeconds = commons['drainSeconds'] if commons['drain'] else 0
+        started = time.monotonic()
+
+        rowCount = 0
+        changes = srcTable.changes(version, upTo)
+        try:
+            for applied, rows, keys in stats.timed('fetch', changes):
+                if rows:
+                    trgtTable.merge(rows, columns)
+                    stats.merge(trgtTable.timings)
+                    self.merged(len(rows), trgtTable.timings)
+
+                if keys:
+                    trgtTable.delete(keys)
+                    stats.merge(trgtTable.timings)
+
+                self.checkpoint(applied)
+                rowCount += len(rows) + len(keys)
+
+                # stop only once the watermark moved, a single version
+                # may hold more changes than a page
+                if applied > version and (
+                        (maxRows and rowCount >= maxRows) or
+                        (maxSeconds and
+                         time.monotonic() - started >= maxSeconds)):
+                    self._backlog = True
+                    break
+            else:
+                self.checkpoint(upTo)
+        finally:
+            changes.close()
+
+        stats.lag = self.sampleLag()
+        return rowCount
+
+    def spoolCycle(self):
+        """
+        A cycle with a spool between source and target.  Rows are read
+        from the source into the spool whether or not the target can be
+        reached, then whatever the target takes is applied from the spool.
+        """
+        dfPid = mp.current_process().pid
+        stats = self.stats
+        spool = self.spool
+
+        if (self._srcTable is not None or self._trgtTable is not None) and \
+                self.stale():
+            self._log.debug(
+                f'({dfPid}) {self.name}: schema changed, rebuilding.')
+            self.close()
+
+        started = time.perf_counter()
+        if self._srcTable is None:
+            self.connectSource()
+
+        if self._trgtTable is None:
+            try:
+                self.connectTarget()
+            except Exception as e:
+                self._log.warning(f'({dfPid}) {self.name}: target'
+                                  f' unavailable, spooling only. {e}')
+                stats.errors = 1
+        stats.add('connect', time.perf_counter() - started)
+
+        if self._trgtTable is not None and self.needsInitialLoad():
+            self._backlog = False
+            return self.initialLoad()
+
+        fetchBacklog = False
+        full = spool.size >= self._commons['spoolBytes']
+        if not full and (spool.rowver is not None or self.watermarkKnown()):
+            start = spool.rowver
+            if self.watermarkKnown():
+                applied = self.watermark()
+                if start is None or (applied is not None and applied > start):
+                    start = applied
+
+            full = self.fill(start)
+            fetchBacklog = not full and not self._srcTable.caughtUp
+
+        rowCount = 0
+        if self._trgtTable is not None:
+            try:
+                rowCount = self.applySpool()
+            except Exception as e:
+                self._log.warning(f'({dfPid}) {self.name}: apply failed,'
+                                  f' rows stay spooled. {e}')
+                stats.errors = 1
+                self.closeTarget()
+
+        applyBacklog = (self._trgtTable is not None and
+                        spool.rowver is not None and
+                        spool.rowver != self._rowver)
+        self._backlog = fetchBacklog or applyBacklog
+
+        if self.watermarkKnown():
+            stats.lag = self.sampleLag()
+
+        return rowCount
+
+    def fill(self, rowver):
+        """
+        Reads source rows past rowver into the spool.  Returns True if it
+        stopped because the spool reached spoolBytes.
+        """
+        stats = self.stats
+        spool = self.spool
+        columns = self._srcTable.columns
+        rowverIdx = columns.index('[rowver]')
+
+        rowSets = self._srcTable.rows(rowver,
+                                      drain=self._commons['drain'],
+                                      maxRows=self._commons['drainRows'],
+                                      maxSeconds=self._commons['drainSeconds'],
+                                      columnar=self._commons['columnar'])
+        try:
+            for rowSet in stats.timed('fetch', rowSets):
+                if rowSet:
+                    started = time.perf_counter()
+                    spool.append(rowSet[-1][rowverIdx], columns, rowSet)
+                    stats.add('spool', time.perf_counter() - started)
+                    self.fetched(len(rowSet))
+
+                if spool.size >= self._commons['spoolBytes']:
+                    return True
+        finally:
+            rowSets.close()
+
+        return False
+
+    def applySpool(self):
+        """Applies spooled row sets to the target, returns the rows applied"""
+        stats = self.stats
+        spool = self.spool
+        trgtTable = self._trgtTable
+        maxSeconds = self._commons['drainSeconds']
+        started = time.time()
+
+        rowCount = 0
+        try:
+            # records spooled before a schema change carry their own
+            # columns, merge keeps statements per column set
+            for rowver, columns, rows in spool.records(self.watermark()):
+                trgtTable.merge(rows, columns)
+                stats.merge(trgtTable.timings)
+                self.merged(len(rows), trgtTable.timings)
+                self.checkpoint(rowver)
+                rowCount += len(rows)
+
+                if maxSeconds and time.time() - started >= maxSeconds:
+                    break
+        finally:
+            if self._rowver is not None:
+                spool.release(self._rowver)
+
+        return rowCount
+
+
+class Branch:
+    """
+    Applies the row sets of a Fanout cycle to one target on its own
+    thread.  Rows at or below the target's watermark are skipped.
+    """
+
+    end = object()
+
+    def __init__(self, flow, after, columns, stats, depth):
+        self.flow = flow
+        self.rows = 0
+        self.error = None
+        self.idle = True
+        self.held = 0.0
+        self.detached = False
+        self._columns = columns
+        self._rowverIdx = columns.index('[rowver]')
+        self._after = after
+        self._stats = stats
+        self.queue = queue.Queue(maxsize=depth)
+        self.thread = threading.Thread(target=self.apply, daemon=True)
+        self.thread.start()
+
+    @property
+    def alive(self):
+        return self.thread.is_alive()
+
+    @property
+    def waiting(self):
+        """True if the target is done with everything it was handed"""
+        return self.alive and self.idle and self.queue.empty()
+
+    def apply(self):
+        trgtTable = self.flow.target
+        rowverIdx = self._rowverIdx
+
+        try:
+            while True:
+                self.idle = True
+                rowSet = self.queue.get()
+                self.idle = False
+                if rowSet is Branch.end:
+                    return
+
+                after = self._after
+                if after is not None and rowSet[0][rowverIdx] <= after:
+                    rowSet = [row for row in rowSet
+                              if row[rowverIdx] > after]
+                    if not rowSet:
+                        continue
+
+                trgtTable.merge(rowSet, self._columns)
+                self._stats.merge(trgtTable.timings)
+                self.flow.checkpoint(rowSet[-1][rowverIdx])
+                self.rows += len(rowSet)
+
+        except Exception as e:
+            self.error = e
+
+    def stop(self):
+        """Queues the end of the cycle and waits for the thread"""
+        while self.alive:
+            try:
+                self.queue.put(Branch.end, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+
+        self.thread.join()
+
+
+class Fanout:
+    """
+    One source table replicated to several targets from a single read.
+
+    Every target is a Dataflow of its own, named job>label, with its own
+    target connection, checkpoint and initial load.  They share a single
+    source connection.  A cycle reads the source once from the lowest of
+    their watermarks and hands each row set to a Branch per target.  A
+    target that keeps the others waiting for rows is detached for the
+    rest of the cycle and catches up from its own watermark on the next
+    one.
+    """
+
+    # seconds per cycle a target may keep the others waiting for rows,
+    # so targets that keep pace are not detached on a race
+    patience = 1.0
+
+    def __init__(self, name, conf, commons, store=None, catalogs=None,
+                 pool=None):
+        self.name = name
+        self.spool = None
+        self.stats = CycleStats()
+        self._commons = commons
+        self._backlog = False
+        self._srcTable = None
+        self._srcModified = None
+        self._lagSampled = 0
+        self._log = logging.getLogger('replicator')
+
+        if commons['spool']:
+            self._log.warning(f'{name}: spooling is not supported with'
+                              ' several targets, spool disabled.')
+            commons = dict(commons, spool=None)
+
+        if commons['lobChunk']:
+            self._log.warning(f'{name}: LOB values are read whole with'
+                              ' several targets.')
+            commons = dict(commons, lobChunk=0)
+
+        self.flows = [
+            Dataflow(f"{name}>{target['label']}",
+                     dict(conf, target=target), commons, store, catalogs,
+                     pool)
+            for target in conf['targets']
+        ]
+
+    @property
+    def backlog(self):
+        return self._backlog
+
+    def close(self):
+        for flow in self.flows:
+            flow.close()
+
+        self.closeSource()
+
+    def connectSource(self):
+        """Connects the source the targets read from, once for all"""
+        self.flows[0].connectSource()
+        self._srcTable = self.flows[0].source
+        self._srcModified = self._srcTable.modifyDate
+        for flow in self.flows:
+            flow.share(self._srcTable)
+
+    def closeSource(self):
+        if self._srcTable is not None:
+            self.flows[0].release(self._srcTable)
+
+        self._srcTable = None
+
+    def run(self):
+        """
+        Runs a single replication cycle, returns the rows applied to all
+        targets.  A failing target does not fail the others.
+        """
+        self.stats = CycleStats()
+
+        try:
+            rowCount = self.cycle()
+            self.stats.rows = rowCount
+            return rowCount
+
+        except Exception:
+            self.stats.errors += 1
+            self.close()
+            raise
+
+    def ready(self):
+        """Connects the targets, returns the ones to read for"""
+        dfPid = mp.current_process().pid
+        flows = []
+        loaded = 0
+
+        if self._srcTable is not None and \
+                self._srcTable.modifyDate != self._srcModified:
+            self._log.debug(f'({dfPid}) {self.name}: source schema changed,'
+                            ' rebuilding.')
+            self.close()
+
+        if self._srcTable is None:
+            self.connectSource()
+
+        for flow in self.flows:
+            try:
+                if flow.connected and flow.stale():
+                    self._log.debug(
+                        f'({dfPid}) {flow.name}: schema changed, rebuilding.')
+                    flow.close()
+
+                if not flow.connected:
+                    if flow.source is None:
+                        flow.share(self._srcTable)
+                    started = time.perf_counter()
+                    flow.connect()
+                    self.stats.add('connect', time.perf_counter() - started)
+
+                if flow.needsInitialLoad():
+                    loaded += flow.initialLoad()
+                else:
+                    flows.append(flow)
+
+            except Exception as e:
+                self._log.warning(f'({dfPid}) {flow.name}: {e}')
+                self.stats.errors += 1
+                flow.close()
+
+        return flows, loaded
+
+    def feed(self, branches, rowSet):
+        """
+        Hands rowSet to every attached branch.  Waits for full queues
+        unless the other branches have been left without work for more
+        than patience seconds this cycle.
+        """
+        pending = [b for b in branches if not b.detached and b.alive]
+        while pending:
+            for branch in list(pending):
+                try:
+                    branch.queue.put_nowait(rowSet)
+                    pending.remove(branch)
+                except queue.Full:
+                    if not branch.alive:
+                        pending.remove(branch)
+
+            if not pending:
+                return
+
+            time.sleep(0.01)
+            if any(b.waiting for b in branches if b not in pending):
+                for branch in list(pending):
+                    branch.held += 0.01
+                    if branch.held >= Fanout.patience:
+                        self._log.debug(f'{branch.flow.name}: target is'
+                                        ' behind, detached for this cycle.')
+                        branch.detached = True
+                        pending.remove(branch)
+
+    def cycle(self):
+        dfPid = mp.current_process().pid
+        stats = self.stats
+
+        flows, rowCount = self.ready()
+        self._backlog = False
+        if not flows:
+            return rowCount
+
+        srcTable = self._srcTable
+        columns = srcTable.columns
+        depth = max(1, self._commons['depth'])
+
+        # metadata comes from the catalog, which stays on this thread
+        for flow in flows:
+            flow.target.mergeStatement(columns)
+
+        marks = [flow.watermark() for flow in flows]
+        start = None if None in marks else min(marks)
+        branches = [Branch(flow, mark, columns, stats, depth)
+                    for flow, mark in zip(flows, marks)]
+
+        stopped = False
+        rowSets = srcTable.rows(start,
+                                self._commons['commit'],
+                                drain=self._commons['drain'],
+                                maxRows=self._commons['drainRows'],
+                                maxSeconds=self._commons['drainSeconds'],
+                                columnar=self._commons['columnar'])
+        try:
+            for rowSet in stats.timed('fetch', rowSets):
+                if rowSet:
+                    self.feed(branches, rowSet)
+
+                if not any(b.alive and not b.detached for b in branches):
+                    stopped = True
+                    break
+        finally:
+            rowSets.close()
+            for branch in branches:
+                branch.stop()
+
+        for branch in branches:
+            rowCount += branch.rows
+            if branch.error is not None:
+                self._log.warning(f'({dfPid}) {branch.flow.name}:'
+                                  f' {branch.error}')
+                stats.errors += 1
+                branch.flow.close()
+
+        self._backlog = any(b.detached for b in branches) or \
+            (not stopped and not srcTable.caughtUp)
+
+        # the source is sampled once for all targets
+        interval = self._commons['lagInterval']
+        if interval and time.time() - self._lagSampled >= interval:
+            self._lagSampled = time.time()
+            mark = srcTable.rowver()
+            lags = [flow.lag(mark) for flow in flows if flow.connected]
+            stats.lag = max(lags) if lags else None
+
+        return rowCount
+
+
+def procWorker(commons, jobs, conn):
+    """
+    Worker process.  Receives job names on conn, runs one cycle of the
+    job and sends back (jobName, rowCount, backlog, stats).  A None task
+    stops the worker.
+    """
+    wName = mp.current_process().name
+    wPid = mp.current_process().pid
+    qh = logging.handlers.QueueHandler(commons['logQ'])
+    root = logging.getLogger()
+    root.setLevel(commons['lvl'])
+    root.addHandler(qh)
+    wLogger = logging.getLogger('replicator')
+
+    wLogger.debug(f'({wPid}) {wName}: Worker started.')
+
+    store = None
+    if commons['checkpoint']:
+        store = CheckpointStore(commons['checkpoint'])
+
+    catalogs = {} if commons['catalog'] else None
+    pool = Pool(commons['poolSize'], commons['poolCheck'],
+                commons['shareConnections'])
+
+    flows = {}
+    while True:
+        try:
+            jobName = conn.recv()
+        except EOFError:
+            break
+
+        if jobName is None:
+            break
+
+        if jobName not in flows:
+            flow = Fanout if 'targets' in jobs[jobName] else Dataflow
+            flows[jobName] = flow(jobName, jobs[jobName], commons,
+                                  store, catalogs, pool)
+
+        flow = flows[jobName]
+        rowCount = 0
+        try:
+            wLogger.debug(f'({wPid}) {jobName}: Running dataflow processes.')
+            rowCount = flow.run()
+            wLogger.debug(f'({wPid}) {jobName}: Completed dataflow processes.'
+                          f' {rowCount} rows.')
+        except Exception:
+            e = sys.exc_info()
+            ex = f'({wPid}) {jobName}: {e[1]}'
+            wLogger.critical(''.join(traceback.format_tb(e[2])))
+            wLogger.critical('{0}: {1}'.format(e[0], ex))
+
+        conn.send((jobName, rowCount, flow.backlog, flow.stats.snapshot()))
+
+    for flow in flows.values():
+        flow.close()
+        if flow.spool is not None:
+            flow.spool.close()
+
+    if store is not None:
+        store.close()
+
+    for catalog in (catalogs or {}).values():
+        catalog.close()
+
+    pool.close()
+
+    wLogger.debug(f'({wPid}) {wName}: Worker stopped.')
@@ -0,0 +1,146 @@
+import hashlib
+import os
+import socket
+import sqlite3
+import time
+
+
+def nodeName():
+    """Default name of this replicator instance"""
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+class Leases:
+    """
+    Job ownership shared by several replicator instances.
+
+    Backed by a sqlite file every instance can reach.  Each instance, or
+    node, renews a heartbeat and its job leases every seconds / 3.  Jobs are
+    split evenly among the live nodes by rendezvous hashing, capped at a
+    fair share per node.  Nodes therefore agree on the split without
+    talking to each other, and a node joining or leaving moves few jobs.
+
+    A node claims a job that ranks it highest once the job's lease is free
+    or expired.  It gives a job up when another node ranks higher, but not
+    while a cycle of the job is still running.  The leases of a node that
+    died expire after seconds, and the remaining nodes take its jobs over.
+    Node clocks must agree to well within seconds.
+    """
+
+    def __init__(self, path, node=None, seconds=30):
+        self._path = path
+        self.node = node or nodeName()
+        self._seconds = seconds
+        self._renewed = 0
+        self._held = set()
+        self._connection = sqlite3.connect(path, timeout=30,
+                                           isolation_level=None)
+        self._connection.executescript("""
+            create table if not exists nodes (
+                node text primary key,
+                seen real
+            );
+            create table if not exists leases (
+                job text primary key,
+                node text,
+                expires real
+            );
+        """)
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def interval(self):
+        """Seconds between renewals"""
+        return self._seconds / 3
+
+    def due(self):
+        """Seconds until the next renewal is due"""
+        return max(0, self._renewed + self.interval - time.time())
+
+    def owners(self, jobs, nodes):
+        """
+        Maps each job to a node.  A job goes to the node that ranks highest
+        for it and still has less than its fair share of jobs.
+        """
+        share = -(-len(jobs) // len(nodes))
+        counts = {node: 0 for node in nodes}
+        owners = {}
+
+        for job in sorted(jobs):
+            ranked = sorted(nodes, reverse=True, key=lambda node: hashlib.sha1(
+                f'{job}/{node}'.encode()).digest())
+            node = next(node for node in ranked if counts[node] < share)
+            counts[node] += 1
+            owners[job] = node
+
+        return owners
+
+    def held(self, jobs, busy=()):
+        """
+        The jobs of jobs this node may run, renewing the leases first if a
+        renewal is due.  busy are jobs with a cycle running on this node.
+        """
+        if self.due() == 0:
+            self._held = self.renew(jobs, busy)
+
+        return self._held
+
+    def renew(self, jobs, busy=()):
+        """Heartbeats, renews, claims and gives up leases"""
+        now = time.time()
+        expires = now + self._seconds
+        mine = set()
+        db = self._connection
+
+        db.execute('begin immediate;')
+        try:
+            db.execute("""
+                insert into nodes (node, seen) values (?, ?)
+                on conflict (node) do update set seen = excluded.seen;
+            """, (self.node, now))
+            db.execute('delete from nodes where seen < ?;',
+                       (now - 10 * self._seconds,))
+
+            nodes = [row[0] for row in db.execute(
+                'select node from nodes where seen >= ?;',
+                (now - self._seconds,))]
+            leases = {job: (node, until) for job, node, until in db.execute(
+                'select job, node, expires from leases;')}
+
+            owners = self.owners(jobs, nodes)
+            for job in jobs:
+                holder, until = leases.get(job, (None, 0))
+                wanted = owners[job] == self.node
+
+                if holder == self.node and not wanted and job not in busy:
+                    db.execute('delete from leases where job = ?;', (job,))
+                elif holder == self.node or (
+                        wanted and (holder is None or until < now)):
+                    db.execute("""
+                        insert into leases (job, node, expires)
+                        values (?, ?, ?)
+                        on conflict (job) do update
+                        set node = excluded.node, expires = excluded.expires;
+                    """, (job, self.node, expires))
+                    if wanted:
+                        mine.add(job)
+
+            db.execute('commit;')
+        except Exception:
+            db.execute('rollback;')
+            raise
+
+        self._renewed = now
+        return mine
+
+    def close(self):
+        """Gives up every lease of this node and leaves"""
+        db = self._connection
+        db.execute('begin immediate;')
+        db.execute('delete from leases where node = ?;', (self.node,))
+        db.execute('delete from nodes where node = ?;', (self.node,))
+        db.execute('commit;')
+        db.close()
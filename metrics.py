@@ -0,0 +1,200 @@
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+PHASES = ('connect', 'fetch', 'spool', 'stage', 'update', 'insert',
+          'delete', 'lob', 'commit')
+
+
+class CycleStats:
+    """
+    Timings and counters for one cycle of a job, collected in the worker.
+    Safe to use from the prefetch thread.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.rows = 0
+        self.errors = 0
+        self.lag = None
+        self.batch = None
+        self.commit = None
+        self.seconds = {phase: 0.0 for phase in PHASES}
+        self.started = time.time()
+
+    def add(self, phase, seconds):
+        with self._lock:
+            self.seconds[phase] += seconds
+
+    def merge(self, timings):
+        """Adds the timings of a Table operation"""
+        with self._lock:
+            for phase, seconds in timings.items():
+                if phase in self.seconds:
+                    self.seconds[phase] += seconds
+
+    def timed(self, phase, rowSets):
+        """Wraps a row set generator, timing each fetch"""
+        while True:
+            started = time.perf_counter()
+            try:
+                rowSet = next(rowSets)
+            except StopIteration:
+                return
+            finally:
+                self.add(phase, time.perf_counter() - started)
+
+            yield rowSet
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'rows': self.rows,
+                'errors': self.errors,
+                'lag': self.lag,
+                'batch': self.batch,
+                'commit': self.commit,
+                'seconds': dict(self.seconds),
+                'duration': time.time() - self.started,
+            }
+
+
+class Metrics:
+    """
+    Per-job metrics aggregated by the supervisor from cycle snapshots.
+    Exported in Prometheus text format over http and/or as a json file.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jobs = {}
+
+    def record(self, job, snapshot):
+        with self._lock:
+            stats = self._jobs.setdefault(job, {
+                'cycles': 0,
+                'rows': 0,
+                'errors': 0,
+                'lag': None,
+                'batch': None,
+                'commit': None,
+                'seconds': {phase: 0.0 for phase in PHASES},
+                'lastRun': None,
+                'lastRows': 0,
+                'lastRowsPerSecond': 0.0,
+            })
+
+            stats['cycles'] += 1
+            stats['rows'] += snapshot['rows']
+            stats['errors'] += snapshot['errors']
+            stats['lastRun'] = time.time()
+            stats['lastRows'] = snapshot['rows']
+            if snapshot['duration'] > 0:
+                stats['lastRowsPerSecond'] = \
+                    snapshot['rows'] / snapshot['duration']
+
+            if snapshot['lag'] is not None:
+                stats['lag'] = snapshot['lag']
+
+            if snapshot['batch'] is not None:
+                stats['batch'] = snapshot['batch']
+                stats['commit'] = snapshot['commit']
+
+            for phase, seconds in snapshot['seconds'].items():
+                stats['seconds'][phase] += seconds
+
+    def json(self):
+        with self._lock:
+            return json.loads(json.dumps(self._jobs))
+
+    def prometheus(self):
+        lines = []
+
+        def metric(name, kind, help, values):
+            lines.append(f'# HELP replicator_{name} {help}')
+            lines.append(f'# TYPE replicator_{name} {kind}')
+            for labels, value in values:
+                lbl = ','.join(f'{k}="{v}"' for k, v in labels.items())
+                lines.append(f'replicator_{name}{{{lbl}}} {value}')
+
+        jobs = self.json()
+        metric('cycles_total', 'counter', 'Completed cycles.',
+               [({'job': j}, s['cycles']) for j, s in jobs.items()])
+        metric('rows_total', 'counter', 'Rows applied to the target.',
+               [({'job': j}, s['rows']) for j, s in jobs.items()])
+        metric('errors_total', 'counter', 'Failed cycles.',
+               [({'job': j}, s['errors']) for j, s in jobs.items()])
+        metric('phase_seconds_total', 'counter',
+               'Time spent per dataflow phase.',
+               [({'job': j, 'phase': p}, v)
+                for j, s in jobs.items() for p, v in s['seconds'].items()])
+        metric('rows_per_second', 'gauge',
+               'Throughput of the last cycle.',
+               [({'job': j}, s['lastRowsPerSecond'])
+                for j, s in jobs.items()])
+        metric('rowver_lag', 'gauge',
+               'Source max(rowver) minus the applied watermark.',
+               [({'job': j}, s['lag'])
+                for j, s in jobs.items() if s['lag'] is not None])
+        metric('batch_rows', 'gauge',
+               'Rows per source page chosen by the adaptive sizer.',
+               [({'job': j}, s['batch'])
+                for j, s in jobs.items() if s['batch'] is not None])
+        metric('commit_rows', 'gauge',
+               'Rows per merge chosen by the adaptive sizer.',
+               [({'job': j}, s['commit'])
+                for j, s in jobs.items() if s['commit'] is not None])
+        metric('last_run_timestamp_seconds', 'gauge',
+               'Unix time of the last completed cycle.',
+               [({'job': j}, s['lastRun']) for j, s in jobs.items()])
+
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port, host='127.0.0.1'):
+        """Serves /metrics (Prometheus) and /metrics.json on a thread"""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == '/metrics':
+                    body = metrics.prometheus().encode()
+                    contentType = 'text/plain; version=0.0.4'
+                elif self.path == '/metrics.json':
+                    body = json.dumps(metrics.json()).encode()
+                    contentType = 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+
+                self.send_response(200)
+                self.send_header('Content-Type', contentType)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        return server
+
+    def writeEvery(self, path, interval):
+        """Rewrites a json file with the current metrics on a thread"""
+        def write():
+            while True:
+                time.sleep(interval)
+                tmp = f'{path}.tmp'
+                with open(tmp, 'w') as f:
+                    json.dump(self.json(), f, indent=2)
+
+                # atomic so readers never see a partial file
+                os.replace(tmp, path)
+
+        thread = threading.Thread(target=write, daemon=True)
+        thread.start()
+        return thread
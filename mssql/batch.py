@@ -0,0 +1,110 @@
+from array import array
+from collections.abc import Sequence
+
+
+class ColumnLayout:
+    """
+    Storage for each column of a row set, derived from Table.schema.
+
+    Integer and floating point columns are kept in typed arrays (8 bytes per
+    value, no boxing) with a separate null mask.  Everything else is kept
+    in a plain list per column.
+    """
+
+    typeCodes = {
+        'tinyint': 'q', 'smallint': 'q', 'int': 'q', 'bigint': 'q',
+        'real': 'd', 'float': 'd',
+    }
+
+    def __init__(self, schema, columns):
+        self.columns = tuple(columns)
+        self.typeCodes = tuple(
+            ColumnLayout.typeCodes.get(
+                schema.get(col[1:-1], {}).get('DATA_TYPE'))
+            for col in self.columns)
+
+
+class ColumnBatch(Sequence):
+    """
+    A row set stored by column.
+
+    It behaves as a read-only sequence of row tuples, so it can be passed
+    straight to executemany and indexed like a list of rows, while holding
+    far fewer python objects than a list of pyodbc.Row.
+    """
+
+    def __init__(self, layout):
+        self.layout = layout
+        self._data = [array(code) if code else []
+                      for code in layout.typeCodes]
+        self._nulls = [bytearray() if code else None
+                       for code in layout.typeCodes]
+        self._len = 0
+
+    @classmethod
+    def fromRows(cls, rows, layout):
+        batch = cls(layout)
+        batch.extend(rows)
+        return batch
+
+    def extend(self, rows):
+        for i, code in enumerate(self.layout.typeCodes):
+            data = self._data[i]
+            if code:
+                nulls = self._nulls[i]
+                for row in rows:
+                    value = row[i]
+                    if value is None:
+                        data.append(0)
+                        nulls.append(1)
+                    else:
+                        data.append(value)
+                        nulls.append(0)
+            else:
+                data.extend(row[i] for row in rows)
+
+        self._len += len(rows)
+
+    def column(self, name):
+        """The values of a column, an array for numeric columns"""
+        return self._data[self.layout.columns.index(name)]
+
+    def nulls(self, name):
+        """Null mask of a numeric column, None for other columns"""
+        return self._nulls[self.layout.columns.index(name)]
+
+    def __iter__(self):
+        columns = [
+            data if nulls is None or not any(nulls) else
+            [None if null else value for value, null in zip(data, nulls)]
+            for data, nulls in zip(self._data, self._nulls)]
+        return zip(*columns)
+
+    def __len__(self):
+        return self._len
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._len))]
+
+        if index < 0:
+            index += self._len
+
+        if not 0 <= index < self._len:
+            raise IndexError('row index out of range')
+
+        return tuple(
+            None if nulls is not None and nulls[index] else data[index]
+            for data, nulls in zip(self._data, self._nulls))
+
+
+class RowSet(list):
+    """
+    A list of row tuples whose LOB values were cut at a chunk size by
+    Table.rows.  long holds (pk values, column, bytes) for every value
+    that is longer, to be streamed in chunks after the row set is merged.
+    """
+
+    def __init__(self, rows=(), long=()):
+        super().__init__(rows)
+        self.long = list(long)
@@ -0,0 +1,156 @@
+from mssql.table import templates
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+
+class Catalog:
+    """
+    Table metadata for one database, shared between worker processes.
+
+    A single cheap query reads sys.objects.modify_date for every table in
+    the database.  Only tables whose modify date changed are then re-read,
+    in one bulk catalog query.  Results are kept in a local sqlite file, so
+    a worker skips the check entirely if another worker ran it within the
+    last interval seconds.
+
+    Tables are looked up from prefetch and fan-out threads as well, so the
+    sqlite connection is shared between threads behind a lock.
+    """
+
+    def __init__(self, connStr, path, interval=60):
+        # don't persist credentials, the connection string is only a key
+        self._db = hashlib.sha1(connStr.encode()).hexdigest()
+        self._interval = interval
+        self._checked = 0
+        self._force = False
+        self._tables = {}
+
+        self._lock = threading.Lock()
+        self._store = sqlite3.connect(path, timeout=30, isolation_level=None,
+                                      check_same_thread=False)
+        self._store.execute('pragma journal_mode=wal;')
+        self._store.execute("""
+            create table if not exists catalog (
+                db text,
+                schemaName text,
+                tableName text,
+                modifyDate text,
+                meta text,
+                primary key (db, schemaName, tableName)
+            );
+        """)
+        self._store.execute("""
+            create table if not exists catalogCheck (
+                db text primary key,
+                checked real
+            );
+        """)
+
+    def invalidate(self):
+        """Forces a catalog check on the next lookup"""
+        self._force = True
+
+    def table(self, connection, schemaName, tableName):
+        """
+        Returns metadata for a table or None if it does not exist:
+            schema: same layout as Table.schema
+            pkColumns: pk column names in key order
+            modifyDate: sys.objects.modify_date as a string
+        """
+        with self._lock:
+            self.refresh(connection)
+            return self._tables.get((schemaName, tableName))
+
+    def refresh(self, connection):
+        """Re-reads changed tables, callers hold the lock"""
+        now = time.time()
+        if not self._force and now - self._checked < self._interval:
+            return
+
+        row = self._store.execute(
+            'select checked from catalogCheck where db = ?;', (self._db,)
+        ).fetchone()
+
+        if not self._force and row and now - row[0] < self._interval:
+            # another worker checked recently, use what it stored
+            self._checked = row[0]
+            self._load()
+            return
+
+        with connection.cursor() as cursor:
+            cursor.execute(templates['catalogDates'])
+            dates = {(r.TABLE_SCHEMA, r.TABLE_NAME): str(r.MODIFY_DATE)
+                     for r in cursor.fetchall()}
+
+        cached = {(r[0], r[1]): r[2] for r in self._store.execute(
+            """select schemaName, tableName, modifyDate
+               from catalog where db = ?;""", (self._db,))}
+
+        changed = {k for k, v in dates.items() if cached.get(k) != v}
+        dropped = [k for k in cached if k not in dates]
+
+        if changed:
+            since = min(dates[k] for k in changed)
+            self._read(connection, changed, dates, since)
+
+        for schemaName, tableName in dropped:
+            self._store.execute(
+                """delete from catalog
+                   where db = ? and schemaName = ? and tableName = ?;""",
+                (self._db, schemaName, tableName))
+
+        self._store.execute(
+            """insert or replace into catalogCheck (db, checked)
+               values (?, ?);""", (self._db, now))
+
+        self._checked = now
+        self._force = False
+        self._load()
+
+    def _read(self, connection, changed, dates, since):
+        """Bulk reads metadata for the changed tables"""
+        tables = {}
+        with connection.cursor() as cursor:
+            cursor.execute(templates['catalog'], since)
+            for col in cursor.fetchall():
+                key = (col.TABLE_SCHEMA, col.TABLE_NAME)
+                if key not in changed:
+                    continue
+
+                meta = tables.setdefault(key, {'schema': {}, 'pk': {}})
+                meta['schema'][col.COLUMN_NAME] = {
+                    'ORDINAL_POSITION': col.ORDINAL_POSITION,
+                    'IS_NULLABLE': col.IS_NULLABLE,
+                    'DATA_TYPE': col.DATA_TYPE,
+                    'CHARACTER_MAXIMUM_LENGTH': col.CHARACTER_MAXIMUM_LENGTH,
+                    'NUMERIC_PRECISION': col.NUMERIC_PRECISION,
+                    'NUMERIC_SCALE': col.NUMERIC_SCALE,
+                }
+                if col.PK_ORDINAL is not None:
+                    meta['pk'][col.COLUMN_NAME] = col.PK_ORDINAL
+
+        for (schemaName, tableName), meta in tables.items():
+            pk = sorted(meta['pk'], key=meta['pk'].get)
+            self._store.execute(
+                """insert or replace into catalog
+                   (db, schemaName, tableName, modifyDate, meta)
+                   values (?, ?, ?, ?, ?);""",
+                (self._db, schemaName, tableName,
+                 dates[(schemaName, tableName)],
+                 json.dumps({'schema': meta['schema'], 'pkColumns': pk})))
+
+    def _load(self):
+        self._tables = {}
+        for schemaName, tableName, modifyDate, meta in self._store.execute(
+                """select schemaName, tableName, modifyDate, meta
+                   from catalog where db = ?;""", (self._db,)):
+            meta = json.loads(meta)
+            meta['modifyDate'] = modifyDate
+            self._tables[(schemaName, tableName)] = meta
+
+    def close(self):
+        with self._lock:
+            self._store.close()
@@ -0,0 +1,160 @@
+import threading
+import time
+import pyodbc
+
+
+class Pool:
+    """
+    Connections of a worker process, keyed by connection string.
+
+    acquire hands out a connection for the caller's use until release,
+    reusing idle ones before logging in again.  Connections that sat idle
+    for checkInterval seconds are checked with a trivial query first, and
+    released connections are checked before going back to the pool, so a
+    dead session is dropped instead of handed to the next table.
+
+    maxSize caps the connections open per connection string (0 = no cap);
+    acquire waits up to timeout seconds for one to be released, or the
+    timeout it is given, and raises TimeoutError after that.
+
+    With share set, acquire(connStr, role, group) returns the same
+    connection to every caller with that key, so all tables of a job run
+    over one source and one target connection.  Shared connections are
+    only safe for tables used one after another on the same thread.
+    """
+
+    def __init__(self, maxSize=0, checkInterval=60, share=False, timeout=30):
+        self._maxSize = maxSize
+        self._checkInterval = checkInterval
+        self._share = share
+        self._timeout = timeout
+        self._cond = threading.Condition()
+        self._idle = {}
+        self._open = {}
+        self._shared = {}
+        self._leases = {}
+
+    @property
+    def size(self):
+        """Open connections per connection string"""
+        with self._cond:
+            return dict(self._open)
+
+    def acquire(self, connStr, role=None, group=None, timeout=None):
+        with self._cond:
+            key = None
+            if self._share and group is not None:
+                key = (connStr, role, group)
+                connection = self._shared.get(key)
+                if connection is not None:
+                    lease = self._leases[id(connection)]
+                    if self.healthy(connection, lease):
+                        lease['count'] += 1
+                        return connection
+
+                    # sharers still holding it fail and release it
+                    del self._shared[key]
+
+            connection = self._take(connStr, timeout)
+            self._leases[id(connection)] = {'connStr': connStr, 'key': key,
+                                            'count': 1, 'used': time.time()}
+            if key is not None:
+                self._shared[key] = connection
+
+            return connection
+
+    def release(self, connection):
+        """Returns a connection acquired from this pool"""
+        with self._cond:
+            lease = self._leases.get(id(connection))
+            if lease is None:
+                return
+
+            key = lease['key']
+            lease['count'] -= 1
+            if lease['count'] > 0:
+                # released after a failure maybe, keep others off it
+                if not self.healthy(connection) and \
+                        self._shared.get(key) is connection:
+                    del self._shared[key]
+                return
+
+            del self._leases[id(connection)]
+            if self._shared.get(key) is connection:
+                del self._shared[key]
+
+            if self.healthy(connection):
+                self._idle.setdefault(lease['connStr'], []).append(
+                    (connection, time.time()))
+            else:
+                self._discard(lease['connStr'], connection)
+
+            self._cond.notify()
+
+    def healthy(self, connection, lease=None):
+        """
+        Runs a trivial query on the connection, unless the lease shows it
+        was handed out less than checkInterval seconds ago.
+        """
+        if lease is not None and \
+                time.time() - lease['used'] < self._checkInterval:
+            lease['used'] = time.time()
+            return True
+
+        try:
+            connection.rollback()
+            connection.execute('select 1;').fetchall()
+        except Exception:
+            return False
+
+        if lease is not None:
+            lease['used'] = time.time()
+
+        return True
+
+    def _take(self, connStr, timeout=None):
+        """An idle connection for connStr or a new one, holds the lock"""
+        if timeout is None:
+            timeout = self._timeout
+        deadline = time.time() + timeout
+        while True:
+            idle = self._idle.get(connStr, [])
+            while idle:
+                connection, since = idle.pop()
+                if time.time() - since < self._checkInterval or \
+                        self.healthy(connection):
+                    return connection
+
+                self._discard(connStr, connection)
+
+            if not self._maxSize or \
+                    self._open.get(connStr, 0) < self._maxSize:
+                connection = pyodbc.connect(connStr)
+                self._open[connStr] = self._open.get(connStr, 0) + 1
+                return connection
+
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise TimeoutError(f'No free connection after'
+                                   f' {timeout}s, all {self._maxSize}'
+                                   ' are in use.')
+
+            self._cond.wait(remaining)
+
+    def _discard(self, connStr, connection):
+        self._leases.pop(id(connection), None)
+        self._open[connStr] -= 1
+        self._cond.notify()
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def close(self):
+        """Closes idle connections, leased ones are closed by their users"""
+        with self._cond:
+            for connStr, idle in self._idle.items():
+                for connection, _ in idle:
+                    self._discard(connStr, connection)
+
+            self._idle = {}
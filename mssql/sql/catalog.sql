@@ -0,0 +1,40 @@
+SET TRANSACTION ISOLATION LEVEL READ UNCOMMITTED;
+
+Declare @Since DATETIME2 = ?;
+
+select sc.TABLE_SCHEMA
+    , sc.TABLE_NAME
+    , sc.ORDINAL_POSITION
+    , sc.COLUMN_NAME
+    , sc.IS_NULLABLE
+    , sc.DATA_TYPE
+    , sc.CHARACTER_MAXIMUM_LENGTH
+    , sc.NUMERIC_PRECISION
+    , sc.NUMERIC_SCALE
+    , pk.key_ordinal as PK_ORDINAL
+from sys.objects o
+inner join sys.schemas s
+    on s.schema_id = o.schema_id
+inner join INFORMATION_SCHEMA.columns sc
+    on sc.TABLE_SCHEMA = s.name
+    and sc.TABLE_NAME = o.name
+left join (
+    select i.object_id
+        , c.name
+        , ic.key_ordinal
+    from sys.indexes i
+    inner join sys.index_columns ic
+        on ic.object_id = i.object_id
+        and ic.index_id = i.index_id
+    inner join sys.columns c
+        on c.object_id = i.object_id
+        and c.column_id = ic.column_id
+    where i.is_primary_key = 1
+) pk
+    on pk.object_id = o.object_id
+    and pk.name = sc.COLUMN_NAME
+where o.type = 'U'
+    and o.modify_date >= @Since
+order by sc.TABLE_SCHEMA
+    , sc.TABLE_NAME
+    , sc.ORDINAL_POSITION asc;
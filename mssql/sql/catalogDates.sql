@@ -0,0 +1,9 @@
+SET TRANSACTION ISOLATION LEVEL READ UNCOMMITTED;
+
+select s.name as TABLE_SCHEMA
+    , o.name as TABLE_NAME
+    , o.modify_date as MODIFY_DATE
+from sys.objects o
+inner join sys.schemas s
+    on s.schema_id = o.schema_id
+where o.type = 'U';
@@ -2,6 +2,9 @@ from os import path, listdir
 from textwrap import dedent
 import pyodbc
 import struct
+import time
+
+from mssql.batch import ColumnBatch, ColumnLayout, RowSet
 
 
 def sqlTemplate(templatePath):
@@ -36,17 +39,35 @@ def handle_datetimeoffset(dto_value):
 class Table:
     """Class for managing a sql table"""
 
-    def __init__(self, connection, schemaName, tableName):
+    strategies = ('update', 'merge', 'delete', 'insert', 'auto')
+
+    # 'auto' uses delete+insert for tables at least this wide
+    wideColumns = 100
+    wideRowBytes = 4000
+
+    def __init__(self, connection, schemaName, tableName, catalog=None):
         self._batch = 10000
+        self._commit = 500
+        self._maxBytes = 0
+        self._lobChunk = 0
+        self._passThrough = False
         self._connection = connection
         self._connection.add_output_converter(-155, handle_datetimeoffset)
+        self._catalog = catalog
 
         self._tableName = tableName
         self._schemaName = schemaName
         self._schema = {}
         self._columns = ()
-        self._pkCols = ()
+        self._pkCols = None
         self._mergeQueries = {}
+        self._stageCursor = None
+        self._deleteQueries = {}
+        self._fast = False
+        self._strategy = 'update'
+        self._appendOnly = False
+        self._caughtUp = True
+        self._timings = {}
 
     def __dict__(self):
         return self.__dict__
@@ -109,6 +130,88 @@ class Table:
     def batch(self, size):
         self._batch = size
 
+    @property
+    def commit(self):
+        """Rows per row set from rows() when no count is given"""
+        return self._commit
+
+    @commit.setter
+    def commit(self, size):
+        self._commit = size
+
+    @property
+    def maxBytes(self):
+        """Estimated bytes a row set from rows() may hold, 0 for no limit"""
+        return self._maxBytes
+
+    @maxBytes.setter
+    def maxBytes(self, size):
+        self._maxBytes = size
+
+    @property
+    def lobChunk(self):
+        """
+        Bytes of a varchar(max), nvarchar(max) or varbinary(max) value
+        read by rows(), the rest is left to lobChunks().  0 reads values
+        whole.
+        """
+        return self._lobChunk
+
+    @lobChunk.setter
+    def lobChunk(self, size):
+        self._lobChunk = size
+
+    @property
+    def passThrough(self):
+        """
+        Read datetimeoffset values as the server formats them, in the same
+        statement, instead of converting each one with
+        handle_datetimeoffset.
+        """
+        return self._passThrough
+
+    @passThrough.setter
+    def passThrough(self, enabled):
+        self._passThrough = enabled
+
+    def selectExpr(self, column, prefix=''):
+        """The select list expression that reads column"""
+        if self.passThrough and \
+                self.schema[column[1:-1]]['DATA_TYPE'] == 'datetimeoffset':
+            return f'convert(nvarchar(34), {prefix}{column}, 121) as {column}'
+
+        return f'{prefix}{column}'
+
+    @property
+    def fast(self):
+        """Stage rows with fast_executemany"""
+        return self._fast
+
+    @fast.setter
+    def fast(self, enabled):
+        self._fast = enabled
+
+    @property
+    def strategy(self):
+        """Apply strategy: update, merge, delete, insert or auto"""
+        return self._strategy
+
+    @strategy.setter
+    def strategy(self, strategy):
+        if strategy not in Table.strategies:
+            raise ValueError(f'Unknown apply strategy: {strategy}')
+
+        self._strategy = strategy
+
+    @property
+    def appendOnly(self):
+        """Rows are never updated at the source"""
+        return self._appendOnly
+
+    @appendOnly.setter
+    def appendOnly(self, appendOnly):
+        self._appendOnly = appendOnly
+
     @property
     def name(self):
         return f'[{self._schemaName}].[{self._tableName}]'
@@ -120,6 +223,11 @@ class Table:
         if self._schema:
             return self._schema
 
+        if self._catalog is not None:
+            meta = self._meta()
+            self._schema = meta['schema'] if meta else {}
+            return self._schema
+
         query = templates['tableSchema']
         with self._connection.cursor() as cursor:
             cursor.execute(query, self._schemaName, self._tableName)
@@ -145,6 +253,17 @@ class Table:
         if self._columns:
             return self._columns
 
+        if self._catalog is not None:
+            # same order as tableColumns: non-pk columns, then the pk
+            pk = self.pkColumns
+            cols = sorted(self.schema.items(),
+                          key=lambda c: (f'[{c[0]}]' in pk,
+                                         pk.index(f'[{c[0]}]')
+                                         if f'[{c[0]}]' in pk else 0,
+                                         c[1]['ORDINAL_POSITION']))
+            self._columns = tuple([f"[{col}]" for col, _ in cols])
+            return self._columns
+
         query = templates['tableColumns']
         with self._connection.cursor() as cursor:
             cursor.execute(query, self._schemaName, self._tableName)
@@ -156,7 +275,14 @@ class Table:
     def pkColumns(self):
         """Returns tuple representing the pk columns"""
 
-        if self._pkCols:
+        # a table without a pk caches (), None is not looked up yet
+        if self._pkCols is not None:
+            return self._pkCols
+
+        if self._catalog is not None:
+            meta = self._meta()
+            pk = meta['pkColumns'] if meta else []
+            self._pkCols = tuple([f"[{col}]" for col in pk])
             return self._pkCols
 
         query = templates['tablePk']
@@ -166,8 +292,15 @@ class Table:
             self._pkCols = tuple([f"[{col.COLUMN_NAME}]" for col in cols])
             return self._pkCols
 
+    def _meta(self):
+        return self._catalog.table(self._connection, self._schemaName,
+                                   self._tableName)
+
     @property
     def exists(self):
+        if self._catalog is not None:
+            return self._meta() is not None
+
         query = "select objectID = object_id(?);"
         with self._connection.cursor() as cursor:
             cursor.execute(query, self.name)
@@ -178,6 +311,20 @@ class Table:
 
             return False
 
+    @property
+    def modifyDate(self):
+        """Last schema modification date of the table (not cached)"""
+
+        if self._catalog is not None:
+            meta = self._meta()
+            return meta['modifyDate'] if meta else None
+
+        query = "select modify_date from sys.objects" \
+            " where object_id = object_id(?);"
+        with self._connection.cursor() as cursor:
+            cursor.execute(query, self.name)
+            return cursor.fetchval()
+
     def syncWith(self, other, create=False):
         """
         Adds columns to this table so that columns match the source.
@@ -194,11 +341,13 @@ class Table:
             selfColSchema = ", ".join([f"[{col}] {TypeMap.typeFor(attr)}"
                                        for col, attr in other.schema.items()])
 
+            if pk:
+                selfColSchema += f", primary key clustered ({pk})"
+
             tableCreate = f"""
                     IF OBJECT_ID('{self.name}') IS NULL
                         CREATE TABLE {self.name}(
-                            {selfColSchema},
-                            primary key clustered ({pk})
+                            {selfColSchema}
                         );
                 """
             tableCreate = dedent(tableCreate)
@@ -209,6 +358,8 @@ class Table:
                 if not self._connection.autocommit:
                     cursor.commit()
 
+            self.deinit()
+
         if self < other:
             newCols = {k: v for (k, v) in other.schema.items()
                        if k not in self.schema}
@@ -222,12 +373,41 @@ class Table:
                     if not self._connection.autocommit:
                         cursor.commit()
 
+            self.deinit()
+
     def deinit(self):
         """Deinitializes lazy props"""
+        if self._catalog is not None:
+            self._catalog.invalidate()
+
         self._schema = {}
         self._columns = ()
-        self._pkCols = ()
+        self._pkCols = None
         self._tempTable = ""
+        self._mergeQueries = {}
+        self._deleteQueries = {}
+        self.closeStageCursor()
+
+    @property
+    def connection(self):
+        return self._connection
+
+    def closeStageCursor(self):
+        if self._stageCursor is not None:
+            try:
+                self._stageCursor.close()
+            except Exception:
+                pass
+
+        self._stageCursor = None
+
+    def close(self):
+        """Closes the underlying connection"""
+        self.closeStageCursor()
+        try:
+            self._connection.close()
+        except Exception:
+            pass
 
     def rowver(self):
         query = f"""
@@ -239,9 +419,102 @@ class Table:
             cursor.execute(query)
             return cursor.fetchone()[0]
 
-    def rows(self, rowver, count=500):
+    def rowCount(self):
+        """Row count from partition metadata, without reading the table"""
+        query = """
+            Select sum(row_count)
+            From sys.dm_db_partition_stats
+            Where object_id = object_id(?) and index_id < 2;
+        """
+
+        with self._connection.cursor() as cursor:
+            cursor.execute(dedent(query), self.name)
+            return cursor.fetchval() or 0
+
+    def rowverIndexed(self):
+        """True if an index leads on rowver, so rows() can seek"""
+        query = """
+            Select count(*)
+            From sys.index_columns ic
+            Inner join sys.columns c
+            on c.object_id = ic.object_id and c.column_id = ic.column_id
+            Where ic.object_id = object_id(?) and ic.key_ordinal = 1
+            and c.name = 'rowver';
+        """
+
+        with self._connection.cursor() as cursor:
+            cursor.execute(dedent(query), self.name)
+            return bool(cursor.fetchval())
+
+    def pendingRows(self, rowver, samplePercent=0):
+        """
+        Rows with a rowver above rowver.  With samplePercent, estimated
+        from a TABLESAMPLE of the table and rowCount() instead of counted,
+        for tables that would need a full scan.
+        """
+        if not samplePercent:
+            query = f"Select count_big(*) From {self.name} Where rowver > ?;"
+            with self._connection.cursor() as cursor:
+                cursor.execute(query, rowver)
+                return cursor.fetchval()
+
+        query = f"""
+            Select count_big(*), sum(case when rowver > ? then 1 else 0 end)
+            From {self.name} tablesample ({float(samplePercent)} percent);
+        """
+
+        with self._connection.cursor() as cursor:
+            cursor.execute(dedent(query), rowver)
+            sampled, pending = cursor.fetchone()
+
+        if not sampled:
+            return 0
+
+        return round(self.rowCount() * (pending or 0) / sampled)
+
+    @property
+    def timings(self):
+        """Seconds spent per phase by the last merge"""
+        return self._timings
+
+    @property
+    def caughtUp(self):
+        """True if the last call to rows() reached the end of the table"""
+        return self._caughtUp
+
+    def rows(self, rowver, count=None, drain=False, maxRows=0, maxSeconds=0,
+             columnar=False):
+        """
+        Yields row sets of up to count rows with a rowver above rowver.
+        Without a count, self.commit is read before each row set and
+        self.batch before each page, so both may change while draining.
+
+        Reads a single page of self.batch rows unless drain is set.  When
+        draining, pages are keyset paginated on the last rowver seen until
+        the source is caught up or maxRows/maxSeconds (0 = no limit) is
+        used up.
+
+        With columnar set, row sets are ColumnBatch objects instead of
+        lists of pyodbc.Row.
+
+        With maxBytes set, row sets are also cut to the bytes estimated
+        per row, from the schema at first and then from the LOB values
+        seen.  With lobChunk set, (max) values are read up to lobChunk
+        bytes and row sets carry the longer ones in a long attribute,
+        see RowSet.
+        """
+        columns = self.columns
+        # chunks are read back by pk
+        streamed = [i for i, col in enumerate(columns)
+                    if self.lobChunk and self.pkColumns and
+                    self.streamable(col)]
+        selectCols = [f'substring({col}, 1, {self.lobChars(col)}) as {col}'
+                      if i in streamed else self.selectExpr(col)
+                      for i, col in enumerate(columns)]
+        selectCols += [f'datalength({columns[i]})' for i in streamed]
+
         query = f"""
-            Select top (?) {", ".join(self.columns)}
+            Select top (?) {", ".join(selectCols)}
             From {self.name}
             Where rowver > ?
             Order by rowver asc
@@ -250,17 +523,388 @@ class Table:
         if rowver is None:
             rowver = b'\x00\x00\x00\x00\x00\x00\x00'
 
-        cursor = self._connection.cursor()
-        cursor.execute(query, (self.batch, rowver))
-        rows = cursor.fetchmany(count)
+        rowverIdx = columns.index('[rowver]')
+        pkIdx = [columns.index(col) for col in self.pkColumns]
+        layout = ColumnLayout(self.schema, columns) if columnar else None
+        lobs = [i for i, col in enumerate(columns) if self.isLob(col)]
+        fixedBytes = sum(TypeMap.sizeOf(self.schema[col[1:-1]])
+                         for i, col in enumerate(columns) if i not in lobs)
+        estimate = fixedBytes + sum(
+            min(TypeMap.lobSize, self.lobChunk or TypeMap.lobSize)
+            for _ in lobs)
+        started = time.monotonic()
+        total = 0
+        self._caughtUp = False
+
+        def fetch(cursor):
+            fetchRows = count or self.commit
+            if self.maxBytes:
+                fetchRows = max(1, min(fetchRows, self.maxBytes // estimate))
+            return cursor.fetchmany(fetchRows)
 
         while True:
-            yield rows
-            rows = cursor.fetchmany(count)
+            batch = int(self.batch)
+            cursor = self._connection.cursor()
+            cursor.execute(query, (batch, rowver))
+            rows = fetch(cursor)
+            pageRows = 0
+
+            while True:
+                if rows:
+                    rowver = rows[-1][rowverIdx]
+                    pageRows += len(rows)
+
+                if rows and lobs:
+                    # grows at once, shrinks by half per row set
+                    seen = fixedBytes + max(
+                        sum(len(row[i]) for i in lobs if row[i] is not None)
+                        for row in rows)
+                    estimate = max(seen, estimate // 2, 1)
+
+                if streamed:
+                    long = [(tuple(row[i] for i in pkIdx), columns[i], size)
+                            for row in rows
+                            for i, size in zip(streamed, row[len(columns):])
+                            if size and size > self.lobChunk]
+                    if layout is None:
+                        rows = RowSet((tuple(row[:len(columns)])
+                                       for row in rows), long)
+
+                if layout is not None:
+                    rows = ColumnBatch.fromRows(rows, layout)
+                    if streamed:
+                        rows.long = long
+
+                yield rows
+                rows = fetch(cursor)
+
+                if not rows:
+                    break
+
+            cursor.close()
+            total += pageRows
+
+            if pageRows < batch:
+                self._caughtUp = True
+                break
+
+            if not drain:
+                break
+
+            if maxRows and total >= maxRows:
+                break
 
-            if not rows:
+            if maxSeconds and time.monotonic() - started >= maxSeconds:
                 break
 
+    def isLob(self, column):
+        """True for LOB and (max) columns"""
+        attr = self.schema[column[1:-1]]
+        return attr['DATA_TYPE'] in TypeMap.lobTypes or \
+            attr['CHARACTER_MAXIMUM_LENGTH'] == -1
+
+    def streamable(self, column):
+        """True for columns rows() can cut at lobChunk bytes"""
+        attr = self.schema[column[1:-1]]
+        return attr['DATA_TYPE'] in ('varchar', 'nvarchar', 'varbinary') \
+            and attr['CHARACTER_MAXIMUM_LENGTH'] == -1
+
+    def lobChars(self, column):
+        """lobChunk in the units of substring for column"""
+        if self.schema[column[1:-1]]['DATA_TYPE'] == 'nvarchar':
+            return max(1, self.lobChunk // 2)
+
+        return max(1, self.lobChunk)
+
+    def lobChunks(self, key, column, size):
+        """
+        Yields (offset, chunk) for the rest of a value cut by rows(),
+        lobChunk bytes at a time.  key holds the row's pk values and size
+        the value's datalength.  Offsets count from 0, in the units of
+        .WRITE for the column.
+        """
+        chars = self.lobChars(column)
+        if self.schema[column[1:-1]]['DATA_TYPE'] == 'nvarchar':
+            size //= 2
+
+        where = ' and '.join(f'{col} = ?' for col in self.pkColumns)
+        query = f"Select substring({column}, ?, ?)" \
+            f" From {self.name} Where {where};"
+
+        with self._connection.cursor() as cursor:
+            offset = chars
+            while offset < size:
+                cursor.execute(query, offset + 1, chars, *key)
+                chunk = cursor.fetchval()
+                if not chunk:
+                    break
+
+                yield offset, chunk
+                offset += chars
+
+    def appendLob(self, key, column, chunks):
+        """
+        Writes (offset, chunk) pairs into the value of column in the row
+        with pk key.  Each write replaces everything from its offset on, so
+        writing the same chunks again leaves the same value.
+        """
+        where = ' and '.join(f'{col} = ?' for col in self.pkColumns)
+        query = f"Update {self.name} Set {column}.WRITE(?, ?, NULL)" \
+            f" Where {where};"
+
+        with self._connection.cursor() as cursor:
+            for offset, chunk in chunks:
+                cursor.execute(query, chunk, offset, *key)
+
+            if not self._connection.autocommit:
+                cursor.commit()
+
+    def setRowvers(self, rows):
+        """Sets rowver from (rowver, pk values...) tuples"""
+        where = ' and '.join(f'{col} = ?' for col in self.pkColumns)
+        query = f"Update {self.name} Set [rowver] = ? Where {where};"
+
+        with self._connection.cursor() as cursor:
+            cursor.executemany(query, rows)
+            if not self._connection.autocommit:
+                cursor.commit()
+
+    def ctVersion(self):
+        """Current change tracking version of the database"""
+        query = "Select version = CHANGE_TRACKING_CURRENT_VERSION();"
+        with self._connection.cursor() as cursor:
+            cursor.execute(query)
+            return cursor.fetchval()
+
+    def ctMinVersion(self):
+        """
+        Oldest version changes() can start from, None if change tracking
+        is not enabled on this table.
+        """
+        query = "Select version =" \
+            " CHANGE_TRACKING_MIN_VALID_VERSION(OBJECT_ID(?));"
+        with self._connection.cursor() as cursor:
+            cursor.execute(query, self.name)
+            return cursor.fetchval()
+
+    def ctPending(self, version):
+        """Rows changed after change tracking version"""
+        query = f"Select count_big(*)" \
+            f" From CHANGETABLE(CHANGES {self.name}, ?) as ct;"
+        with self._connection.cursor() as cursor:
+            cursor.execute(query, version)
+            return cursor.fetchval()
+
+    def changes(self, version, upTo, count=None):
+        """
+        Yields (version, rows, keys) for the changes tracked after version
+        up to version upTo, in version order.
+
+        rows are the current values of inserted and updated rows, read
+        back from the table by pk; keys are the pk values of deleted rows.
+        The version yielded is the highest one whose changes have all been
+        yielded so far, a checkpoint there never skips a change.  Without a
+        count, self.commit is read before each row set.
+        """
+        pk = self.pkColumns
+        if not pk:
+            raise ValueError(f'{self.name}: change tracking needs a'
+                             ' primary key.')
+
+        query = f"""
+            Select ct.SYS_CHANGE_VERSION,
+                {', '.join(f'ct.{col}' for col in pk)},
+                {', '.join(self.selectExpr(col, 't.')
+                           for col in self.columns)}
+            From CHANGETABLE(CHANGES {self.name}, ?) as ct
+            Left join {self.name} as t
+            on {' and '.join(f't.{col} = ct.{col}' for col in pk)}
+            Where ct.SYS_CHANGE_VERSION <= ?
+            Order by ct.SYS_CHANGE_VERSION asc;
+        """
+
+        keyEnd = 1 + len(pk)
+        presentIdx = keyEnd + self.columns.index(pk[0])
+
+        cursor = self._connection.cursor()
+        try:
+            cursor.execute(dedent(query), (version, upTo))
+            while True:
+                changes = cursor.fetchmany(count or self.commit)
+                if not changes:
+                    break
+
+                rows, keys = [], []
+                for change in changes:
+                    if change[presentIdx] is None:
+                        # no longer in the table, deleted
+                        keys.append(tuple(change[1:keyEnd]))
+                    else:
+                        rows.append(tuple(change[keyEnd:]))
+
+                # more changes of the last version may follow
+                version = max(version, changes[-1][0] - 1)
+                yield version, rows, keys
+        finally:
+            cursor.close()
+
+    @property
+    def empty(self):
+        query = f"select top (1) 1 from {self.name};"
+        with self._connection.cursor() as cursor:
+            cursor.execute(query)
+            return cursor.fetchone() is None
+
+    def truncate(self):
+        with self._connection.cursor() as cursor:
+            cursor.execute(f"truncate table {self.name};")
+            if not self._connection.autocommit:
+                cursor.commit()
+
+    def _keyFilter(self, op, key):
+        """
+        Clause and parameters comparing the pk, in pk order, with the
+        tuple key.  op is '<' or '>='.  T-SQL has no row value comparison,
+        so (a, b) < (x, y) is written as a < x or (a = x and b < y).
+        """
+        pk = self.pkColumns
+        strict = op[0]
+        clause, params = f"{pk[-1]} {op} ?", [key[-1]]
+        for col, value in zip(reversed(pk[:-1]), reversed(key[:-1])):
+            clause = f"({col} {strict} ? or ({col} = ? and {clause}))"
+            params = [value, value] + params
+
+        return clause, params
+
+    def _rangeFilter(self, lower, upper):
+        """Where clause and parameters for a range of pk tuples"""
+        if lower is None and upper is None:
+            return "", []
+
+        if not self.pkColumns:
+            raise ValueError(f'{self.name} has no primary key to range on.')
+
+        where = []
+        params = []
+        for op, key in (('>=', lower), ('<', upper)):
+            if key is not None:
+                clause, keyParams = self._keyFilter(op, key)
+                where.append(clause)
+                params.extend(keyParams)
+
+        return "Where " + " and ".join(where), params
+
+    def pkRanges(self, parts, lower=None, upper=None):
+        """
+        Splits the table, or the range lower .. upper of it, into roughly
+        equal ranges of pk tuples.  Returns a list of (lower, upper)
+        bounds, lower inclusive and upper exclusive, where None is
+        unbounded.  A range only fails to split when it holds a single
+        row.  A table without a pk is a single range.
+        """
+        if not self.pkColumns:
+            return [(lower, upper)]
+
+        pk = ", ".join(self.pkColumns)
+        where, params = self._rangeFilter(lower, upper)
+        query = f"""
+            Select {pk}
+            From (
+                Select {pk},
+                    row_number() over (partition by part order by {pk}) as n
+                From (
+                    Select {pk}, ntile(?) over (order by {pk}) as part
+                    From {self.name}
+                    {where}
+                ) p
+            ) q
+            Where n = 1
+            Order by {pk};
+        """
+
+        with self._connection.cursor() as cursor:
+            cursor.execute(query, int(parts), *params)
+            bounds = [tuple(row) for row in cursor.fetchall()][1:]
+
+        return list(zip([lower] + bounds, bounds + [upper]))
+
+    def rangeChecksums(self, ranges, columns):
+        """
+        Row count and checksum_agg(binary_checksum(columns)) of each range
+        in ranges, which must be contiguous and in order, as computed by
+        pkRanges.  All ranges are aggregated by a single query.  Returns a
+        list of (count, checksum), (0, None) for an empty range.
+        """
+        where, params = self._rangeFilter(ranges[0][0], ranges[-1][1])
+        cases = []
+        caseParams = []
+        for i, (_, upper) in enumerate(ranges[:-1]):
+            clause, keyParams = self._keyFilter('<', upper)
+            cases.append(f'when {clause} then {i}')
+            caseParams.extend(keyParams)
+        part = f'case {" ".join(cases)} else {len(ranges) - 1} end' \
+            if cases else '0'
+
+        query = f"""
+            Select p.part, count_big(*), checksum_agg(p.checksum)
+            From (
+                Select {part} as part,
+                    binary_checksum({", ".join(columns)}) as checksum
+                From {self.name}
+                {where}
+            ) p
+            Group by p.part;
+        """
+
+        sums = [(0, None)] * len(ranges)
+        with self._connection.cursor() as cursor:
+            cursor.execute(query, *caseParams, *params)
+            for part, rowCount, checksum in cursor.fetchall():
+                sums[part] = (rowCount, checksum)
+
+        return sums
+
+    def rowChecksums(self, lower, upper, columns):
+        """
+        Dictionary of pk values: binary_checksum(columns) for the rows in
+        the range lower .. upper.
+        """
+        pk = self.pkColumns
+        if not pk:
+            raise ValueError(f'{self.name} has no primary key to compare'
+                             ' rows on.')
+
+        where, params = self._rangeFilter(lower, upper)
+        query = f"""
+            Select {", ".join(pk)},
+                binary_checksum({", ".join(columns)}) as checksum
+            From {self.name}
+            {where}
+        """
+
+        with self._connection.cursor() as cursor:
+            cursor.execute(query, *params)
+            return {tuple(row[:len(pk)]): row[len(pk)]
+                    for row in cursor.fetchall()}
+
+    def rangeRows(self, lower, upper, count=500):
+        """Yields row sets for a range returned by pkRanges"""
+        where, params = self._rangeFilter(lower, upper)
+        query = f"""
+            Select {", ".join(self.selectExpr(col) for col in self.columns)}
+            From {self.name}
+            {where}
+        """
+
+        with self._connection.cursor() as cursor:
+            cursor.execute(query, *params)
+            while True:
+                rows = cursor.fetchmany(count)
+                if not rows:
+                    break
+
+                yield rows
+
     def insert(self, rows, columns):
         query = f"""
             Insert {self.name} ({', '.join(columns)})
@@ -268,21 +912,79 @@ class Table:
         """
 
         with self._connection.cursor() as cursor:
-            cursor.fast_executemany = True
+            sizes = self.inputSizes(columns)
+            if sizes is None or hasattr(cursor, 'setinputsizes'):
+                cursor.fast_executemany = True
+                if sizes:
+                    cursor.setinputsizes(sizes)
+
             cursor.executemany(query, rows)
             if not self._connection.autocommit:
                 cursor.commit()
 
-    def mergeStatement(self, columns):
+    def applyStrategy(self):
+        """
+        The strategy used to apply staged rows:
+            update: update existing rows, then insert the rest
+            merge: a single MERGE statement
+            delete: delete existing rows, then insert all
+            insert: insert rows not already in the table (append-only)
+        'auto' picks one from the table traits.
+        """
+        if self.strategy != 'auto':
+            return self.strategy
+
+        if not self.pkColumns or self.appendOnly:
+            return 'insert'
 
-        if self._mergeQueries:
-            return self._mergeQueries
+        if (len(self.schema) >= Table.wideColumns or
+                self.rowBytes() >= Table.wideRowBytes):
+            return 'delete'
 
+        return 'update'
+
+    def rowBytes(self):
+        """Estimated size of a row, see TypeMap.sizeOf"""
+        return sum(TypeMap.sizeOf(attr) for attr in self.schema.values())
+
+    def mergeStatement(self, columns):
+        """
+        Statements that stage rows of columns and apply them to this table.
+
+        Built once per (columns, strategy) and kept until deinit, which
+        runs whenever the schema changes.  Every batch of the same shape
+        then sends the very same statement text, so the server reuses its
+        cached plans.
+        """
+        strategy = self.applyStrategy()
+        key = (tuple(columns), strategy)
+        if key in self._mergeQueries:
+            return self._mergeQueries[key]
         selfPk = ", ".join(self.pkColumns)
 
         selfColSchema = ", ".join([f"[{col}] {TypeMap.typeFor(attr)}"
                                    for col, attr in self.schema.items()])
 
+        insertCols = ', '.join(columns)
+        selectCols = ', '.join([f's.{col}' for col in columns])
+
+        if not self.pkColumns and strategy != 'insert':
+            raise ValueError(f'{self.name} has no primary key,'
+                             ' only the insert strategy applies.')
+
+        # Without a pk there is nothing to match on, rows go straight in
+        if strategy == 'insert' and not self.pkColumns:
+            directInsert = f"""
+                    Insert {self.name} ({insertCols})
+                    values ({', '.join('?' * len(columns))});
+                """
+
+            self._mergeQueries[key] = {
+                'strategy': strategy,
+                'directInsert': dedent(directInsert),
+            }
+            return self._mergeQueries[key]
+
         # Generate a temporary table for staging the data
         tempTableName = self._schemaName + self._tableName
         tempTableCreate = f"""
@@ -298,86 +1000,312 @@ class Table:
 
         # Insert rows into the staging table
         # Use the columns from the source data.
-        insertCols = ', '.join(columns)
         tempTableInsert = f"""
                 Insert #{tempTableName} ({insertCols})
                 values ({', '.join('?' * len(columns))});
             """
         tempTableInsert = dedent(tempTableInsert)
 
-        # Output table for capturing updated keys
-        selfPkColShema = [f'{key} {TypeMap.typeFor(attr)}'
-                          for key, attr in self.schema.items()
-                          if f'[{key}]' in self.pkColumns]
-
-        outTempTableName = f'{tempTableName}_updated'
-        outTempTableCreate = f"""
-                if object_id('tempdb..#{outTempTableName}') is not null
-                    drop table #{outTempTableName};
-
-                Create Table #{outTempTableName} (
-                    {', '.join(selfPkColShema)},
-                    primary key({selfPk})
-                );
-            """
-        outTempTableCreate = dedent(outTempTableCreate)
-
-        # Update Existing records
-        # Exclude the pk columns from the update.
-        updateCols = [
-            f"t.{col} = s.{col}"
-            for col in columns
-            if col not in self.pkColumns]
-
+        # Exclude the pk columns from updates.
+        updateCols = [col for col in columns if col not in self.pkColumns]
         joinCols = [f's.{col} = t.{col}' for col in self.pkColumns]
 
-        outputCols = [f'inserted.{col}' for col in self.pkColumns]
+        outTempTableCreate = None
+        outTempTableName = f'{tempTableName}_updated'
+        truncateTables = [tempTableName]
+
+        if strategy == 'update' and updateCols:
+            # Output table for capturing updated keys
+            selfPkColShema = [f'{key} {TypeMap.typeFor(attr)}'
+                              for key, attr in self.schema.items()
+                              if f'[{key}]' in self.pkColumns]
+
+            outTempTableCreate = f"""
+                    if object_id('tempdb..#{outTempTableName}') is not null
+                        drop table #{outTempTableName};
+
+                    Create Table #{outTempTableName} (
+                        {', '.join(selfPkColShema)},
+                        primary key({selfPk})
+                    );
+                """
+            outTempTableCreate = dedent(outTempTableCreate)
+            truncateTables.append(outTempTableName)
+
+            outputCols = [f'inserted.{col}' for col in self.pkColumns]
+
+            # Update Existing records
+            updateTable = f"""
+                        update t
+                        set {', '.join(f't.{c} = s.{c}' for c in updateCols)}
+                        output {', '.join(outputCols)}
+                        into #{outTempTableName} ({selfPk})
+                        from {self.name} t
+                        inner join #{tempTableName} s
+                        on {' and '.join(joinCols)};
+                    """
+
+            # Insert new rows
+            insertTable = f"""
+                    insert {self.name} ({insertCols})
+                    select {selectCols}
+                    from #{tempTableName} s
+                    left join #{outTempTableName} t
+                    on {' and '.join(joinCols)}
+                    where t.{self.pkColumns[0]} is null;
+                """
+            applyTable = dedent(updateTable) + dedent(insertTable)
+
+        elif strategy == 'merge':
+            whenMatched = f"""
+                    when matched then
+                        update set {', '.join(f'{c} = s.{c}'
+                                              for c in updateCols)}
+                """ if updateCols else ''
+
+            applyTable = f"""
+                    merge {self.name} with (holdlock) as t
+                    using #{tempTableName} as s
+                    on {' and '.join(joinCols)}
+                    {whenMatched.strip()}
+                    when not matched by target then
+                        insert ({insertCols})
+                        values ({selectCols});
+                """
+            applyTable = dedent(applyTable)
 
-        updateTable = f"""
-                    update t
-                    set {', '.join(updateCols)}
-                    output {', '.join(outputCols)}
-                    into #{outTempTableName} ({', '.join(self.pkColumns)})
+        elif strategy == 'delete':
+            deleteTable = f"""
+                    delete t
                     from {self.name} t
                     inner join #{tempTableName} s
                     on {' and '.join(joinCols)};
                 """
-        updateTable = dedent(updateTable)
-
-        # Insert new rows
-        insertTable = f"""
-                insert {self.name} ({insertCols})
-                select {', '.join([f's.{col}' for col in columns])}
-                from #{tempTableName} s
-                left join #{outTempTableName} t
-                on {' and '.join(joinCols)}
-                where t.{self.pkColumns[0]} is null;
-            """
-        insertTable = dedent(insertTable)
 
-        self._mergeQueries = {
+            insertTable = f"""
+                    insert {self.name} ({insertCols})
+                    select {selectCols}
+                    from #{tempTableName} s;
+                """
+            applyTable = dedent(deleteTable) + dedent(insertTable)
+
+        else:
+            # insert only, or an update with nothing but pk columns
+            insertTable = f"""
+                    insert {self.name} ({insertCols})
+                    select {selectCols}
+                    from #{tempTableName} s
+                    where not exists (
+                        select 1 from {self.name} t
+                        where {' and '.join(joinCols)}
+                    );
+                """
+            applyTable = dedent(insertTable)
+
+        # Empty the staging tables so they can be reused by the next batch
+        tempTableTruncate = ''.join(f"truncate table #{table};\n"
+                                    for table in truncateTables)
+
+        self._mergeQueries[key] = {
+            'strategy': strategy,
             'tempTableCreate': tempTableCreate,
             'outTempTableCreate': outTempTableCreate,
             'tempTableInsert': tempTableInsert,
-            'updateTable': updateTable,
-            'insertTable': insertTable
+            'apply': applyTable + tempTableTruncate,
+            'staged': False,
         }
 
-        return self._mergeQueries
+        return self._mergeQueries[key]
+
+    def inputSizes(self, columns):
+        """
+        Parameter sizes for fast_executemany.
+
+        datetimeoffset values arrive as strings (see passThrough) and are
+        bound as nvarchar.  Fixed binary columns, such as the binary (8)
+        copy of a rowver, are bound as binary so their bytes go through
+        as they are.  LOB columns are bound with a size of 0 so the driver
+        streams them instead of allocating max length buffers for every
+        row.  Returns None if nothing needs to be declared.
+        """
+        sizes = []
+        for col in columns:
+            attr = self.schema.get(col[1:-1], {})
+            base = attr.get('DATA_TYPE')
+
+            if base == 'datetimeoffset':
+                sizes.append((pyodbc.SQL_WVARCHAR, 34, 0))
+            elif base == 'binary' and attr.get('CHARACTER_MAXIMUM_LENGTH'):
+                sizes.append((pyodbc.SQL_BINARY,
+                              attr['CHARACTER_MAXIMUM_LENGTH'], 0))
+            elif base in TypeMap.lobTypes or (
+                    base in TypeMap.sizedTypes and
+                    attr.get('CHARACTER_MAXIMUM_LENGTH') == -1):
+                if base in TypeMap.binaryTypes:
+                    sizes.append((pyodbc.SQL_VARBINARY, 0, 0))
+                else:
+                    sizes.append((pyodbc.SQL_WVARCHAR, 0, 0))
+            else:
+                sizes.append(None)
+
+        if all(size is None for size in sizes):
+            return None
+
+        return sizes
 
     def merge(self, rows, columns):
+        """
+        Stages rows in a session temp table and applies them to this table.
+
+        The temp tables are created once per connection and truncated after
+        each batch, so a batch costs one executemany plus one batch holding
+        the update, insert and truncate statements.
+
+        Rows are staged through a cursor kept for this table.  pyodbc keeps
+        the last statement it prepared on a cursor, so batches of the same
+        shape skip the prepare and the server runs its prepared plan.
+        """
         mergeStatements = self.mergeStatement(columns)
 
-        with self._connection.cursor() as cursor:
-            # cursor.fast_executemany = True
-            cursor.execute(mergeStatements['tempTableCreate'])
-            cursor.execute(mergeStatements['outTempTableCreate'])
-            cursor.executemany(mergeStatements['tempTableInsert'], rows)
-            cursor.execute(mergeStatements['updateTable'])
-            cursor.execute(mergeStatements['insertTable'])
+        try:
+            with self._connection.cursor() as cursor:
+                direct = 'directInsert' in mergeStatements
+                if not direct and not mergeStatements['staged']:
+                    cursor.execute(mergeStatements['tempTableCreate'])
+                    if mergeStatements['outTempTableCreate']:
+                        cursor.execute(mergeStatements['outTempTableCreate'])
+                    mergeStatements['staged'] = True
+
+                if self._stageCursor is None:
+                    self._stageCursor = self._connection.cursor()
+                stageCursor = self._stageCursor
+
+                sizes = self.inputSizes(columns) if self.fast else None
+                if self.fast and (sizes is None or
+                                  hasattr(stageCursor, 'setinputsizes')):
+                    stageCursor.fast_executemany = True
+                    if sizes:
+                        stageCursor.setinputsizes(sizes)
+
+                timings = {}
+                started = time.perf_counter()
+                if direct:
+                    stageCursor.executemany(mergeStatements['directInsert'],
+                                            rows)
+                    timings['insert'] = time.perf_counter() - started
+                else:
+                    stageCursor.executemany(
+                        mergeStatements['tempTableInsert'], rows)
+                    timings['stage'] = time.perf_counter() - started
+                stageCursor.fast_executemany = False
+
+                if not direct:
+                    # execute returns with the first statement's row count,
+                    # nextset with the next.  Every result has to be
+                    # consumed or the rest of the batch may not run.
+                    started = time.perf_counter()
+                    cursor.execute(mergeStatements['apply'])
+                    timings['update'] = time.perf_counter() - started
+
+                    started = time.perf_counter()
+                    while cursor.nextset():
+                        pass
+                    timings['insert'] = time.perf_counter() - started
+
+                started = time.perf_counter()
+                if not self._connection.autocommit:
+                    cursor.commit()
+                timings['commit'] = time.perf_counter() - started
+
+                self._timings = timings
+
+        except Exception:
+            # the staging tables may hold a partial batch, recreate them
+            for statements in self._mergeQueries.values():
+                statements['staged'] = False
+            self.closeStageCursor()
+            raise
+
+    def deleteStatement(self):
+        """Statements to stage pk values and delete the rows they match"""
+        if self._deleteQueries:
+            return self._deleteQueries
+
+        pkSchema = [f'[{key}] {TypeMap.typeFor(attr)}'
+                    for key, attr in self.schema.items()
+                    if f'[{key}]' in self.pkColumns]
+        pk = ', '.join(self.pkColumns)
+        joinCols = [f's.{col} = t.{col}' for col in self.pkColumns]
+        tempTableName = f'{self._schemaName}{self._tableName}_deleted'
 
-            if not self._connection.autocommit:
-                cursor.commit()
+        tempTableCreate = f"""
+                IF OBJECT_ID('tempdb..#{tempTableName}') IS NOT NULL
+                    DROP TABLE #{tempTableName};
+
+                CREATE TABLE #{tempTableName}(
+                    {', '.join(pkSchema)},
+                    primary key clustered ({pk})
+                );
+            """
+
+        tempTableInsert = f"""
+                Insert #{tempTableName} ({pk})
+                values ({', '.join('?' * len(self.pkColumns))});
+            """
+
+        deleteTable = f"""
+                delete t
+                from {self.name} t
+                inner join #{tempTableName} s
+                on {' and '.join(joinCols)};
+                truncate table #{tempTableName};
+            """
+
+        self._deleteQueries = {
+            'tempTableCreate': dedent(tempTableCreate),
+            'tempTableInsert': dedent(tempTableInsert),
+            'apply': dedent(deleteTable),
+            'staged': False,
+        }
+
+        return self._deleteQueries
+
+    def delete(self, keys):
+        """
+        Deletes the rows whose pk values are in keys, staged in a session
+        temp table the same way merge stages rows.
+        """
+        deleteStatements = self.deleteStatement()
+
+        try:
+            with self._connection.cursor() as cursor:
+                if not deleteStatements['staged']:
+                    cursor.execute(deleteStatements['tempTableCreate'])
+                    deleteStatements['staged'] = True
+
+                timings = {}
+                started = time.perf_counter()
+                cursor.fast_executemany = self.fast
+                cursor.executemany(deleteStatements['tempTableInsert'], keys)
+                cursor.fast_executemany = False
+                timings['stage'] = time.perf_counter() - started
+
+                started = time.perf_counter()
+                cursor.execute(deleteStatements['apply'])
+                while cursor.nextset():
+                    pass
+                timings['delete'] = time.perf_counter() - started
+
+                started = time.perf_counter()
+                if not self._connection.autocommit:
+                    cursor.commit()
+                timings['commit'] = time.perf_counter() - started
+
+                self._timings = timings
+
+        except Exception:
+            deleteStatements['staged'] = False
+            raise
 
 
 class TypeMap:
@@ -387,9 +1315,44 @@ class TypeMap:
         'timestamp': 'binary (8)'
     }
 
-    sizedTypes = ('char', 'varchar', 'nvarchar', 'binary', 'varbinary')
+    sizedTypes = ('char', 'varchar', 'nchar', 'nvarchar',
+                  'binary', 'varbinary')
+    lobTypes = ('text', 'ntext', 'image', 'xml')
+    binaryTypes = ('binary', 'varbinary', 'image')
     scaleTypes = ('numeric', 'decimal')
 
+    fixedSizes = {
+        'bit': 1, 'tinyint': 1, 'smallint': 2, 'int': 4, 'bigint': 8,
+        'real': 4, 'float': 8, 'smallmoney': 4, 'money': 8,
+        'date': 3, 'time': 5, 'smalldatetime': 4, 'datetime': 8,
+        'datetime2': 8, 'datetimeoffset': 10, 'uniqueidentifier': 16,
+        'timestamp': 8, 'rowversion': 8,
+    }
+
+    # assumed size of a LOB value when estimating row widths
+    lobSize = 8000
+
+    @staticmethod
+    def sizeOf(type):
+        """Estimated size in bytes of a value of a sql type"""
+        base = type['DATA_TYPE']
+
+        if base in TypeMap.fixedSizes:
+            return TypeMap.fixedSizes[base]
+
+        if base in TypeMap.scaleTypes:
+            precision = type['NUMERIC_PRECISION'] or 18
+            return 5 + 4 * min(3, (precision - 1) // 9)
+
+        size = type['CHARACTER_MAXIMUM_LENGTH']
+        if base in TypeMap.lobTypes or size == -1:
+            return TypeMap.lobSize
+
+        if size:
+            return size * 2 if base.startswith('n') else size
+
+        return 8
+
     @staticmethod
     def typeFor(type):
         base = type['DATA_TYPE']
@@ -398,10 +1361,11 @@ class TypeMap:
             return TypeMap.swapTypes[base]
 
         if base in TypeMap.sizedTypes:
-            return f"{base} ({type['CHARACTER_MAXIMUM_LENGTH']})"
+            size = type['CHARACTER_MAXIMUM_LENGTH']
+            return f"{base} ({'max' if size == -1 else size})"
 
         if base in TypeMap.scaleTypes:
             return f"{base} ({type['NUMERIC_PRECISION']}" \
-                ", {type['NUMERIC_SCALE']})"
+                f", {type['NUMERIC_SCALE']})"
 
         return base
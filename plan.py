@@ -0,0 +1,171 @@
+import json
+import logging
+from datetime import timedelta
+from os import path
+import pyodbc
+from checkpoint import CheckpointStore
+from mssql.table import Table as sqlTable
+
+
+def throughput(metricsFile):
+    """
+    Rows per second of each job while it was working, from the metrics
+    file of a previous run.  Jobs without metrics are left out.
+    """
+    if not metricsFile or not path.exists(metricsFile):
+        return {}
+
+    with open(metricsFile, 'r') as f:
+        jobs = json.load(f)
+
+    rates = {}
+    for job, stats in jobs.items():
+        seconds = sum(seconds for phase, seconds in stats['seconds'].items()
+                      if phase != 'connect')
+        if stats['rows'] and seconds:
+            rates[job] = stats['rows'] / seconds
+
+    return rates
+
+
+class Planner:
+    """
+    Estimates the catch-up of one job without moving any data.
+
+    Pending rows are counted past the watermark: the checkpoint, else the
+    target's max(rowver).  The count is exact when an index leads on
+    rowver, since it is a seek.  Otherwise it is estimated from a
+    TABLESAMPLE of samplePercent and the partition row count.  Change
+    tracking jobs count CHANGETABLE, which is indexed.  Bytes use the
+    estimated row width from Table.schema.
+    """
+
+    def __init__(self, name, conf, store=None, samplePercent=1):
+        self.name = name
+        self._conf = conf
+        self._store = store
+        self._samplePercent = samplePercent
+
+    def watermark(self, trgtTable):
+        """The checkpoint, else max(rowver) of the target, None if unknown"""
+        if self._store is not None:
+            rowver = self._store.get(self.name)
+            if rowver is not None:
+                return rowver
+
+        if self._conf['source'].get('mode') == 'changeTracking' or \
+                not trgtTable.exists or 'rowver' not in trgtTable.schema:
+            return None
+
+        return trgtTable.rowver()
+
+    def run(self):
+        """Returns a dictionary describing the job's backlog"""
+        conf = self._conf
+        srcTable = trgtTable = None
+
+        try:
+            srcTable = sqlTable(
+                connection=pyodbc.connect(conf['source']['connStr']),
+                schemaName=conf['source']['schema'],
+                tableName=conf['source']['name']
+            )
+            trgtTable = sqlTable(
+                connection=pyodbc.connect(conf['target']['connStr']),
+                schemaName=conf['target']['schema'],
+                tableName=conf['target']['name']
+            )
+
+            rowCount = srcTable.rowCount()
+            watermark = self.watermark(trgtTable)
+            changeTracking = conf['source'].get('mode') == 'changeTracking'
+            indexed = None
+            exact = True
+
+            if watermark is None:
+                # a full load
+                pending = rowCount
+                exact = False
+            elif changeTracking:
+                minVersion = srcTable.ctMinVersion()
+                if minVersion is None or watermark < minVersion:
+                    pending = rowCount
+                    exact = False
+                else:
+                    pending = srcTable.ctPending(watermark)
+            else:
+                indexed = srcTable.rowverIndexed()
+                if indexed:
+                    pending = srcTable.pendingRows(watermark)
+                else:
+                    pending = srcTable.pendingRows(watermark,
+                                                   self._samplePercent)
+                    exact = False
+
+            return {
+                'job': self.name,
+                'mode': 'changeTracking' if changeTracking else 'rowver',
+                'rows': rowCount,
+                'pending': pending,
+                'exact': exact,
+                'bytes': pending * srcTable.rowBytes(),
+                'rowverIndexed': indexed,
+            }
+
+        finally:
+            for table in (srcTable, trgtTable):
+                if table is not None:
+                    table.close()
+
+
+def plan(config, samplePercent=1):
+    """
+    Plans every job of a confighelper.config and prints the report.
+    Returns the number of jobs that could not be planned.
+    """
+    log = logging.getLogger('replicator')
+    store = None
+    if config.checkpoint and path.exists(config.checkpoint):
+        store = CheckpointStore(config.checkpoint)
+
+    rates = throughput(config.metricsFile)
+
+    # fan-out targets have their own checkpoints
+    flows = {}
+    for jobName, conf in config.jobs.items():
+        if 'targets' in conf:
+            for target in conf['targets']:
+                flows[f"{jobName}>{target['label']}"] = (
+                    jobName, dict(conf, target=target))
+        else:
+            flows[jobName] = (jobName, conf)
+
+    print(f'{"job":<40} {"mode":>14} {"rows":>12} {"pending":>12}'
+          f' {"MB":>10} {"rowver idx":>10} {"rows/s":>10} {"eta":>12}')
+
+    failed = 0
+    try:
+        for name, (jobName, conf) in flows.items():
+            try:
+                report = Planner(name, conf, store, samplePercent).run()
+            except Exception as e:
+                log.error(f'{name}: planning failed. {e}')
+                failed += 1
+                continue
+
+            rate = rates.get(jobName)
+            eta = str(timedelta(seconds=round(report['pending'] / rate))) \
+                if rate else '?'
+            indexed = {None: '-', True: 'yes', False: 'no'}[
+                report['rowverIndexed']]
+            pending = f"{'' if report['exact'] else '~'}{report['pending']}"
+
+            print(f"{name:<40} {report['mode']:>14} {report['rows']:>12}"
+                  f" {pending:>12} {report['bytes'] / 2 ** 20:>10.1f}"
+                  f" {indexed:>10} {round(rate) if rate else '?':>10}"
+                  f" {eta:>12}")
+    finally:
+        if store is not None:
+            store.close()
+
+    return failed
@@ -1,17 +1,19 @@
 import sys
 from os import path
-import time
 import multiprocessing as mp
+import multiprocessing.connection as mpc
 import threading
 import logging
 import logging.config
-import logging.handlers
 import traceback
-import pyodbc
 import argparse
 import confighelper as cfgh
-from mssql.table import Table as sqlTable
-from collections import deque
+from dataflow import procWorker
+from scheduler import Scheduler
+from metrics import Metrics
+from reconcile import reconcile
+from plan import plan
+from lease import Leases
 import json
 
 
@@ -31,122 +33,171 @@ def logger_thread(logQ):
         logger.handle(record)
 
 
-def procDataflow(commons, conf):
-    """
-    Processes a dataflow.
-        src: a data source (table)
-        trgt: a data target (table)
+def startWorker(i, commons, runJobs):
+    conn, workerConn = mp.Pipe()
+    proc = mp.Process(target=procWorker, name=f'worker-{i}',
+                      args=(commons, runJobs, workerConn))
+    proc.start()
+    workerConn.close()
+    return {'proc': proc, 'conn': conn, 'job': None}
 
-    Note:   It is possible to extend this pattern by including
-            transformation functions.
-            Someting to think about for later :)
-    """
-    dfName = mp.current_process().name
-    dfPid = mp.current_process().pid
-    qh = logging.handlers.QueueHandler(commons['logQ'])
-    root = logging.getLogger()
-    root.setLevel(commons['lvl'])
-    root.addHandler(qh)
-    dfLogger = logging.getLogger('replicator')
 
-    dfLogger.debug(f'({dfPid}) {dfName}: Running dataflow processes.')
-
-    try:
-
-        dfLogger.debug(f'({dfPid}) {dfName}: connecting to source db.')
-        srcTable = sqlTable(
-            connection=pyodbc.connect(conf['source']['connStr']),
-            schemaName=conf['source']['schema'],
-            tableName=conf['source']['name']
-        )
-        srcTable.batch = commons['batch']
-
-        dfLogger.debug(f'({dfPid}) {dfName}: connecting to target db.')
-        trgtTable = sqlTable(
-            connection=pyodbc.connect(conf['target']['connStr']),
-            schemaName=conf['target']['schema'],
-            tableName=conf['target']['name']
-        )
-        trgtTable.batch = commons['batch']
-
-        dfLogger.debug(f'({dfPid}) {dfName}: synching table.')
-        trgtTable.syncWith(srcTable, commons['auto'])
-        dfLogger.debug(f'({dfPid}) {dfName}: Completed dataflow processes.')
-
-        rowSets = srcTable.rows(trgtTable.rowver(), commons['commit'])
-        for rowSet in rowSets:
-            if rowSet:
-                trgtTable.merge(rowSet, srcTable.columns)
-
-        time.sleep(1)  # take a nap...
-
-    except:
-        e = sys.exc_info()
-        ex = f'({dfPid}) {dfName}: {e[1]}'
-        dfLogger.critical(''.join(traceback.format_tb(e[2])))
-        dfLogger.critical('{0}: {1}'.format(e[0], ex))
-
-
-def nextProc(runQueue, runJobs, commons):
-    jobName = runQueue.popleft()
-    jobConf = runJobs[jobName]
-    jobArgs = (commons, jobConf)
-    jobProc = mp.Process(target=procDataflow, name=jobName, args=jobArgs)
-    return jobProc
-
-
-def main(args, logQ, configF):
-    config = cfgh.config(args, configF)
+def main(args, logQ, configF, baseDir=None):
+    config = cfgh.config(args, configF, baseDir)
     runJobs = config.jobs
-    runQueue = deque([k for k in runJobs])
+    runQueue = [k for k in runJobs]
 
-    commons = {
-        'batch': config.batch,
-        'auto': config.auto,
-        'commit': config.commit,
-        'logQ': logQ,
-        'lvl': logging.DEBUG if args.debug else logging.ERROR
-    }
+    commons = dict(config.commons, logQ=logQ,
+                   lvl=logging.DEBUG if args.debug else logging.ERROR)
 
     rLog.debug(f'{"*" * 20}')
     rLog.debug(f'batch size: {config.batch}')
     rLog.debug(f'commit size: {config.commit}')
+    rLog.debug(f'adaptive sizes: {config.adaptive}'
+               f' ({config.batchSeconds}s, {config.batchBytes} bytes,'
+               f' {config.minRows} - {config.maxRows} rows)')
+    rLog.debug(f'prefetch depth: {config.depth}')
+    rLog.debug(f'fast staging: {config.fast}')
+    rLog.debug(f'drain: {config.drain} (max {config.drainRows} rows,'
+               f' {config.drainSeconds}s)')
+    rLog.debug(f'columnar row sets: {config.columnar}')
+    rLog.debug(f'row set bytes: {config.rowSetBytes or "no limit"}'
+               f' (lob chunks: {config.lobChunk or "off"})')
+    rLog.debug(f'datetimeoffset pass-through: {config.passThrough}')
     rLog.debug(f'auto commit: {config.auto}')
+    rLog.debug(f'checkpoint: {config.checkpoint} (verify {config.verify})')
+    rLog.debug(f'spool: {config.spool} ({config.spoolBytes} bytes)')
+    rLog.debug(f'initial load: {config.initial}'
+               f' ({config.initialParallel} ranges)')
+    rLog.debug(f'catalog: {config.catalog}'
+               f' (every {config.catalogInterval}s)')
+    rLog.debug(f'connection pool: {config.poolSize or "no"} cap,'
+               f' checked after {config.poolCheck}s idle'
+               f' (shared per job: {config.shareConnections})')
+    rLog.debug(f'idle backoff: {config.idleMin}s - {config.idleMax}s')
+    rLog.debug(f'max wait: {config.maxWait}s')
     rLog.debug(f'{"*" * 20}')
 
-    dfProcs = []
-    for _ in range(min(config.proc, len(runQueue))):
-        jobProc = nextProc(runQueue, runJobs, commons)
-        jobProc.start()
-        dfProcs.append(jobProc)
+    if args.plan:
+        failed = plan(config, config.planSample)
+        logQ.put(None)
+        return 1 if failed else 0
+
+    if args.reconcile:
+        rLog.debug(f'reconciling in {config.reconcileParts} parts down to'
+                   f' {config.reconcileRows} rows.')
+        failed = reconcile(config)
+        logQ.put(None)
+        return 1 if failed else 0
+
+    metrics = Metrics()
+    if config.metricsPort:
+        metrics.serve(config.metricsPort)
+        rLog.debug(f'metrics: http://127.0.0.1:{config.metricsPort}/metrics')
+
+    if config.metricsFile:
+        metrics.writeEvery(config.metricsFile, config.metricsInterval)
+        rLog.debug(f'metrics: {config.metricsFile}')
+
+    # Each job is owned by a single worker so that its connections and
+    # table metadata stay warm between cycles.  Shared connections need
+    # every table of a jobconfig job on the same worker.
+    def group(jobName):
+        return runJobs[jobName]['job'] if config.shareConnections else jobName
+
+    groups = {g: i for i, g in
+              enumerate(dict.fromkeys(group(job) for job in runQueue))}
+    workers = [startWorker(i, commons, runJobs)
+               for i in range(min(config.proc, len(groups)))]
+    owners = {jobName: groups[group(jobName)] % len(workers)
+              for jobName in runQueue}
+
+    settings = {jobName: {'priority': runJobs[jobName]['priority'],
+                          'sla': runJobs[jobName]['sla']}
+                for jobName in runQueue}
+    sched = Scheduler(runQueue, config.idleMin, config.idleMax, settings,
+                      config.maxWait)
+    running = set()
+
+    # nodes sharing a lease file split the jobs, this one only runs the
+    # jobs it holds a lease on
+    leases = None
+    held = set(runQueue)
+    if config.leases:
+        leases = Leases(config.leases, config.node, config.leaseSeconds)
+        rLog.debug(f'leases: {config.leases} as {leases.node}'
+                   f' ({config.leaseSeconds}s)')
 
-    while len(dfProcs) > 0:
-        for dfProc in dfProcs:
-            if dfProc.is_alive() is False:
-                dfProcs.remove(dfProc)
-                runQueue.append(dfProc.name)
-                jobProc = nextProc(runQueue, runJobs, commons)
-                jobProc.start()
-                dfProcs.append(jobProc)
-
-            time.sleep(5)  # pause before double-checking
+    try:
+        while workers:
+            if leases is not None:
+                previous = held
+                held = leases.held(runQueue, running)
+                if held != previous:
+                    rLog.info(f'{leases.node} holds {len(held)} of'
+                              f' {len(runQueue)} jobs.')
+
+            # a worker gets one job at a time so the scheduler can pick the
+            # most urgent one when it is free.  Due jobs are promoted on
+            # every pass, so with every worker busy the wait below blocks
+            # on the workers rather than on jobs that are already due.
+            sched.promote()
+            for i, worker in enumerate(workers):
+                if worker['job'] is None:
+                    jobName = sched.next(
+                        lambda job: owners[job] == i and job in held)
+                    if jobName is not None:
+                        worker['conn'].send(jobName)
+                        worker['job'] = jobName
+                        running.add(jobName)
+
+            waitOn = {}
+            for i, worker in enumerate(workers):
+                waitOn[worker['conn']] = ('done', i)
+                waitOn[worker['proc'].sentinel] = ('died', i)
+
+            timeout = sched.timeout()
+            if leases is not None:
+                timeout = leases.due() if timeout is None \
+                    else min(timeout, leases.due())
+
+            for ready in mpc.wait(list(waitOn), timeout=timeout):
+                event, i = waitOn[ready]
+
+                if event == 'done':
+                    if ready is not workers[i]['conn']:
+                        continue  # the worker was restarted in this pass
+
+                    try:
+                        jobName, rowCount, backlog, stats = \
+                            workers[i]['conn'].recv()
+                    except EOFError:
+                        continue  # the sentinel reports the dead worker
+
+                    metrics.record(jobName, stats)
+                    running.discard(jobName)
+                    workers[i]['job'] = None
+                    sched.done(jobName, backlog, stats['lag'],
+                               failed=stats['errors'] > 0)
+
+                elif event == 'died':
+                    rLog.critical(f'worker-{i} exited unexpectedly,'
+                                  ' restarting.')
+                    workers[i]['conn'].close()
+                    workers[i] = startWorker(i, commons, runJobs)
+
+                    lost = [j for j in running if owners[j] == i]
+                    for jobName in lost:
+                        running.discard(jobName)
+                        sched.done(jobName, failed=True)
+    finally:
+        if leases is not None:
+            leases.close()
 
     logQ.put(None)
 
 
-# Logging objects for main process
-rLog = logging.getLogger('replicator')
-logQ = mp.Queue()
-
-
-if __name__ == '__main__':
-
-    if getattr(sys, 'frozen', False):
-        cur_dir = sys._MEIPASS
-        mp.freeze_support()
-    else:
-        cur_dir = path.dirname(path.abspath(__file__))
-
+def argParser():
     epilog = "All replicator arguments are optional and will" \
         " override the values in the config file."
 
@@ -169,15 +220,68 @@ if __name__ == '__main__':
                         help='<Optional> Size of batch to commit to target.',
                         required=False)
 
+    parser.add_argument('-q', '--depth', nargs='?',
+                        help='<Optional> Number of row sets to prefetch'
+                        ' from source while the target merges.'
+                        ' 0 disables prefetching.',
+                        required=False)
+
     parser.add_argument('-a', '--auto', action="store_true",
                         help='<Optional> Auto create target tables.',
                         required=False)
 
+    parser.add_argument('-f', '--fast', action="store_true",
+                        help='<Optional> Stage rows with fast_executemany.',
+                        required=False)
+
+    parser.add_argument('-r', '--drain', action="store_true",
+                        help='<Optional> Keep reading batches until each'
+                        ' source table is caught up.',
+                        required=False)
+
+    parser.add_argument('-v', '--verify', action="store_true",
+                        help='<Optional> Check checkpoints against the'
+                        ' target on startup.',
+                        required=False)
+
+    parser.add_argument('-i', '--initial', action="store_true",
+                        help='<Optional> Bulk load empty target tables'
+                        ' in parallel ranges.',
+                        required=False)
+
+    parser.add_argument('-n', '--plan', action="store_true",
+                        help='<Optional> Report the pending rows, bytes and'
+                        ' expected catch-up time of each job without'
+                        ' moving any data, and exit.',
+                        required=False)
+
+    parser.add_argument('-k', '--reconcile', action="store_true",
+                        help='<Optional> Compare each target with its source'
+                        ' by range checksums, repair the drifted rows and'
+                        ' exit.',
+                        required=False)
+
     parser.add_argument('-d', '--debug', action='store_true',
                         help='<Optional> Use debug logging level.',
                         required=False)
 
-    args = parser.parse_args()
+    return parser
+
+
+# Logging objects for main process
+rLog = logging.getLogger('replicator')
+logQ = mp.Queue()
+
+
+if __name__ == '__main__':
+
+    if getattr(sys, 'frozen', False):
+        cur_dir = sys._MEIPASS
+        mp.freeze_support()
+    else:
+        cur_dir = path.dirname(path.abspath(__file__))
+
+    args = argParser().parse_args()
 
     lf = path.join(cur_dir, 'config/logconfig.json')
 
@@ -205,4 +309,4 @@ if __name__ == '__main__':
         configF = json.load(f)
 
     print('Starting replicator jobs')
-    sys.exit(main(args, logQ, configF))
+    sys.exit(main(args, logQ, configF, cur_dir))
@@ -0,0 +1,111 @@
+import heapq
+import math
+import time
+
+
+class Scheduler:
+    """
+    Decides when each job runs next and which due job goes first.
+
+    A job that left a backlog behind (it moved a full batch) is due again
+    immediately.  A job that found nothing to do backs off, doubling its
+    delay from idleMin up to idleMax.  Failed jobs back off the same way.
+
+    Due jobs wait until their worker is free.  next() then hands out the
+    most urgent one: any job that has been waiting maxWait seconds first,
+    so nothing starves, then jobs that have not caught up within their
+    freshness sla, then the highest priority weight times log(1 + lag),
+    lag being the last sampled source max(rowver) minus the watermark.
+    """
+
+    def __init__(self, jobs, idleMin=1, idleMax=60, settings=None,
+                 maxWait=300):
+        now = time.monotonic()
+        self._idleMin = idleMin
+        self._idleMax = idleMax
+        self._maxWait = maxWait
+        self._settings = settings or {}
+        self._delay = {job: 0 for job in jobs}
+        self._lag = {job: None for job in jobs}
+        self._fresh = {job: now for job in jobs}
+        self._ready = {}
+        self._queue = [(now, i, job) for i, job in enumerate(jobs)]
+        self._seq = len(self._queue)
+        heapq.heapify(self._queue)
+
+    def delay(self, job):
+        return self._delay[job]
+
+    def lag(self, job):
+        return self._lag[job]
+
+    def done(self, job, backlog=False, lag=None, failed=False):
+        """Reschedules a job once it completes a cycle"""
+        if lag is not None:
+            self._lag[job] = lag
+        elif not backlog and not failed:
+            self._lag[job] = 0
+
+        if not backlog and not failed:
+            self._fresh[job] = time.monotonic()
+
+        if backlog:
+            delay = 0
+        elif self._delay[job] == 0:
+            delay = self._idleMin
+        else:
+            delay = min(self._delay[job] * 2, self._idleMax)
+
+        self._delay[job] = delay
+        self._seq += 1
+        heapq.heappush(self._queue, (time.monotonic() + delay,
+                                     self._seq, job))
+
+    def urgency(self, job, now):
+        """Sort key for a ready job, larger runs first"""
+        settings = self._settings.get(job, {})
+        waited = now - self._ready[job]
+        sla = settings.get('sla')
+        weight = settings.get('priority', 1)
+
+        return (
+            waited >= self._maxWait,
+            bool(sla) and now - self._fresh[job] >= sla,
+            weight * (1 + math.log1p(self._lag[job] or 0)),
+            waited,
+        )
+
+    def promote(self):
+        """Moves the jobs that came due to the ready set"""
+        now = time.monotonic()
+        while self._queue and self._queue[0][0] <= now:
+            due, _, job = heapq.heappop(self._queue)
+            self._ready[job] = due
+
+        return now
+
+    def next(self, eligible=None):
+        """
+        Pops the most urgent due job for which eligible(job) is true,
+        None if there is none.
+        """
+        now = self.promote()
+        jobs = [job for job in self._ready
+                if eligible is None or eligible(job)]
+        if not jobs:
+            return None
+
+        job = max(jobs, key=lambda job: self.urgency(job, now))
+        del self._ready[job]
+        return job
+
+    def timeout(self):
+        """
+        Seconds until the next job that is not due yet becomes due, None
+        if there is none.  Jobs already promoted only wait for a worker,
+        so the caller can block on its workers until one is free.
+        """
+        if not self._queue:
+            return None
+
+        return max(0, self._queue[0][0] - time.monotonic())
@@ -0,0 +1,52 @@
+class BatchSizer:
+    """
+    Rows per source page (batch) and per merge (commit) for one table.
+
+    Both start from the configured sizes, with commit capped by maxBytes
+    over the estimated row width, and then follow observed latency: after
+    each page and each merge the size is scaled towards what would take
+    seconds, by at most a factor of two.  A size only grows after a full
+    page or merge, a short one says nothing about what more rows would
+    cost.  Sizes stay within minRows .. maxRows.
+    """
+
+    def __init__(self, rowBytes, batch, commit, seconds=1.0,
+                 maxBytes=8 * 2 ** 20, minRows=100, maxRows=50000):
+        self._rowBytes = max(1, rowBytes)
+        self._seconds = seconds
+        self._maxBytes = maxBytes
+        self._minRows = minRows
+        self._maxRows = maxRows
+
+        self.commit = self.clamp(commit, self.commitLimit)
+        self.batch = max(self.commit, self.clamp(batch, maxRows))
+
+    @property
+    def commitLimit(self):
+        """Most rows a merge may hold under the byte budget"""
+        return self._maxBytes // self._rowBytes
+
+    def clamp(self, rows, limit):
+        return int(max(self._minRows, min(rows, limit, self._maxRows)))
+
+    def scale(self, size, rows, seconds):
+        """The size that would take self._seconds, given rows took seconds"""
+        if seconds <= 0 or not rows:
+            return size
+
+        target = rows * self._seconds / seconds
+        if target > size and rows < size:
+            return size
+
+        return max(size / 2, min(target, size * 2))
+
+    def paged(self, rows, seconds):
+        """Observes a source page of rows read in seconds"""
+        self.batch = max(self.commit, self.clamp(
+            self.scale(self.batch, rows, seconds), self._maxRows))
+
+    def merged(self, rows, seconds):
+        """Observes a merge of rows applied in seconds"""
+        self.commit = self.clamp(self.scale(self.commit, rows, seconds),
+                                 self.commitLimit)
+        self.batch = max(self.batch, self.commit)
@@ -0,0 +1,163 @@
+import mmap
+import os
+import pickle
+import struct
+import zlib
+
+
+class Spool:
+    """
+    Local buffer of fetched row sets for one job.
+
+    Row sets are appended to numbered segment files in directory, each
+    record holding a header (payload length, crc32, last rowver) and the
+    pickled columns and rows.  Segments are read back through mmap and
+    deleted once every record in them has been applied to the target.
+
+    The spool is only ever touched by the worker that owns the job.  A
+    record torn by a crash is cut off when the spool is reopened; the last
+    complete record tells the source where to resume.
+    """
+
+    header = struct.Struct('<II8s')
+
+    def __init__(self, directory, segmentBytes=64 * 2 ** 20):
+        self._dir = directory
+        self._segmentBytes = segmentBytes
+        self._segments = []
+        self._tail = None
+        self._rowver = None
+
+        os.makedirs(directory, exist_ok=True)
+        for name in sorted(os.listdir(directory)):
+            if name.endswith('.seg'):
+                self._load(os.path.join(directory, name))
+
+    @property
+    def rowver(self):
+        """Last rowver spooled, None if nothing was spooled yet"""
+        return self._rowver
+
+    @property
+    def size(self):
+        """Bytes held in segment files"""
+        return sum(size for _, size, _ in self._segments)
+
+    @property
+    def pending(self):
+        return any(size for _, size, _ in self._segments)
+
+    def _scan(self, path):
+        """Yields (end offset, rowver) of each complete record"""
+        size = os.path.getsize(path)
+        if not size:
+            return
+
+        with open(path, 'rb') as f, \
+                mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as m:
+            offset = 0
+            while offset + Spool.header.size <= size:
+                length, crc, rowver = Spool.header.unpack_from(m, offset)
+                start = offset + Spool.header.size
+                if start + length > size or \
+                        zlib.crc32(m[start:start + length]) != crc:
+                    return
+
+                offset = start + length
+                yield offset, rowver
+
+    def _load(self, path):
+        size, rowver = 0, None
+        for size, rowver in self._scan(path):
+            pass
+
+        if size != os.path.getsize(path):
+            with open(path, 'r+b') as f:
+                f.truncate(size)
+
+        if not size:
+            os.remove(path)
+            return
+
+        self._segments.append([path, size, rowver])
+        self._rowver = rowver
+
+    def _roll(self):
+        """Seals the tail segment and starts a new one"""
+        if self._tail is not None:
+            self._tail.close()
+
+        seq = 1
+        if self._segments:
+            name = os.path.basename(self._segments[-1][0])
+            seq = int(os.path.splitext(name)[0]) + 1
+
+        path = os.path.join(self._dir, f'{seq:012d}.seg')
+        self._tail = open(path, 'ab')
+        self._segments.append([path, 0, None])
+
+    def append(self, rowver, columns, rows):
+        """Spools a row set whose last row has rowver"""
+        payload = pickle.dumps((tuple(columns), [tuple(row) for row in rows]),
+                               protocol=pickle.HIGHEST_PROTOCOL)
+        record = Spool.header.pack(len(payload), zlib.crc32(payload),
+                                   bytes(rowver)) + payload
+
+        if self._tail is None or \
+                self._segments[-1][1] >= self._segmentBytes:
+            self._roll()
+
+        self._tail.write(record)
+        self._tail.flush()
+
+        segment = self._segments[-1]
+        segment[1] += len(record)
+        segment[2] = rowver
+        self._rowver = rowver
+
+    def records(self, after=None):
+        """Yields (rowver, columns, rows) for records past rowver after"""
+        for path, size, last in list(self._segments):
+            if not size or (after is not None and last <= after):
+                continue
+
+            with open(path, 'rb') as f, \
+                    mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as m:
+                offset = 0
+                while offset < size:
+                    length, crc, rowver = Spool.header.unpack_from(m, offset)
+                    start = offset + Spool.header.size
+                    offset = start + length
+                    if after is not None and rowver <= after:
+                        continue
+
+                    payload = m[start:offset]
+                    if zlib.crc32(payload) != crc:
+                        raise ValueError(f'corrupt spool record in {path}')
+
+                    columns, rows = pickle.loads(payload)
+                    yield rowver, list(columns), rows
+
+    def release(self, rowver):
+        """Deletes segments whose records are all applied up to rowver"""
+        while self._segments and self._segments[0][1] and \
+                self._segments[0][2] <= rowver:
+            if len(self._segments) == 1 and self._tail is not None:
+                self._tail.close()
+                self._tail = None
+
+            os.remove(self._segments.pop(0)[0])
+
+    def clear(self):
+        """Deletes every segment, the spool starts over empty"""
+        self.close()
+        for path, _, _ in self._segments:
+            os.remove(path)
+
+        self._segments = []
+        self._rowver = None
+
+    def close(self):
+        if self._tail is not None:
+            self._tail.close()
+            self._tail = None